@@ -55,8 +55,12 @@ NUTRITION_KEYS = [
 MAX_LIMIT = 1000
 DEFAULT_LIMIT = 200
 
-# /summary aggregates one day per query, so keep the range from fanning out.
-MAX_SUMMARY_DAYS = 92
+# Most items one POST .../batch request may log.
+MAX_BATCH = 500
+
+# /summary aggregates the whole range in two queries; this only bounds the
+# size of the response.
+MAX_SUMMARY_DAYS = 366 * 5
 
 # A bare local calendar day, as opposed to a full ISO datetime.
 PLAIN_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
@@ -75,10 +79,13 @@ class ApiError(Exception):
         self.status = status
         self.extra = extra
 
-    def to_response(self):
+    def to_dict(self):
         body = {'error': self.message}
         body.update(self.extra)
-        return jsonify(body), self.status
+        return body
+
+    def to_response(self):
+        return jsonify(self.to_dict()), self.status
 
 
 def _provided_key():
@@ -111,6 +118,8 @@ def require_key(fn):
             return fn(*args, **kwargs)
         except ApiError as e:
             return e.to_response()
+        except db.IdConflict as e:
+            return jsonify({'error': str(e)}), 409
         except Exception as e:  # noqa: BLE001 - surface the reason, don't leak a stack trace
             print(f"Agent API error in {fn.__name__}: {e}")
             return jsonify({'error': 'Server error', 'detail': str(e)}), 500
@@ -508,6 +517,9 @@ def agent_index():
             {'method': 'POST', 'path': '/api/agent/meals',
              'body': ['userId', 'foodName', 'mealType', 'nutrition', 'servingSize', 'servingUnit', 'brandName', 'when', 'tz'],
              'description': 'Log a meal.'},
+            {'method': 'POST', 'path': '/api/agent/meals/batch',
+             'body': ['userId', 'meals (array of POST /api/agent/meals bodies, at most %d)' % MAX_BATCH, 'tz'],
+             'description': 'Log many meals in one transaction, with a result per item.'},
             {'method': 'PATCH', 'path': '/api/agent/meals/<mealId>',
              'params': ['userId'], 'description': 'Update a logged meal.'},
             {'method': 'DELETE', 'path': '/api/agent/meals/<mealId>',
@@ -518,6 +530,9 @@ def agent_index():
             {'method': 'POST', 'path': '/api/agent/events',
              'body': ['userId', 'eventTypeId', 'data', 'when', 'notes', 'tz'],
              'description': 'Log an event. data is validated against the event type field schema.'},
+            {'method': 'POST', 'path': '/api/agent/events/batch',
+             'body': ['userId', 'events (array of POST /api/agent/events bodies, at most %d)' % MAX_BATCH, 'tz'],
+             'description': 'Log many events in one transaction, with a result per item.'},
             {'method': 'PATCH', 'path': '/api/agent/events/<eventId>',
              'params': ['userId'], 'description': 'Update a logged event.'},
             {'method': 'DELETE', 'path': '/api/agent/events/<eventId>',
@@ -633,12 +648,19 @@ def agent_summary():
             hint='Request a narrower range, or use /api/agent/events for raw rows.'
         )
 
+    daily_stats = db.get_daily_stats(
+        user_id,
+        day_bounds(first_day.isoformat(), tzinfo)[0],
+        day_bounds(last_day.isoformat(), tzinfo)[1],
+        tz_name
+    )
+
     days = []
     cursor = first_day
 
     while cursor <= last_day:
         day_start, day_end = day_bounds(cursor.isoformat(), tzinfo)
-        stats = db.get_todays_stats(user_id, day_start, day_end)
+        stats = daily_stats.get(cursor.isoformat(), {})
 
         totals = {}
         for stat_id, stat in stats.items():
@@ -695,13 +717,14 @@ def agent_get_meals():
     })
 
 
-@agent_api.route('/api/agent/meals', methods=['POST'])
-@require_key
-def agent_create_meal():
-    """Log a meal for an existing user."""
-    user_id = require_user()
-    tzinfo, tz_name = resolve_tz()
-    payload = json_body()
+def build_meal(payload, user_id, tzinfo, record_id=None):
+    """
+    The meal record a create payload describes. Raises ApiError if it is
+    invalid. record_id is the client's id for it (the app's own writes carry
+    one); a new id is generated otherwise.
+    """
+    if not isinstance(payload, dict):
+        raise ApiError('Each meal must be a JSON object', 400)
 
     food_name = (payload.get('foodName') or '').strip()
     if not food_name:
@@ -723,8 +746,8 @@ def agent_create_meal():
     except (TypeError, ValueError):
         raise ApiError(f"servingSize must be a number, got {payload.get('servingSize')!r}", 400)
 
-    meal = {
-        'id': f"meal-{now_ms()}-{uuid.uuid4().hex[:6]}",
+    return {
+        'id': record_id or f"meal-{now_ms()}-{uuid.uuid4().hex[:6]}",
         'userId': user_id,
         'foodName': food_name,
         'brandName': payload.get('brandName'),
@@ -735,6 +758,37 @@ def agent_create_meal():
         'timestamp': timestamp
     }
 
+
+def batch_items(payload, key):
+    """The non-empty list under payload[key], at most MAX_BATCH long."""
+    items = payload.get(key)
+    if not isinstance(items, list) or not items:
+        raise ApiError(f'{key} must be a non-empty array', 400)
+    if len(items) > MAX_BATCH:
+        raise ApiError(f'At most {MAX_BATCH} {key} per request', 400)
+    return items
+
+
+def batch_response(results, tz_name):
+    """Per-item results, 201 if every item was logged and 207 otherwise."""
+    failed = sum(1 for r in results if r['status'] == 'error')
+    return jsonify({
+        'success': failed == 0,
+        'timezone': tz_name,
+        'count': len(results) - failed,
+        'failed': failed,
+        'results': results
+    }), 201 if failed == 0 else 207
+
+
+@agent_api.route('/api/agent/meals', methods=['POST'])
+@require_key
+def agent_create_meal():
+    """Log a meal for an existing user."""
+    user_id = require_user()
+    tzinfo, tz_name = resolve_tz()
+    meal = build_meal(json_body(), user_id, tzinfo)
+
     db.add_meal(meal)
 
     return jsonify({
@@ -744,6 +798,35 @@ def agent_create_meal():
     }), 201
 
 
+@agent_api.route('/api/agent/meals/batch', methods=['POST'])
+@require_key
+def agent_create_meals():
+    """
+    Log many meals for one user in a single transaction. Each item takes the
+    fields POST /api/agent/meals does; invalid items are reported in their
+    result and the rest are still logged.
+    """
+    user_id = require_user()
+    tzinfo, tz_name = resolve_tz()
+    items = batch_items(json_body(), 'meals')
+
+    results = [None] * len(items)
+    meals = []
+    for index, payload in enumerate(items):
+        try:
+            meals.append((index, build_meal(payload, user_id, tzinfo)))
+        except ApiError as e:
+            results[index] = {'index': index, 'status': 'error', 'code': e.status, **e.to_dict()}
+
+    saved = db.add_meals([meal for _, meal in meals])
+    for (index, _), outcome in zip(meals, saved):
+        if 'meal' in outcome:
+            outcome['meal'] = with_local(outcome['meal'], tzinfo)
+        results[index] = {'index': index, **outcome}
+
+    return batch_response(results, tz_name)
+
+
 @agent_api.route('/api/agent/meals/<meal_id>', methods=['PATCH'])
 @require_key
 def agent_update_meal(meal_id):
@@ -847,16 +930,14 @@ def agent_get_events():
     })
 
 
-@agent_api.route('/api/agent/events', methods=['POST'])
-@require_key
-def agent_create_event():
+def build_event(payload, user_id, tzinfo, event_types=None, record_id=None):
     """
-    Log an event. The data payload is validated against the event type's field
-    schema, and the category comes from the resolved type rather than the caller.
+    The event record a create payload describes. Raises ApiError if it is
+    invalid. event_types, if given, caches resolved types across calls;
+    record_id is as for build_meal.
     """
-    user_id = require_user()
-    tzinfo, tz_name = resolve_tz()
-    payload = json_body()
+    if not isinstance(payload, dict):
+        raise ApiError('Each event must be a JSON object', 400)
 
     event_type_id = (payload.get('eventTypeId') or '').strip()
     if not event_type_id:
@@ -873,11 +954,21 @@ def agent_create_event():
             hint='Use POST /api/agent/meals instead.'
         )
 
-    event_type = resolve_event_type(event_type_id, user_id)
+    if event_types is None:
+        event_type = resolve_event_type(event_type_id, user_id)
+    else:
+        if event_type_id not in event_types:
+            try:
+                event_types[event_type_id] = resolve_event_type(event_type_id, user_id)
+            except ApiError as e:
+                event_types[event_type_id] = e
+        event_type = event_types[event_type_id]
+        if isinstance(event_type, ApiError):
+            raise event_type
     data = validate_event_data(event_type, payload.get('data') or {})
 
-    event = {
-        'id': f"evt_{uuid.uuid4().hex[:12]}",
+    return {
+        'id': record_id or f"evt_{uuid.uuid4().hex[:12]}",
         'userId': user_id,
         'eventTypeId': event_type_id,
         'timestamp': parse_when(payload.get('when', payload.get('timestamp')), tzinfo),
@@ -887,6 +978,18 @@ def agent_create_event():
         'notes': payload.get('notes', '')
     }
 
+
+@agent_api.route('/api/agent/events', methods=['POST'])
+@require_key
+def agent_create_event():
+    """
+    Log an event. The data payload is validated against the event type's field
+    schema, and the category comes from the resolved type rather than the caller.
+    """
+    user_id = require_user()
+    tzinfo, tz_name = resolve_tz()
+    event = build_event(json_body(), user_id, tzinfo)
+
     saved = db.log_event(event)
 
     return jsonify({
@@ -896,6 +999,35 @@ def agent_create_event():
     }), 201
 
 
+@agent_api.route('/api/agent/events/batch', methods=['POST'])
+@require_key
+def agent_create_events():
+    """
+    Log many events for one user in a single transaction, validated per item as
+    POST /api/agent/events does. Weigh-ins among them queue one weight refill.
+    """
+    user_id = require_user()
+    tzinfo, tz_name = resolve_tz()
+    items = batch_items(json_body(), 'events')
+
+    results = [None] * len(items)
+    events = []
+    event_types = {}
+    for index, payload in enumerate(items):
+        try:
+            events.append((index, build_event(payload, user_id, tzinfo, event_types)))
+        except ApiError as e:
+            results[index] = {'index': index, 'status': 'error', 'code': e.status, **e.to_dict()}
+
+    saved = db.log_events([event for _, event in events])
+    for (index, _), outcome in zip(events, saved):
+        if 'event' in outcome:
+            outcome['event'] = with_local(outcome['event'], tzinfo)
+        results[index] = {'index': index, **outcome}
+
+    return batch_response(results, tz_name)
+
+
 @agent_api.route('/api/agent/events/<event_id>', methods=['PATCH'])
 @require_key
 def agent_update_event(event_id):
@@ -1,10 +1,18 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, g
 from flask_cors import CORS
-import requests
+import base64
+import binascii
+import json
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from datetime import timezone
 from dotenv import load_dotenv
-import supabase_client
+import food_cache
+import fatsecret_client
+import jobs
+import singleflight
 
 load_dotenv()
 
@@ -12,13 +20,26 @@ app = Flask(__name__, static_folder='../frontend', static_url_path='')
 CORS(app)
 
 # Remote read/write API (/api/agent/*), key-protected. Routes live in agent_api.py.
-from agent_api import agent_api as agent_api_blueprint
+from agent_api import agent_api as agent_api_blueprint, ApiError, batch_items, build_event, build_meal
 app.register_blueprint(agent_api_blueprint)
 
 # USDA API Configuration
 USDA_API_KEY = os.getenv('USDA_API_KEY', 'DEMO_KEY')
 USDA_BASE_URL = 'https://api.nal.usda.gov/fdc/v1'
-FATSECRET_BASE_URL = 'https://fatsecret-proxy-production-e380.up.railway.app'
+
+# Identical FatSecret requests in flight at once share one proxy call
+_fatsecret_flights = singleflight.Group()
+
+# /api/search-food runs its independent lookups on this pool, and answers within
+# SEARCH_DEADLINE_S with whatever has finished
+SEARCH_DEADLINE_S = float(os.getenv('LIFESTATS_SEARCH_DEADLINE', '6'))
+_search_pool = ThreadPoolExecutor(max_workers=int(os.getenv('LIFESTATS_SEARCH_WORKERS', '8')),
+                                  thread_name_prefix='lifestats-search')
+
+# /api/food-details/batch fetches uncached foods from FatSecret this many at a time
+FOOD_DETAILS_BATCH_MAX = 100
+_details_pool = ThreadPoolExecutor(max_workers=int(os.getenv('LIFESTATS_FOOD_DETAILS_CONCURRENCY', '4')),
+                                   thread_name_prefix='lifestats-details')
 
 
 @app.route('/')
@@ -141,6 +162,180 @@ def normalize_food_data(food_id, food_name, brand_name, serving):
     }
 
 
+def fetch_fatsecret_search(query):
+    """
+    Search FatSecret and normalize the results, using cached details where we have them.
+    Returns {'foods': [...]}, or None if the API answered with an error.
+    """
+    # Call FatSecret Proxy
+    response = fatsecret_client.search(query)
+    
+    if response.status_code != 200:
+        print(f"FatSecret API Error: {response.status_code} - {response.text}")
+        return None
+    
+    data = response.json()
+    
+    # Parse FatSecret response
+    foods = []
+    fs_foods = data.get('foods', {}).get('food', [])
+    
+    # Handle case where single result is a dict, not list
+    if isinstance(fs_foods, dict):
+        fs_foods = [fs_foods]
+        
+    from food_cache import get_cached_foods
+    
+    # 1. Try Cache (Fastest): every result's details in one lookup
+    # cache returns the normalized dicts now, keyed by food_id
+    cached_foods = get_cached_foods([food.get('food_id') for food in fs_foods])
+    
+    for food in fs_foods:
+        food_id = food.get('food_id')
+
+        food_name = food.get('food_name', '')
+        brand_name = food.get('brand_name')
+
+        cached_food = cached_foods.get(str(food_id)) if food_id else None
+        
+        if cached_food:
+            foods.append(cached_food)
+            continue
+        
+        # 2. Skip Detailed API Fetch during search
+        # We rely on cache (already checked above) or fallback (below)
+        # This optimizes performance and API usage.
+
+
+        # 3. Fallback: Parse description from search result (Lowest Fidelity)
+        # This happens if API failed or returned no serving data
+        description = food.get('food_description', '')
+        nutrients = parse_fatsecret_food(description)
+        serving_text = description.split(' - ')[0].replace('Per ', '')
+        parsed_size, parsed_unit = parse_serving_size(serving_text)
+        
+        foods.append({
+            'fdcId': food_id,
+            'description': food_name,
+            'brandName': brand_name or 'Generic',
+            'servingSize': parsed_size,
+            'servingUnit': parsed_unit,
+            'preCalculated': True,
+            'calories': nutrients.get('calories', 0),
+            'protein': nutrients.get('protein', 0),
+            'carbs': nutrients.get('carbs', 0),
+            'fat': nutrients.get('fat', 0),
+            'cholesterol': None,
+            'sodium': None,
+            'fiber': None,
+            'sugar': None,
+            'saturatedFat': None,
+            'transFat': None,
+            'polyunsaturatedFat': None,
+            'monounsaturatedFat': None,
+            'addedSugar': None,
+            'vitaminD': None,
+            'calcium': None,
+            'iron': None,
+            'potassium': None,
+            'vitaminC': None
+        })
+    
+    return {'foods': foods}
+
+
+def search_fatsecret(query, normalized_query):
+    """
+    fetch_fatsecret_search for a search-cache miss, shared by identical searches in
+    flight and remembered for a short while when it fails or finds nothing.
+    Returns {'foods': [...]}, or None while the API is failing.
+    """
+    failure = food_cache.known_failure('search', normalized_query)
+    if failure is not None:
+        return {'foods': []} if failure == 'empty' else None
+
+    def fetch():
+        try:
+            result = fetch_fatsecret_search(query)
+        except fatsecret_client.CircuitOpen:
+            raise
+        except Exception:
+            food_cache.remember_failure('search', normalized_query, 'error', food_cache.NEGATIVE_ERROR_TTL_S)
+            raise
+        if result is None:
+            food_cache.remember_failure('search', normalized_query, 'error', food_cache.NEGATIVE_ERROR_TTL_S)
+        elif not result['foods']:
+            food_cache.remember_failure('search', normalized_query, 'empty', food_cache.NEGATIVE_EMPTY_TTL_S)
+        else:
+            food_cache.remember_results(normalized_query, result)
+            # Save to the persistent cache (API results only, to keep cache clean), after responding
+            try:
+                jobs.enqueue('cache_search_results', {'query': normalized_query, 'results': result})
+            except Exception as e:
+                print(f"Warning: Failed to queue cache write, writing now: {e}")
+                food_cache.cache_results(normalized_query, result)
+        return result
+
+    return _fatsecret_flights.do(('search', normalized_query), fetch)
+
+
+def fetch_fatsecret_food(food_id, cache=True):
+    """
+    Fetch one food's details from FatSecret, then normalize and (unless cache is
+    False, for callers that save several at once) cache them.
+    Returns (food, None), or (None, status) with FatSecret's error status, or 404
+    when it has no serving data for the food.
+    """
+    response = fatsecret_client.food(food_id)
+    
+    if response.status_code != 200:
+        return None, response.status_code
+        
+    data = response.json()
+    
+    # Normalize and Cache
+    raw_serving = data.get('food', {}).get('servings', {}).get('serving', {})
+    if isinstance(raw_serving, list):
+        raw_serving = raw_serving[0]
+        
+    if not raw_serving:
+        return None, 404
+
+    food_name = data.get('food', {}).get('food_name', '')
+    brand_name = data.get('food', {}).get('brand_name')
+    
+    normalized_food = normalize_food_data(food_id, food_name, brand_name, raw_serving)
+    if cache:
+        food_cache.cache_food(food_id, normalized_food, source='fatsecret')
+    return normalized_food, None
+
+
+def fatsecret_food(food_id, cache=True):
+    """
+    fetch_fatsecret_food shared by identical requests in flight, with failures
+    remembered for a short while. Returns (food, None) or (None, status).
+    """
+    failure = food_cache.known_failure('food', food_id)
+    if failure is not None:
+        return None, failure
+
+    def fetch():
+        try:
+            food, status = fetch_fatsecret_food(food_id, cache)
+        except fatsecret_client.CircuitOpen:
+            raise
+        except Exception:
+            food_cache.remember_failure('food', food_id, 500, food_cache.NEGATIVE_ERROR_TTL_S)
+            raise
+        if status == 404:
+            food_cache.remember_failure('food', food_id, status, food_cache.NEGATIVE_EMPTY_TTL_S)
+        elif status is not None:
+            food_cache.remember_failure('food', food_id, status, food_cache.NEGATIVE_ERROR_TTL_S)
+        return food, status
+
+    return _fatsecret_flights.do(('food', food_id), fetch)
+
+
 @app.route('/api/search-food', methods=['GET'])
 def search_food():
     """Search USDA FoodData Central database"""
@@ -151,143 +346,96 @@ def search_food():
 
     # Check Cache
     normalized_query = query.lower().strip()
-
-    # 0. Search Local DB (food_cache) for Custom Foods & Cached Items
-    # This ensures custom foods appear first
-    from supabase_client import search_food_in_db
-    local_results = search_food_in_db(normalized_query)
-
-    # 0b. Search the user's own recent food log (most recent match wins per name, capped at 3)
     user_id = request.args.get('userId')
-    recent_matches = []
-    if user_id:
-        from db import get_recent_meal_matches
-        recent_matches = get_recent_meal_matches(user_id, normalized_query, limit=3)
-    recent_names = {f['description'].strip().lower() for f in recent_matches}
-
-    def prepend_recent(other_foods):
-        # Recent log matches first, then everything else with duplicate names removed
-        deduped = [f for f in other_foods if f.get('description', '').strip().lower() not in recent_names]
-        return recent_matches + deduped
-
-    # 1. Check Search Cache (FatSecret Results)
-    cached_data = supabase_client.get_cached_results(normalized_query)
-
     # Check if local_only request (Optimization for instant results)
     local_only = request.args.get('local_only', 'false').lower() == 'true'
 
-    if local_only:
-        # For instant search, just return what we have locally + cached
-        # No need to merge complex logic, just dump what we have quickly
-        if cached_data:
-             local_ids = {f['fdcId'] for f in local_results}
-             filtered_cache = [f for f in cached_data.get('foods', []) if f.get('fdcId') not in local_ids]
-             return jsonify({'foods': prepend_recent(local_results + filtered_cache)})
-        return jsonify({'foods': prepend_recent(local_results)})
-
-    if cached_data:
-        print(f"Cache hit for: {normalized_query}")
-        # Merge: Local First + Cached Search Results
-        # deduplicate by ID if needed, but simplistic merge is often okay for now
-        # We filter out local results from cached_data if they are duplicates
-        local_ids = {f['fdcId'] for f in local_results}
-        filtered_cache = [f for f in cached_data.get('foods', []) if f.get('fdcId') not in local_ids]
-
-        return jsonify({'foods': prepend_recent(local_results + filtered_cache)})
-    
-    try:
-        print(f"Cache miss for: {normalized_query}. Calling FatSecret API...")
-        # Call FatSecret Proxy
-        response = requests.get(
-            f'{FATSECRET_BASE_URL}/search',
-            params={'query': query},
-            timeout=5
-        )
-        
-        if response.status_code != 200:
-            print(f"FatSecret API Error: {response.status_code} - {response.text}")
-            return jsonify({'error': 'Nutrition API error'}), 500
-        
-        data = response.json()
-        
-        # Parse FatSecret response
-        foods = []
-        fs_foods = data.get('foods', {}).get('food', [])
-        
-        # Handle case where single result is a dict, not list
-        if isinstance(fs_foods, dict):
-            fs_foods = [fs_foods]
-            
-        from supabase_client import get_cached_food, cache_food
-        
-        for food in fs_foods:
-            food_id = food.get('food_id')
-
-            food_name = food.get('food_name', '')
-            brand_name = food.get('brand_name')
-
-            # 1. Try Cache (Fastest)
-            # cache returns the normalized dict now
-            cached_food = get_cached_food(food_id) if food_id else None
-            
-            if cached_food:
-                foods.append(cached_food)
-                continue
-            
-            # 2. Skip Detailed API Fetch during search
-            # We rely on cache (already checked above) or fallback (below)
-            # This optimizes performance and API usage.
+    started = time.perf_counter()
+    deadline = time.monotonic() + SEARCH_DEADLINE_S
+    timings = {}
+    outcome = 'error'
+
+    def stage(name, fn, *args):
+        def run():
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                timings[name] = (time.perf_counter() - start) * 1000
+        return _search_pool.submit(run)
+
+    def result_of(name, future, default):
+        if future is None:
+            return default
+        try:
+            return future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeout:
+            print(f"search-food: {name} missed the {SEARCH_DEADLINE_S}s deadline for {normalized_query!r}")
+        except Exception as e:
+            print(f"search-food: {name} failed for {normalized_query!r}: {e}")
+        return default
+
+    # These don't depend on each other, so they run at once:
+    # 0. Search Local DB (food_cache) for Custom Foods & Cached Items
+    # 0b. Search the user's own recent food log (most recent match wins per name, capped at 3)
+    # 1. Check Search Cache (FatSecret Results): memory first, then the persistent tier
+    from food_cache import search_food_in_db
+    from db import get_recent_meal_matches
+    local_future = stage('local', search_food_in_db, normalized_query)
+    recent_future = stage('recent', get_recent_meal_matches, user_id, normalized_query, 3) if user_id else None
+    cache_future = stage('cache', food_cache.get_search_results, normalized_query)
 
+    try:
+        cached_data, stale = result_of('cache', cache_future, (None, False))
+        if stale:
+            # Answer with what we have; FatSecret is re-queried in the background
+            food_cache.refresh_search_results(normalized_query, lambda: fetch_fatsecret_search(query))
+
+        # 2. On a cache miss, FatSecret starts as soon as we know, alongside the rest
+        api_future = None
+        if not cached_data and not local_only:
+            print(f"Cache miss for: {normalized_query}. Calling FatSecret API...")
+            api_future = stage('fatsecret', search_fatsecret, query, normalized_query)
+
+        local_results = result_of('local', local_future, [])
+        recent_matches = result_of('recent', recent_future, [])
+        recent_names = {f['description'].strip().lower() for f in recent_matches}
+
+        def merged(other_foods):
+            # Recent log matches first, then local, then cached or API results,
+            # dropping cached/API duplicates of local foods and anything named like a recent match
+            local_ids = {f['fdcId'] for f in local_results}
+            foods = local_results + [f for f in other_foods if f.get('fdcId') not in local_ids]
+            deduped = [f for f in foods if f.get('description', '').strip().lower() not in recent_names]
+            return jsonify({'foods': recent_matches + deduped})
+
+        if api_future is None:
+            # For instant search (local_only), or a cache hit, answer with what we have
+            if cached_data:
+                outcome = 'cache hit'
+                return merged(cached_data.get('foods', []))
+            outcome = 'local only'
+            return merged([])
 
-            # 3. Fallback: Parse description from search result (Lowest Fidelity)
-            # This happens if API failed or returned no serving data
-            description = food.get('food_description', '')
-            nutrients = parse_fatsecret_food(description)
-            serving_text = description.split(' - ')[0].replace('Per ', '')
-            parsed_size, parsed_unit = parse_serving_size(serving_text)
-            
-            foods.append({
-                'fdcId': food_id,
-                'description': food_name,
-                'brandName': brand_name or 'Generic',
-                'servingSize': parsed_size,
-                'servingUnit': parsed_unit,
-                'preCalculated': True,
-                'calories': nutrients.get('calories', 0),
-                'protein': nutrients.get('protein', 0),
-                'carbs': nutrients.get('carbs', 0),
-                'fat': nutrients.get('fat', 0),
-                'cholesterol': None,
-                'sodium': None,
-                'fiber': None,
-                'sugar': None,
-                'saturatedFat': None,
-                'transFat': None,
-                'polyunsaturatedFat': None,
-                'monounsaturatedFat': None,
-                'addedSugar': None,
-                'vitaminD': None,
-                'calcium': None,
-                'iron': None,
-                'potassium': None,
-                'vitaminC': None
-            })
-        
-        result = {'foods': foods}
-        
-        # Save to Cache (API results only, to keep cache clean)
-        supabase_client.cache_results(normalized_query, result)
-        
-        # Merge Local Results for Response
-        # We perform the same merge logic as the cache-hit case
-        local_ids = {f['fdcId'] for f in local_results}
-        filtered_api_foods = [f for f in foods if f.get('fdcId') not in local_ids]
+        try:
+            result = api_future.result(timeout=max(0, deadline - time.monotonic()))
+        except (fatsecret_client.CircuitOpen, FutureTimeout) as e:
+            # The proxy is down or too slow: answer with what we have now instead of waiting on it
+            print(f"FatSecret unavailable ({type(e).__name__}), returning local results for: {normalized_query}")
+            outcome = 'api unavailable'
+            return merged([])
+        if result is None:
+            return jsonify({'error': 'Nutrition API error'}), 500
+        outcome = 'api'
+        return merged(result['foods'])
 
-        return jsonify({'foods': prepend_recent(local_results + filtered_api_foods)})
-    
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
+    finally:
+        stages = ', '.join(f"{name} {ms:.1f}ms" for name, ms in sorted(timings.items(), key=lambda t: t[1]))
+        print(f"search-food {normalized_query!r} ({outcome}): {stages}; "
+              f"total {(time.perf_counter() - started) * 1000:.1f}ms")
 
 @app.route('/api/get-food-details', methods=['GET'])
 def get_food_details():
@@ -297,44 +445,75 @@ def get_food_details():
         return jsonify({'error': 'food_id required'}), 400
         
     try:
-        from supabase_client import get_cached_food, cache_food
+        from food_cache import get_cached_food
         
         # 1. Check Cache
         cached_food = get_cached_food(food_id)
         if cached_food:
             return jsonify(cached_food)
             
-        # 2. Fetch from API
-        response = requests.get(
-            f'{FATSECRET_BASE_URL}/food',
-            params={'food_id': food_id},
-            timeout=5
-        )
-        
-        if response.status_code != 200:
-            return jsonify({'error': 'Failed to fetch details'}), response.status_code
-            
-        data = response.json()
-        
-        # 3. Normalize and Cache
-        raw_serving = data.get('food', {}).get('servings', {}).get('serving', {})
-        if isinstance(raw_serving, list):
-            raw_serving = raw_serving[0]
-            
-        if raw_serving:
-            food_name = data.get('food', {}).get('food_name', '')
-            brand_name = data.get('food', {}).get('brand_name')
-            
-            normalized_food = normalize_food_data(food_id, food_name, brand_name, raw_serving)
-            cache_food(food_id, normalized_food, source='fatsecret')
-            return jsonify(normalized_food)
-            
-        return jsonify({'error': 'No serving data found'}), 404
+        # 2. Fetch from API (normalized and cached there)
+        food, status = fatsecret_food(food_id)
+        if food:
+            return jsonify(food)
+        if status == 404:
+            return jsonify({'error': 'No serving data found'}), 404
+        return jsonify({'error': 'Failed to fetch details'}), status
         
+    except fatsecret_client.CircuitOpen:
+        return jsonify({'error': 'Nutrition API unavailable'}), 503
     except Exception as e:
         print(f"Error fetching details for {food_id}: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/food-details/batch', methods=['POST'])
+def get_food_details_batch():
+    """
+    Fetch detailed food data for several foods at once: cached ones in one
+    lookup, the rest from FatSecret in parallel, then cached together.
+    Returns {'foods': {id: food}, 'errors': {id: {'error', 'status'}}}.
+    """
+    data = request.json or {}
+    food_ids = data.get('food_ids')
+    if not isinstance(food_ids, list) or not food_ids:
+        return jsonify({'error': 'food_ids must be a non-empty list'}), 400
+    food_ids = list(dict.fromkeys(str(food_id) for food_id in food_ids if food_id))
+    if len(food_ids) > FOOD_DETAILS_BATCH_MAX:
+        return jsonify({'error': f'At most {FOOD_DETAILS_BATCH_MAX} food_ids per request'}), 400
+
+    try:
+        foods = food_cache.get_cached_foods(food_ids)
+        missing = [food_id for food_id in food_ids if food_id not in foods]
+        errors = {}
+        fetched = {}
+
+        futures = {_details_pool.submit(fatsecret_food, food_id, False): food_id for food_id in missing}
+        for future in as_completed(futures):
+            food_id = futures[future]
+            try:
+                food, status = future.result()
+            except fatsecret_client.CircuitOpen:
+                errors[food_id] = {'error': 'Nutrition API unavailable', 'status': 503}
+                continue
+            except Exception as e:
+                print(f"Error fetching details for {food_id}: {e}")
+                errors[food_id] = {'error': str(e), 'status': 500}
+                continue
+            if food:
+                fetched[food_id] = food
+            elif status == 404:
+                errors[food_id] = {'error': 'No serving data found', 'status': 404}
+            else:
+                errors[food_id] = {'error': 'Failed to fetch details', 'status': status}
+
+        food_cache.cache_foods(fetched, source='fatsecret')
+        foods.update(fetched)
+        return jsonify({'foods': foods, 'errors': errors})
+
+    except Exception as e:
+        print(f"Error fetching details for {len(food_ids)} foods: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/add-custom-food', methods=['POST'])
 def add_custom_food_route():
     """Create a new custom food."""
@@ -349,7 +528,7 @@ def add_custom_food_route():
             return jsonify({'error': f'Missing required field: {field}'}), 400
             
     try:
-        from supabase_client import add_custom_food
+        from food_cache import add_custom_food
         
         result = add_custom_food(data)
         if result:
@@ -369,7 +548,7 @@ def list_custom_foods_route():
         return jsonify({'error': 'userId required'}), 400
 
     try:
-        from supabase_client import list_custom_foods
+        from food_cache import list_custom_foods
         return jsonify(list_custom_foods(user_id))
     except Exception as e:
         print(f"Error listing custom foods: {e}")
@@ -388,7 +567,7 @@ def update_custom_food_route(food_id):
             return jsonify({'error': f'Missing required field: {field}'}), 400
 
     try:
-        from supabase_client import update_custom_food
+        from food_cache import update_custom_food
         result = update_custom_food(food_id, data['userId'], data)
         if result:
             return jsonify(result)
@@ -406,7 +585,7 @@ def delete_custom_food_route(food_id):
         return jsonify({'error': 'userId required'}), 400
 
     try:
-        from supabase_client import delete_custom_food
+        from food_cache import delete_custom_food
         deleted = delete_custom_food(food_id, user_id)
         if deleted:
             return jsonify({'success': True})
@@ -416,19 +595,66 @@ def delete_custom_food_route(food_id):
         print(f"Error deleting custom food: {e}")
         return jsonify({'error': str(e)}), 500
 
-from db import init_db, get_user_meals, add_meal, delete_meal, update_meal, get_db_connection
+from db import init_db, IdConflict, get_user_meals, get_meals_page, add_meal, delete_meal, update_meal, db_connection, begin_request_scope, end_request_scope, pool_stats
 # Initialize DB on startup (safely fails if no URL)
 init_db()
 
+@app.before_request
+def open_request_scope():
+    """Every db call made while handling this request shares one pooled connection."""
+    begin_request_scope()
+    g.db_scope_open = True
+
+@app.teardown_request
+def close_request_scope(exc):
+    if g.pop('db_scope_open', False):
+        end_request_scope()
+
+# Page sizes for GET /api/meals with a window or cursor
+MEALS_PAGE_DEFAULT = 100
+MEALS_PAGE_MAX = 500
+
+def encode_meal_cursor(key):
+    """An opaque nextCursor token for a (timestamp, id) keyset position."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_meal_cursor(token):
+    """The (timestamp, id) behind a nextCursor token. Raises ValueError if it isn't one."""
+    try:
+        timestamp, meal_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return int(timestamp), str(meal_id)
+    except (TypeError, binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+
 @app.route('/api/meals', methods=['GET'])
 def get_meals_route():
     user_id = request.args.get('userId')
     if not user_id:
         return jsonify({'error': 'userId required'}), 400
     
+    # Without a window, cursor or limit: the full history as one array, as before
+    if not any(request.args.get(arg) for arg in ('start', 'end', 'cursor', 'limit')):
+        try:
+            meals = get_user_meals(user_id)
+            return jsonify(meals)
+        except Exception as e:
+            print(f"DB Error: {e}")
+            return jsonify({'error': 'Database error'}), 500
+
+    # Otherwise one page of the [start, end) window, newest first
     try:
-        meals = get_user_meals(user_id)
-        return jsonify(meals)
+        start = int(request.args['start']) if request.args.get('start') else None
+        end = int(request.args['end']) if request.args.get('end') else None
+        limit = min(int(request.args.get('limit') or MEALS_PAGE_DEFAULT), MEALS_PAGE_MAX)
+        after = decode_meal_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'start, end and limit must be integers, cursor a nextCursor value'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    try:
+        meals, next_key = get_meals_page(user_id, start, end, after, limit)
+        return jsonify({'meals': meals, 'nextCursor': encode_meal_cursor(next_key) if next_key else None})
     except Exception as e:
         print(f"DB Error: {e}")
         return jsonify({'error': 'Database error'}), 500
@@ -442,9 +668,67 @@ def save_meal_route():
     try:
         saved_meal = add_meal(data)
         return jsonify(saved_meal)
+    except IdConflict as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        print(f"DB Error: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
+def batch_records(data, key, build):
+    """
+    Validate data[key] (a POST .../batch body) item by item with build(item,
+    user_id, record_id), one of agent_api's builders: the app's items only add
+    the client's id and an epoch-ms timestamp. Returns ([(index, record)],
+    results), with an error result already in place for each invalid item.
+    Raises ApiError if the body itself is invalid.
+    """
+    if not data or not data.get('userId'):
+        raise ApiError('userId required', 400)
+    items = batch_items(data, key)
+
+    user_id = data['userId']
+    results = [None] * len(items)
+    records = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ApiError('Each item must be a JSON object', 400)
+            if not item.get('id') or not isinstance(item['id'], str):
+                raise ApiError('id required', 400)
+            if isinstance(item.get('timestamp'), bool) or not isinstance(item.get('timestamp'), int):
+                raise ApiError('timestamp (epoch ms) required', 400)
+            records.append((index, build(item, user_id, item['id'])))
+        except ApiError as e:
+            results[index] = {'index': index, 'status': 'error', 'code': e.status, **e.to_dict()}
+    return records, results
+
+def batch_result(records, saved, results):
+    """Fill results in from a db batch write: 201 if every item saved, else 207."""
+    for (index, _), outcome in zip(records, saved):
+        results[index] = {'index': index, **outcome}
+    failed = sum(1 for r in results if r['status'] == 'error')
+    return jsonify({'results': results, 'count': len(results) - failed, 'failed': failed}), 201 if failed == 0 else 207
+
+@app.route('/api/meals/batch', methods=['POST'])
+def save_meals_route():
+    """
+    Log many meals (`{"userId", "meals": [...]}`, each as POST /api/meals takes
+    it) in one transaction. Each gets a result: created, replayed (its id was
+    already logged) or error; invalid items don't stop the rest.
+    """
+    try:
+        records, results = batch_records(request.get_json(silent=True), 'meals',
+                                         lambda item, user_id, record_id: build_meal(item, user_id, timezone.utc, record_id))
+    except ApiError as e:
+        return e.to_response()
+
+    try:
+        from db import add_meals
+        saved = add_meals([meal for _, meal in records])
     except Exception as e:
         print(f"DB Error: {e}")
         return jsonify({'error': 'Database error'}), 500
+    return batch_result(records, saved, results)
 
 @app.route('/api/meals/<meal_id>', methods=['DELETE'])
 def delete_meal_route(meal_id):
@@ -482,6 +766,53 @@ def update_meal_route(meal_id):
         print(f"DB Error: {e}")
         return jsonify({'error': 'Database error'}), 500
 
+# Most changes GET /api/sync returns per table in one response
+SYNC_PAGE_MAX = 1000
+
+def encode_sync_position(position):
+    """The `next` token for a (change_xid, change_seq) sync position."""
+    return f"{position[0]}-{position[1]}"
+
+def decode_sync_position(token):
+    """
+    The (change_xid, change_seq) behind a `next` token. A bare integer is a
+    change_seq handed out before positions carried an xid. Raises ValueError.
+    """
+    match = re.fullmatch(r'(?:(\d+)-)?(\d+)', token)
+    if not match:
+        raise ValueError(f"Invalid sync position: {token}")
+    return int(match.group(1) or 0), int(match.group(2))
+
+@app.route('/api/sync', methods=['GET'])
+def sync_route():
+    """
+    Meals, events, event types, goals, categories and favorites changed since
+    the client's last sync (`since`, the `next` it was given; 0 for everything),
+    plus the ids deleted since. See db.get_changes.
+    """
+    user_id = request.args.get('userId')
+    if not user_id:
+        return jsonify({'error': 'userId required'}), 400
+    try:
+        since = decode_sync_position(request.args.get('since') or '0')
+        limit = min(int(request.args.get('limit') or SYNC_PAGE_MAX), SYNC_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'since must be a next value (or 0), limit an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    try:
+        from db import get_changes, SyncExpired
+        changes = get_changes(user_id, since, limit)
+        changes['next'] = encode_sync_position(changes['next'])
+        return jsonify(dict(changes, since=encode_sync_position(since)))
+    except SyncExpired as e:
+        # Deletions since then were pruned: the client must start over from 0
+        return jsonify({'error': str(e), 'resync': True}), 410
+    except Exception as e:
+        print(f"DB Error: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint with DB diagnostics"""
@@ -497,13 +828,12 @@ def health():
 
     # Check DB Connection
     try:
-        conn = get_db_connection()
-        # Simple query to ensure table exists
-        cur = conn.cursor()
-        cur.execute("SELECT count(*) FROM meals")
-        count = cur.fetchone()['count']
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            # Simple query to ensure table exists
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM meals")
+            count = cur.fetchone()['count']
+            cur.close()
         db_status = "connected"
         db_details = f"Table 'meals' exists with {count} rows"
     except Exception as e:
@@ -516,11 +846,27 @@ def health():
         'database': {
             'status': db_status,
             'error': db_error,
-            'details': db_details
+            'details': db_details,
+            'pool': pool_stats()
         },
         'environment': env_vars
     })
 
+@app.route('/api/jobs/status', methods=['GET'])
+def jobs_status():
+    """Background job queue depth and latency."""
+    try:
+        return jsonify(jobs.queue_status())
+    except Exception as e:
+        print(f"Error reading job status: {e}")
+        return jsonify({'error': 'Database error'}), 500
+
+@app.route('/api/search-cache/status', methods=['GET'])
+def search_cache_status():
+    """Search cache hit, miss and stale counters, and FatSecret proxy calls, for this process."""
+    return jsonify(dict(food_cache.search_cache_stats(), fatsecret_calls=_fatsecret_flights.stats(),
+                        fatsecret_client=fatsecret_client.stats()))
+
 
 # ============================================================================
 # INTEGRATION API ROUTES
@@ -809,10 +1155,34 @@ def log_event_route():
         from db import log_event
         event = log_event(data)
         return jsonify(event), 201
+    except IdConflict as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         print(f"Error logging event: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/events/batch', methods=['POST'])
+def log_events_route():
+    """
+    Log many events (`{"userId", "events": [...]}`) in one transaction, like
+    POST /api/meals/batch. Weigh-ins among them queue a single weight refill.
+    """
+    event_types = {}
+    try:
+        records, results = batch_records(request.get_json(silent=True), 'events',
+                                         lambda item, user_id, record_id: build_event(item, user_id, timezone.utc,
+                                                                                      event_types, record_id))
+    except ApiError as e:
+        return e.to_response()
+
+    try:
+        from db import log_events
+        saved = log_events([event for _, event in records])
+    except Exception as e:
+        print(f"Error logging events: {e}")
+        return jsonify({'error': str(e)}), 500
+    return batch_result(records, saved, results)
+
 @app.route('/api/events', methods=['GET'])
 def get_events_route():
     """Get events with optional filtering."""
@@ -1068,7 +1438,7 @@ def get_todays_stats_route():
 @app.route('/api/chart-data', methods=['GET'])
 def get_chart_data_route():
     """
-    Get chart data for multiple event types, aggregated by day.
+    Get chart data for multiple event types, aggregated by hour, day, week, month or year.
     
     Query params:
         userId: Required
@@ -1076,6 +1446,10 @@ def get_chart_data_route():
         startDate: Start timestamp in milliseconds
         endDate: End timestamp in milliseconds
         aggregations: Optional JSON object of {eventTypeId: aggregationType} overrides
+        granularity: Optional 'day' (default), 'hour', 'week', 'month' or 'year'
+        tz: Optional IANA timezone of the client (lets daily charts use rollups)
+        maxPoints: Optional cap on the number of points per series (at least 3);
+            longer charts are downsampled, keeping peaks and troughs
     """
     user_id = request.args.get('userId')
     
@@ -1125,8 +1499,19 @@ def get_chart_data_route():
     
     # Granularity
     granularity = request.args.get('granularity', 'day')
-    if granularity not in ['day', 'hour']:
-        return jsonify({'error': "granularity must be 'day' or 'hour'"}), 400
+    if granularity not in ['day', 'hour', 'week', 'month', 'year']:
+        return jsonify({'error': "granularity must be 'day', 'hour', 'week', 'month' or 'year'"}), 400
+    
+    # Optional downsampling cap
+    max_points = None
+    max_points_str = request.args.get('maxPoints')
+    if max_points_str:
+        try:
+            max_points = int(max_points_str)
+        except ValueError:
+            max_points = 0
+        if max_points < 3:
+            return jsonify({'error': 'maxPoints must be an integer of at least 3'}), 400
     
     # Timezone Offset (minutes)
     try:
@@ -1144,7 +1529,9 @@ def get_chart_data_route():
             aggregation_overrides,
             field_overrides,
             granularity,
-            timezone_offset
+            timezone_offset,
+            request.args.get('tz'),
+            max_points
         )
         return jsonify(chart_data)
     except Exception as e:
@@ -1164,6 +1551,7 @@ def get_maintenance_calories_route():
         startDate: Start timestamp in milliseconds
         endDate: End timestamp in milliseconds
         timezoneOffset: Optional minutes offset from UTC (JS getTimezoneOffset() convention)
+        tz: Optional IANA timezone of the client (lets the estimate use rollups)
     """
     user_id = request.args.get('userId')
     if not user_id:
@@ -1183,7 +1571,8 @@ def get_maintenance_calories_route():
 
     try:
         from db import get_maintenance_calories
-        result = get_maintenance_calories(user_id, start_date_int, end_date_int, timezone_offset)
+        result = get_maintenance_calories(user_id, start_date_int, end_date_int, timezone_offset,
+                                          request.args.get('tz'))
         return jsonify(result)
     except Exception as e:
         print(f"Error computing maintenance calories: {e}")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Compare search latency of the two food cache backends (see food_cache.py).
+
+Types a query one keystroke at a time and, for each, times what /api/search-food
+asks the cache for on every keystroke:
+
+  - search_food_in_db()    custom and previously cached foods
+  - get_cached_results()   the cached FatSecret results for the query
+  - get_cached_food()      one cached food's details
+
+against pg_food_cache (SQL on the pooled connection) and supabase_client (the
+Supabase REST API), and then the three together as the search box sees them.
+Both backends are read only; for a like-for-like comparison the Postgres tables
+should hold the same rows, which --copy does first (upserting every Supabase
+food_cache and search_cache row into Postgres; also the way to move an existing
+deployment over to LIFESTATS_FOOD_CACHE=postgres).
+
+Usage: python bench_food_cache.py [--query chicken] [--repeat 20] [--copy]
+"""
+
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from psycopg2.extras import Json, execute_values
+
+import db
+import pg_food_cache
+import supabase_client
+
+BACKENDS = [('postgres', pg_food_cache), ('supabase', supabase_client)]
+PAGE_SIZE = 1000
+
+
+def keystrokes(query):
+    # The search box ignores queries under two characters
+    return [query[:i] for i in range(2, len(query) + 1)]
+
+
+def supabase_pages(table):
+    start = 0
+    while True:
+        rows = supabase_client.supabase.table(table).select("*").range(start, start + PAGE_SIZE - 1).execute().data
+        if not rows:
+            return
+        yield rows
+        start += PAGE_SIZE
+
+
+def copy_from_supabase():
+    """Upsert every Supabase food_cache and search_cache row into Postgres. Returns row counts."""
+    food_columns = ['food_id', 'source', 'brand', 'food_name', 'serving_size', 'serving_unit', 'food_data']
+    food_columns += [column for column, _ in pg_food_cache.FOOD_COLUMNS]
+    counts = {'food_cache': 0, 'search_cache': 0}
+
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        for rows in supabase_pages('food_cache'):
+            execute_values(cur, f"""
+                INSERT INTO food_cache ({', '.join(food_columns)}) VALUES %s
+                ON CONFLICT (food_id) DO UPDATE SET
+                {', '.join(f'{c} = EXCLUDED.{c}' for c in food_columns[1:])}
+            """, [tuple(Json(row.get(c)) if c == 'food_data' else row.get(c) for c in food_columns) for row in rows])
+            counts['food_cache'] += len(rows)
+
+        for rows in supabase_pages('search_cache'):
+            execute_values(cur, """
+                INSERT INTO search_cache (query, results) VALUES %s
+                ON CONFLICT (query) DO UPDATE SET results = EXCLUDED.results
+            """, [(row['query'], Json(row['results'])) for row in rows])
+            counts['search_cache'] += len(rows)
+        cur.execute("ANALYZE food_cache")
+        conn.commit()
+    return counts
+
+
+def time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+
+def sample_food_id():
+    """A food both backends should have cached, if any."""
+    rows = pg_food_cache.search_food_in_db('a', limit=1) or supabase_client.search_food_in_db('a', limit=1)
+    return rows[0]['fdcId'] if rows else 'missing'
+
+
+def run_backend(backend, queries, food_id, repeat):
+    """{label: [(keystroke, median_ms, p95_ms)]} for one backend."""
+    results = {'search_food_in_db': [], 'get_cached_results': [], 'get_cached_food': [], 'per keystroke': []}
+
+    # Like a request: every call shares one pooled connection
+    db.begin_request_scope()
+    try:
+        for q in queries:
+            def search():
+                backend.search_food_in_db(q)
+
+            def results_cache():
+                backend.get_cached_results(q)
+
+            def food():
+                backend.get_cached_food(food_id)
+
+            def keystroke():
+                search()
+                results_cache()
+                food()
+
+            results['search_food_in_db'].append((q, *time_ms(search, repeat)))
+            results['get_cached_results'].append((q, *time_ms(results_cache, repeat)))
+            results['get_cached_food'].append((q, *time_ms(food, repeat)))
+            results['per keystroke'].append((q, *time_ms(keystroke, repeat)))
+    finally:
+        db.end_request_scope()
+    return results
+
+
+def print_results(title, results):
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+    for label, rows in results.items():
+        print(f"\n{label}")
+        print(f"  {'keystroke':<10} {'median ms':>10} {'p95 ms':>10}")
+        for q, median, p95 in rows:
+            print(f"  {q:<10} {median:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--query', default='chicken')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--copy', action='store_true', help="copy the Supabase cache rows into Postgres first")
+    args = parser.parse_args()
+
+    if not supabase_client.supabase:
+        print("FOOD_CACHE_SUPABASE_URL / FOOD_CACHE_SUPABASE_SERVICE_ROLE_KEY are not set")
+        raise SystemExit(1)
+
+    if args.copy:
+        copy_start = time.time()
+        counts = copy_from_supabase()
+        print(f"✓ Copied {counts['food_cache']:,} foods and {counts['search_cache']:,} searches "
+              f"in {time.time() - copy_start:.1f}s")
+
+    queries = keystrokes(args.query)
+    food_id = sample_food_id()
+    summary = []
+    for name, backend in BACKENDS:
+        # One untimed pass so connection setup and TLS handshakes aren't counted
+        run_backend(backend, queries[:1], food_id, 1)
+        results = run_backend(backend, queries, food_id, args.repeat)
+        print_results(f"{name.upper()} ({backend.__name__})", results)
+        summary.append((name, statistics.median(m for _, m, _ in results['per keystroke'])))
+
+    print("\nMedian per-keystroke cache time:")
+    for name, median in summary:
+        print(f"  {name:<10} {median:>10.2f} ms")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark search-box keystroke latency with and without trigram indexes.
+
+Builds a scratch schema (bench_search) holding a synthetic food_cache and a
+meals table for one user, types a query one keystroke at a time, and times:
+
+  - food_cache ILIKE '%q%'           (search_food_in_db's fallback)
+  - food_cache search_food_cache()   (food_cache_search.sql)
+  - get_recent_meal_matches()        (the real db.py function)
+
+once before and once after the trigram indexes exist. Nothing outside the
+bench_search schema is touched; the schema is dropped afterwards unless --keep.
+
+Usage: python bench_search.py [--foods 1000000] [--meals 100000] [--repeat 20] [--keep]
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import db
+import migrate
+
+SCHEMA = 'bench_search'
+BENCH_USER = 'bench_user'
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Every prefix the debounced search box could send while typing "chicken"
+# (it ignores queries under two characters), then a typo.
+KEYSTROKES = ['ch', 'chi', 'chic', 'chick', 'chicke', 'chicken', 'chikcen']
+
+ADJECTIVES = ['grilled', 'roasted', 'fried', 'baked', 'spicy', 'smoked', 'crispy', 'honey',
+              'garlic', 'lemon', 'teriyaki', 'bbq', 'steamed', 'creamy', 'sweet', 'classic']
+FOODS = ['chicken', 'beef', 'salmon', 'tofu', 'turkey', 'pork', 'shrimp', 'rice', 'pasta',
+         'oatmeal', 'yogurt', 'banana', 'apple', 'almonds', 'broccoli', 'potato', 'egg',
+         'cheese', 'bagel', 'burrito', 'sandwich', 'salad', 'pizza', 'soup', 'noodles']
+STYLES = ['bowl', 'wrap', 'plate', 'breast', 'thigh', 'fillet', 'bites', 'bar', 'cup',
+          'slice', 'skewer', 'stir fry', 'sub', 'taco', 'curry', 'medley']
+BRANDS = ['Kirkland', 'Trader Joes', 'Chobani', 'Quest', 'Tyson', 'Amys', 'Barilla',
+          'Kind', 'Clif', 'Annies', None]
+
+
+def sql_array(values):
+    return "ARRAY[" + ", ".join("NULL" if v is None else "'" + v.replace("'", "''") + "'"
+                                for v in values) + "]"
+
+
+def random_pick(values):
+    """SQL expression picking a random element of values for each row."""
+    return f"({sql_array(values)})[1 + floor(random() * {len(values)})::int]"
+
+
+def build_tables(cur, foods, meals):
+    name_expr = f"{random_pick(ADJECTIVES)} || ' ' || {random_pick(FOODS)} || ' ' || {random_pick(STYLES)}"
+    now = int(time.time() * 1000)
+
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"""
+        CREATE TABLE {SCHEMA}.food_cache (
+            food_id TEXT PRIMARY KEY,
+            food_name TEXT NOT NULL,
+            brand TEXT,
+            source TEXT,
+            calories FLOAT, protein FLOAT, carbs FLOAT, fat FLOAT,
+            serving_size FLOAT DEFAULT 1.0,
+            serving_unit TEXT DEFAULT 'serving',
+            food_data JSONB
+        )
+    """)
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.food_cache (food_id, food_name, brand, source, calories, protein, carbs, fat)
+        SELECT 'bench_' || i, {name_expr}, {random_pick(BRANDS)}, 'fatsecret',
+               floor(random() * 800), random() * 50, random() * 90, random() * 40
+        FROM generate_series(1, %s) AS i
+    """, (foods,))
+
+    # Same columns and defaults as the real table, but none of its indexes yet.
+    cur.execute(f"CREATE TABLE {SCHEMA}.meals (LIKE public.meals INCLUDING DEFAULTS)")
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.meals (id, user_id, food_name, brand_name, meal_type,
+                                    calories, protein, carbs, fat, timestamp)
+        SELECT 'bench_meal_' || i, %s, {name_expr}, {random_pick(BRANDS)}, 'lunch',
+               floor(random() * 800), random() * 50, random() * 90, random() * 40,
+               %s - floor(random() * %s)::bigint
+        FROM generate_series(1, %s) AS i
+    """, (BENCH_USER, now, 30 * DAY_MS, meals))
+    # The window index from migration 3 is already in production; only the
+    # trigram indexes are under test.
+    cur.execute(f"CREATE INDEX ON {SCHEMA}.meals (user_id, timestamp DESC)")
+    cur.execute(f"ANALYZE {SCHEMA}.food_cache")
+    cur.execute(f"ANALYZE {SCHEMA}.meals")
+
+
+def add_trigram_indexes(cur):
+    """Apply the real DDL (migration 4 and food_cache_search.sql) inside the bench schema."""
+    cur.execute(f"SET search_path TO {SCHEMA}, public")
+    cur.execute(migrate.MEAL_TRIGRAM_SQL)
+    with open(os.path.join(os.path.dirname(__file__), 'food_cache_search.sql')) as f:
+        cur.execute(f.read())
+    cur.execute(f"ANALYZE {SCHEMA}.meals")
+    cur.execute("RESET search_path")
+
+
+def install_search_function(cur):
+    """search_food_cache without its index, so the 'before' run can time it too."""
+    with open(os.path.join(os.path.dirname(__file__), 'food_cache_search.sql')) as f:
+        sql = f.read()
+    function_sql = sql[sql.index('CREATE OR REPLACE FUNCTION'):]
+    cur.execute(f"SET search_path TO {SCHEMA}, public")
+    cur.execute(function_sql)
+    cur.execute("RESET search_path")
+
+
+def time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+
+def run_keystrokes(repeat):
+    """{label: [(keystroke, median_ms, p95_ms)]} for every search path."""
+    results = {'food_cache ILIKE': [], 'food_cache trigram': [], 'meal history': []}
+
+    db.begin_request_scope()
+    try:
+        with db.db_connection() as conn:
+            cur = conn.cursor()
+            # Session-level, so get_recent_meal_matches (which shares this
+            # connection through the request scope) reads the bench tables.
+            cur.execute(f"SET search_path TO {SCHEMA}, public")
+            conn.commit()
+
+            for q in KEYSTROKES:
+                def ilike():
+                    cur.execute("SELECT * FROM food_cache WHERE food_name ILIKE %s LIMIT 5", (f'%{q}%',))
+                    cur.fetchall()
+
+                def trigram():
+                    cur.execute("SELECT * FROM search_food_cache(%s, 5)", (q,))
+                    cur.fetchall()
+
+                def history():
+                    db.get_recent_meal_matches(BENCH_USER, q, limit=3)
+
+                results['food_cache ILIKE'].append((q, *time_ms(ilike, repeat)))
+                results['food_cache trigram'].append((q, *time_ms(trigram, repeat)))
+                results['meal history'].append((q, *time_ms(history, repeat)))
+
+            cur.execute("RESET search_path")
+            conn.commit()
+    finally:
+        db.end_request_scope()
+    return results
+
+
+def print_results(title, results):
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+    for label, rows in results.items():
+        print(f"\n{label}")
+        print(f"  {'keystroke':<10} {'median ms':>10} {'p95 ms':>10}")
+        for q, median, p95 in rows:
+            print(f"  {q:<10} {median:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--foods', type=int, default=1_000_000)
+    parser.add_argument('--meals', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help=f"leave the {SCHEMA} schema in place")
+    args = parser.parse_args()
+
+    conn = db.get_db_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    try:
+        print(f"Building {args.foods:,} cached foods and {args.meals:,} meals in schema {SCHEMA}...")
+        build_start = time.time()
+        build_tables(cur, args.foods, args.meals)
+        install_search_function(cur)
+        print(f"✓ Built in {time.time() - build_start:.1f}s")
+
+        before = run_keystrokes(args.repeat)
+        print_results("WITHOUT TRIGRAM INDEXES", before)
+
+        index_start = time.time()
+        add_trigram_indexes(cur)
+        print(f"\n✓ Trigram indexes built in {time.time() - index_start:.1f}s")
+
+        after = run_keystrokes(args.repeat)
+        print_results("WITH TRIGRAM INDEXES", after)
+    finally:
+        if not args.keep:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Compare the 'materialized' and 'virtual' weight fill modes.
+
+Builds a scratch schema (bench_weights) with copies of events and daily_rollups
+(same columns and indexes), logs a few years of sparse weigh-ins for a set of
+users, and measures for each mode:
+
+  - events table + index size and row count
+  - get_chart_data() latency for the weight chart over several ranges, both
+    from daily_rollups (ROLLUP_TZ) and from raw rows (another zone)
+
+'virtual' is measured first (real weigh-ins only), then every user is filled
+with fill_and_interpolate_weight_data() as 'materialized' mode would. Nothing
+outside the bench_weights schema is touched; the schema is dropped afterwards
+unless --keep.
+
+Usage: python bench_weight_modes.py [--users 50] [--years 5] [--every 7] [--repeat 20] [--keep]
+"""
+
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import db
+
+SCHEMA = 'bench_weights'
+DAY_MS = 24 * 60 * 60 * 1000
+RANGES = [('30 days', 30), ('1 year', 365), ('5 years', 5 * 365)]
+RAW_TZ = 'UTC' if db.ROLLUP_TZ != 'UTC' else 'America/New_York'
+
+
+def build_tables(cur, users, years, every):
+    now = int(time.time() * 1000)
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE TABLE {SCHEMA}.events (LIKE public.events INCLUDING ALL)")
+    cur.execute(f"CREATE TABLE {SCHEMA}.daily_rollups (LIKE public.daily_rollups INCLUDING ALL)")
+    # A weigh-in on roughly one day in `every`, drifting around 150 lbs
+    cur.execute(f"""
+        INSERT INTO {SCHEMA}.events (id, user_id, event_type_id, timestamp, category, data, notes)
+        SELECT 'bench_w_' || u || '_' || d, 'bench_user_' || u, 'weight',
+               %s - d * %s::bigint - floor(random() * %s)::bigint, 'Health',
+               jsonb_build_object('weight', round((150 + 10 * sin(d / 60.0) + random() * 2)::numeric, 1)),
+               ''
+        FROM generate_series(1, %s) AS u, generate_series(0, %s) AS d
+        WHERE random() < 1.0 / %s
+    """, (now, DAY_MS, DAY_MS, users, years * 365, every))
+    cur.execute(f"ANALYZE {SCHEMA}.events")
+
+
+def table_sizes(cur):
+    cur.execute(f"""
+        SELECT
+            (SELECT COUNT(*) FROM {SCHEMA}.events) AS row_count,
+            pg_relation_size('{SCHEMA}.events') AS table_bytes,
+            pg_indexes_size('{SCHEMA}.events') AS index_bytes,
+            pg_total_relation_size('{SCHEMA}.events') AS total_bytes
+    """)
+    return cur.fetchone()
+
+
+def time_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+
+def in_bench_schema(fn):
+    """Run fn with every db.py call on this thread reading the bench tables."""
+    db.begin_request_scope()
+    try:
+        with db.db_connection() as conn:
+            cur = conn.cursor()
+            # Session-level, so db.py functions sharing this connection through
+            # the request scope see the bench tables (event_types stays public).
+            cur.execute(f"SET search_path TO {SCHEMA}, public")
+            conn.commit()
+            try:
+                return fn(cur)
+            finally:
+                cur.execute("RESET search_path")
+                conn.commit()
+    finally:
+        db.end_request_scope()
+
+
+def fill_materialized(users):
+    def fill(cur):
+        for u in range(1, users + 1):
+            db.fill_and_interpolate_weight_data(f'bench_user_{u}')
+    in_bench_schema(fill)
+
+
+def rebuild_rollups():
+    def rebuild(cur):
+        db.write_rollups(cur)
+        cur.connection.commit()
+    in_bench_schema(rebuild)
+
+
+def run_charts(repeat):
+    """[(range, zone, median_ms, p95_ms)] for one user's weight chart."""
+    now = int(time.time() * 1000)
+    results = []
+
+    def charts(cur):
+        for label, days in RANGES:
+            for tz_name in (db.ROLLUP_TZ, RAW_TZ):
+                def chart():
+                    db.get_chart_data('bench_user_1', ['weight'], now - days * DAY_MS, now, tz_name=tz_name)
+                results.append((label, tz_name, *time_ms(chart, repeat)))
+    in_bench_schema(charts)
+    return results
+
+
+def print_results(title, sizes, charts):
+    print("\n" + "=" * 60)
+    print(title)
+    print("=" * 60)
+    print(f"  events rows   {sizes['row_count']:>12,}")
+    print(f"  table         {sizes['table_bytes'] / 1024 / 1024:>10.1f} MB")
+    print(f"  indexes       {sizes['index_bytes'] / 1024 / 1024:>10.1f} MB")
+    print(f"  total         {sizes['total_bytes'] / 1024 / 1024:>10.1f} MB")
+    print(f"\n  {'chart range':<10} {'zone':<22} {'median ms':>10} {'p95 ms':>10}")
+    for label, tz_name, median, p95 in charts:
+        print(f"  {label:<10} {tz_name:<22} {median:>10.2f} {p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--every', type=int, default=7, help="average days between weigh-ins")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help=f"leave the {SCHEMA} schema in place")
+    args = parser.parse_args()
+
+    configured_mode = db.WEIGHT_FILL_MODE
+    conn = db.get_db_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        print(f"Logging ~{args.years * 365 // args.every:,} weigh-ins each for {args.users:,} users in schema {SCHEMA}...")
+        build_tables(cur, args.users, args.years, args.every)
+
+        db.WEIGHT_FILL_MODE = 'virtual'
+        rebuild_rollups()
+        cur.execute(f"VACUUM ANALYZE {SCHEMA}.events")
+        print_results("VIRTUAL (real weigh-ins only, filled on read)", table_sizes(cur), run_charts(args.repeat))
+
+        db.WEIGHT_FILL_MODE = 'materialized'
+        fill_start = time.time()
+        fill_materialized(args.users)
+        print(f"\n✓ Materialized auto-generated weigh-ins in {time.time() - fill_start:.1f}s")
+        rebuild_rollups()
+        cur.execute(f"VACUUM ANALYZE {SCHEMA}.events")
+        print_results("MATERIALIZED (auto-generated rows stored)", table_sizes(cur), run_charts(args.repeat))
+    finally:
+        db.WEIGHT_FILL_MODE = configured_mode
+        if not args.keep:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        conn.close()
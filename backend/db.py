@@ -1,408 +1,362 @@
 import os
 import json
 import uuid
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from urllib.parse import urlparse
 
+import timeseries
+import jobs
+
 # Get DB URL from environment
 DATABASE_URL = os.getenv('POSTGRES_URL')
 
+# Connection pool sizing. Serverless instances handle one request at a time, so a
+# small pool is plenty; the threaded dev server and background work may want more.
+POOL_MIN_CONN = int(os.getenv('POSTGRES_POOL_MIN', 1))
+POOL_MAX_CONN = int(os.getenv('POSTGRES_POOL_MAX', 5))
+# Seconds to wait for a free connection before giving up.
+POOL_TIMEOUT = float(os.getenv('POSTGRES_POOL_TIMEOUT', 10))
+
+# TCP keepalives so a pooled connection left idle across a frozen serverless
+# instance is detected as dead instead of hanging the next query.
+CONNECT_KWARGS = {
+    'cursor_factory': RealDictCursor,
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+# Caps borrowers at POOL_MAX_CONN so a busy pool blocks (and is measured) instead
+# of ThreadedConnectionPool raising immediately.
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONN)
+_pool_stats = {
+    'borrows': 0,
+    'waits': 0,
+    'timeouts': 0,
+    'discarded': 0,
+    'in_use': 0,
+    'peak_in_use': 0,
+    'wait_ms_total': 0.0,
+    'wait_ms_max': 0.0
+}
+
+# The connection shared by every db call on this thread, plus how many holders
+# (open db_connection() blocks and request scopes) still need it.
+_local = threading.local()
+
+# daily_rollups buckets rows by local calendar day in this zone. Reads asking for
+# any other zone aggregate raw rows instead. After changing it, rebuild with
+# `python rebuild_rollups.py --all`.
+ROLLUP_TZ = os.getenv('LIFESTATS_ROLLUP_TZ') or os.getenv('LIFESTATS_DEFAULT_TZ', 'America/Los_Angeles')
+ROLLUP_ZONE = ZoneInfo(ROLLUP_TZ)
+# pg_advisory_xact_lock(ROLLUP_LOCK_ID, hashtext(user_id)) serializes rollup
+# refreshes per user, so concurrent writes to one day can't lose each other.
+ROLLUP_LOCK_ID = 7324002
+
+# 'materialized' stores interpolated/forward-filled weigh-ins as events rows flagged
+# data._auto_generated; 'virtual' never stores them and fills them in on read.
+# After switching, run `python rebuild_rollups.py --all` to purge or recreate them.
+WEIGHT_FILL_MODE = os.getenv('LIFESTATS_WEIGHT_FILL_MODE', 'materialized')
+
 def get_db_connection():
+    """Open a standalone connection outside the pool (one-off scripts and tests)."""
     if not DATABASE_URL:
         raise Exception("POSTGRES_URL environment variable not set")
     conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
     return conn
 
+def _get_pool():
+    """Create the pool on first use, so importing this module never touches the network."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if not DATABASE_URL:
+                    raise Exception("POSTGRES_URL environment variable not set")
+                _pool = ThreadedConnectionPool(POOL_MIN_CONN, POOL_MAX_CONN, DATABASE_URL, **CONNECT_KWARGS)
+    return _pool
+
+def _borrow_connection():
+    """Take a connection from the pool, waiting up to POOL_TIMEOUT for a free slot."""
+    pool = _get_pool()
+
+    started = time.monotonic()
+    if not _pool_slots.acquire(blocking=False):
+        acquired = _pool_slots.acquire(timeout=POOL_TIMEOUT)
+        waited_ms = (time.monotonic() - started) * 1000
+        with _pool_lock:
+            _pool_stats['waits'] += 1
+            _pool_stats['wait_ms_total'] += waited_ms
+            _pool_stats['wait_ms_max'] = max(_pool_stats['wait_ms_max'], waited_ms)
+            if not acquired:
+                _pool_stats['timeouts'] += 1
+        if not acquired:
+            raise PoolError(f"No database connection free after {POOL_TIMEOUT}s (pool max {POOL_MAX_CONN})")
+
+    try:
+        conn = pool.getconn()
+        if conn.closed:
+            # The server dropped it while it sat idle; replace it with a fresh one.
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+
+    with _pool_lock:
+        _pool_stats['borrows'] += 1
+        _pool_stats['in_use'] += 1
+        _pool_stats['peak_in_use'] = max(_pool_stats['peak_in_use'], _pool_stats['in_use'])
+    return conn
+
+def _return_connection(conn):
+    """Hand a connection back to the pool, dropping it if it is no longer usable."""
+    discard = bool(conn.closed)
+    try:
+        if not discard and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # Close out read-only transactions so the next borrower starts clean.
+            conn.rollback()
+    except psycopg2.Error:
+        discard = True
+
+    try:
+        _get_pool().putconn(conn, close=discard)
+    finally:
+        _pool_slots.release()
+        with _pool_lock:
+            _pool_stats['in_use'] -= 1
+            if discard:
+                _pool_stats['discarded'] += 1
+
+def _release_if_unheld():
+    if getattr(_local, 'holders', 0) == 0 and getattr(_local, 'conn', None) is not None:
+        conn = _local.conn
+        _local.conn = None
+        _return_connection(conn)
+
+@contextmanager
+def db_connection():
+    """
+    Borrow a pooled connection for the duration of the block.
+
+    Nested blocks on the same thread, and every block inside a request_scope(),
+    share one connection, so a request pays for at most one checkout no matter
+    how many db functions it calls. Uncommitted work is rolled back if the block
+    raises; callers still commit their own writes.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.closed:
+        # Dropped mid-request; give the dead one back and start over.
+        _local.conn = None
+        _return_connection(conn)
+        conn = None
+    if conn is None:
+        conn = _local.conn = _borrow_connection()
+    _local.holders = getattr(_local, 'holders', 0) + 1
+
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        _local.holders -= 1
+        _release_if_unheld()
+
+def begin_request_scope():
+    """
+    Start sharing one connection across every db call on this thread.
+
+    The connection is borrowed lazily on the first db call, so requests that
+    never touch the database never touch the pool.
+    """
+    _local.holders = getattr(_local, 'holders', 0) + 1
+
+def end_request_scope():
+    """Release the connection shared since begin_request_scope() back to the pool."""
+    _local.holders -= 1
+    _release_if_unheld()
+
+@contextmanager
+def request_scope():
+    """Context-manager form of begin_request_scope()/end_request_scope()."""
+    begin_request_scope()
+    try:
+        yield
+    finally:
+        end_request_scope()
+
+def pool_stats():
+    """Pool size and checkout wait-time counters, for sizing POSTGRES_POOL_MAX."""
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    stats['min_conn'] = POOL_MIN_CONN
+    stats['max_conn'] = POOL_MAX_CONN
+    stats['timeout_s'] = POOL_TIMEOUT
+    stats['initialized'] = _pool is not None
+    stats['avg_wait_ms'] = stats['wait_ms_total'] / stats['waits'] if stats['waits'] else 0.0
+    return stats
+
+# Set to 0 once deploys run `python backend/migrate.py` ahead of traffic, so a
+# cold start never even checks the schema version.
+AUTO_MIGRATE = os.getenv('LIFESTATS_AUTO_MIGRATE', '1') != '0'
+
 def init_db():
-    """Initialize the database tables."""
+    """
+    Bring the schema up to date via migrate.py. Once the database is current this
+    is a single version check; no DDL or seeding runs on a normal cold start.
+    """
     if not DATABASE_URL:
         print("Skipping DB init: POSTGRES_URL not set")
         return
 
-    conn = get_db_connection()
+    if not AUTO_MIGRATE:
+        return
+
     try:
-        cur = conn.cursor()
-        # Create meals table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS meals (
-                id VARCHAR(50) PRIMARY KEY,
-                user_id VARCHAR(50) NOT NULL,
-                food_name TEXT NOT NULL,
-                brand_name TEXT,
-                meal_type VARCHAR(20) NOT NULL,
-                calories INTEGER DEFAULT 0,
-                protein FLOAT DEFAULT 0,
-                carbs FLOAT DEFAULT 0,
-                fat FLOAT DEFAULT 0,
-                serving_size FLOAT DEFAULT 1.0,
-                serving_unit VARCHAR(50) DEFAULT '',
-                cholesterol FLOAT DEFAULT 0,
-                sodium FLOAT DEFAULT 0,
-                fiber FLOAT DEFAULT 0,
-                sugar FLOAT DEFAULT 0,
-                saturated_fat FLOAT DEFAULT 0,
-                trans_fat FLOAT DEFAULT 0,
-                polyunsaturated_fat FLOAT DEFAULT 0,
-                monounsaturated_fat FLOAT DEFAULT 0,
-                added_sugar FLOAT DEFAULT 0,
-                vitamin_d FLOAT DEFAULT 0,
-                calcium FLOAT DEFAULT 0,
-                iron FLOAT DEFAULT 0,
-                potassium FLOAT DEFAULT 0,
-                vitamin_c FLOAT DEFAULT 0,
-                timestamp BIGINT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS search_cache (
-                query TEXT PRIMARY KEY,
-                results JSONB,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
-            
-            -- Event Types Table: Defines what event types exist and their schemas
-            CREATE TABLE IF NOT EXISTS event_types (
-                id VARCHAR(50) PRIMARY KEY,
-                user_id VARCHAR(50),
-                category VARCHAR(50) NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                icon VARCHAR(50),
-                color VARCHAR(20),
-                field_schema JSONB NOT NULL,
-                aggregation_type VARCHAR(20) DEFAULT 'sum',
-                primary_unit VARCHAR(50),
-                tracking_type VARCHAR(20) DEFAULT 'count',
-                is_active BOOLEAN DEFAULT true,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            
-            -- User Favorites Table: Linking users to their favorite event types (system or custom)
-            CREATE TABLE IF NOT EXISTS favorite_event_types (
-                user_id VARCHAR(50) NOT NULL,
-                event_type_id VARCHAR(50) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, event_type_id)
-            );
-            
-            -- Events Table: Unified storage for all event types
-            CREATE TABLE IF NOT EXISTS events (
-                id VARCHAR(50) PRIMARY KEY,
-                user_id VARCHAR(50) NOT NULL,
-                event_type_id VARCHAR(50) NOT NULL,
-                timestamp BIGINT NOT NULL,
-                category VARCHAR(50) NOT NULL,
-                data JSONB NOT NULL,
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-            
-            -- User Profiles Table: Stores user profile information
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id VARCHAR(50) PRIMARY KEY,
-                sex VARCHAR(10),
-                birthdate DATE,
-                height_inches FLOAT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            -- Goals Table: User defined goals for event types
-            CREATE TABLE IF NOT EXISTS goals (
-                id VARCHAR(50) PRIMARY KEY,
-                user_id VARCHAR(50) NOT NULL,
-                event_type_id VARCHAR(50) NOT NULL,
-                target_value FLOAT NOT NULL,
-                period VARCHAR(20) DEFAULT 'daily',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-            -- User Categories Table: dedicated table for custom categories
-            CREATE TABLE IF NOT EXISTS user_categories (
-                id VARCHAR(50) PRIMARY KEY,
-                user_id VARCHAR(50) NOT NULL,
-                name VARCHAR(50) NOT NULL,
-                icon VARCHAR(10),
-                is_active BOOLEAN DEFAULT true,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, name)
-            );
-        """)
-        
-        # Schema Migration: Add columns if they don't exist
-        cur.execute("""
-            DO $$ 
-            BEGIN 
-                -- Meals Table Columns and Defaults
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN serving_size FLOAT DEFAULT 1.0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN serving_unit VARCHAR(50) DEFAULT '';
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN cholesterol FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN sodium FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN fiber FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN sugar FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN saturated_fat FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN trans_fat FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN polyunsaturated_fat FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN monounsaturated_fat FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN added_sugar FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN vitamin_d FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN calcium FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN iron FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN potassium FLOAT DEFAULT 0;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN vitamin_c FLOAT DEFAULT NULL;
-                    -- Update existing defaults to NULL for all extended nutrients
-                    ALTER TABLE meals ALTER COLUMN cholesterol DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN sodium DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN fiber DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN sugar DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN saturated_fat DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN trans_fat DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN polyunsaturated_fat DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN monounsaturated_fat DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN added_sugar DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN vitamin_d DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN calcium DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN iron DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN potassium DROP DEFAULT;
-                    ALTER TABLE meals ALTER COLUMN vitamin_c DROP DEFAULT;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-
-                BEGIN
-                    ALTER TABLE meals ADD COLUMN brand_name TEXT;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-
-                -- Event Types Schema Updates
-                BEGIN
-                    ALTER TABLE event_types ADD COLUMN tracking_type VARCHAR(20) DEFAULT 'count';
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-                BEGIN
-                    ALTER TABLE event_types ADD COLUMN is_favorite BOOLEAN DEFAULT false;
-                EXCEPTION
-                    WHEN duplicate_column THEN NULL;
-                END;
-            END $$;
-        """)
-        
-        # Create indexes for event_types and events tables
-        cur.execute("""
-            -- Indexes for event_types
-            CREATE INDEX IF NOT EXISTS idx_event_types_user_category 
-                ON event_types(user_id, category);
-            CREATE INDEX IF NOT EXISTS idx_event_types_active 
-                ON event_types(is_active);
-            
-            -- Indexes for events
-            CREATE INDEX IF NOT EXISTS idx_events_user_timestamp 
-                ON events(user_id, timestamp DESC);
-            CREATE INDEX IF NOT EXISTS idx_events_user_category 
-                ON events(user_id, category);
-            CREATE INDEX IF NOT EXISTS idx_events_type 
-                ON events(event_type_id);
-            CREATE INDEX IF NOT EXISTS idx_events_data_gin 
-                ON events USING GIN (data);
-        """)
-        
-        conn.commit()
-        
-        # Seed system-defined event types
-        seed_event_types()
-        
+        from migrate import migrate
+        migrate()
     except Exception as e:
         print(f"Error initializing DB: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+
+# System-defined event types
+SYSTEM_EVENT_TYPES = [
+    {
+        'id': 'meal',
+        'user_id': None,  # System-defined
+        'category': 'Nutrition',
+        'name': 'Meal',
+        'icon': '🍽️',
+        'color': '#4CAF50',
+        'aggregation_type': 'sum',
+        'primary_unit': 'serving',
+        'field_schema': {
+            'fields': [
+                {'name': 'food_name', 'type': 'string', 'required': True, 'label': 'Food Name'},
+                {'name': 'meal_type', 'type': 'enum', 'values': ['breakfast', 'lunch', 'dinner', 'snack'], 'required': True, 'label': 'Meal Type'},
+                {'name': 'serving_size', 'type': 'number', 'required': True, 'label': 'Serving Size'},
+                {'name': 'serving_unit', 'type': 'string', 'required': True, 'label': 'Serving Unit'},
+                {'name': 'calories', 'type': 'number', 'unit': 'kcal', 'label': 'Calories'},
+                {'name': 'protein', 'type': 'number', 'unit': 'g', 'label': 'Protein'},
+                {'name': 'carbs', 'type': 'number', 'unit': 'g', 'label': 'Carbohydrates'},
+                {'name': 'fat', 'type': 'number', 'unit': 'g', 'label': 'Fat'},
+                {'name': 'cholesterol', 'type': 'number', 'unit': 'mg', 'label': 'Cholesterol'},
+                {'name': 'sodium', 'type': 'number', 'unit': 'mg', 'label': 'Sodium'},
+                {'name': 'fiber', 'type': 'number', 'unit': 'g', 'label': 'Fiber'},
+                {'name': 'sugar', 'type': 'number', 'unit': 'g', 'label': 'Sugar'},
+                {'name': 'saturated_fat', 'type': 'number', 'unit': 'g', 'label': 'Saturated Fat'},
+                {'name': 'trans_fat', 'type': 'number', 'unit': 'g', 'label': 'Trans Fat'},
+                {'name': 'polyunsaturated_fat', 'type': 'number', 'unit': 'g', 'label': 'Polyunsaturated Fat'},
+                {'name': 'monounsaturated_fat', 'type': 'number', 'unit': 'g', 'label': 'Monounsaturated Fat'},
+                {'name': 'added_sugar', 'type': 'number', 'unit': 'g', 'label': 'Added Sugar'},
+                {'name': 'vitamin_d', 'type': 'number', 'unit': 'mcg', 'label': 'Vitamin D'},
+                {'name': 'calcium', 'type': 'number', 'unit': 'mg', 'label': 'Calcium'},
+                {'name': 'iron', 'type': 'number', 'unit': 'mg', 'label': 'Iron'},
+                {'name': 'potassium', 'type': 'number', 'unit': 'mg', 'label': 'Potassium'},
+                {'name': 'vitamin_c', 'type': 'number', 'unit': 'mg', 'label': 'Vitamin C'}
+            ]
+        }
+    },
+
+    {
+        'id': 'weight',
+        'user_id': None,
+        'category': 'Health',
+        'name': 'Body Weight',
+        'icon': '⚖️',
+        'color': '#2196F3',
+        'aggregation_type': 'last',
+        'primary_unit': 'lbs',
+        'tracking_type': 'number',
+        'field_schema': {
+            'fields': [
+                {'name': 'weight', 'type': 'number', 'required': True, 'unit': 'lbs', 'label': 'Weight'},
+                {'name': 'body_fat_pct', 'type': 'number', 'unit': '%', 'label': 'Body Fat %'}
+            ]
+        }
+    },
+
+    {
+        'id': 'steps',
+        'user_id': None,
+        'category': 'Fitness',
+        'name': 'Steps',
+        'icon': '👣',
+        'color': '#FF5722',
+        'aggregation_type': 'max',  # We want the highest value to represent the day (accumulating)
+        'primary_unit': 'steps',
+        'tracking_type': 'number',
+        'field_schema': {
+            'fields': [
+                {'name': 'count', 'type': 'number', 'required': True, 'unit': 'steps', 'label': 'Count'}
+            ]
+        }
+    }
+]
+
+# Retired system types; their events, favorites and goals are removed with them.
+DEPRECATED_EVENT_TYPES = ['pushups', 'cardio', 'water']
+
+def write_system_event_types(cur):
+    """Upsert SYSTEM_EVENT_TYPES and purge DEPRECATED_EVENT_TYPES. Caller commits."""
+    # Insert each event type (upsert to avoid duplicates)
+    for event_type in SYSTEM_EVENT_TYPES:
+        cur.execute("""
+            INSERT INTO event_types (id, user_id, category, name, icon, color, field_schema, aggregation_type, primary_unit, tracking_type)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET
+                tracking_type = EXCLUDED.tracking_type
+        """, (
+            event_type['id'],
+            event_type['user_id'],
+            event_type['category'],
+            event_type['name'],
+            event_type['icon'],
+            event_type['color'],
+            json.dumps(event_type['field_schema']),
+            event_type['aggregation_type'],
+            event_type['primary_unit'],
+            event_type.get('tracking_type', 'count')
+        ))
+
+    # Cleanup deprecated event types
+    deprecated_types = DEPRECATED_EVENT_TYPES
+    if deprecated_types:
+        cur.execute("DELETE FROM events WHERE event_type_id = ANY(%s)", (deprecated_types,))
+        cur.execute("DELETE FROM favorite_event_types WHERE event_type_id = ANY(%s)", (deprecated_types,))
+        cur.execute("DELETE FROM goals WHERE event_type_id = ANY(%s)", (deprecated_types,))
+        cur.execute("DELETE FROM event_types WHERE id = ANY(%s)", (deprecated_types,))
+        print(f"Cleaned up deprecated types: {deprecated_types}")
 
 def seed_event_types():
-    """Seed system-defined event types if they don't exist."""
+    """
+    Re-run the system event type seed by hand. Normal deploys get this once,
+    through migration 2, rather than on every boot.
+    """
     if not DATABASE_URL:
         return
-    
-    conn = get_db_connection()
+
     try:
-        cur = conn.cursor()
-        
-        # System-defined event types
-        system_event_types = [
-            {
-                'id': 'meal',
-                'user_id': None,  # System-defined
-                'category': 'Nutrition',
-                'name': 'Meal',
-                'icon': '🍽️',
-                'color': '#4CAF50',
-                'aggregation_type': 'sum',
-                'primary_unit': 'serving',
-                'field_schema': {
-                    'fields': [
-                        {'name': 'food_name', 'type': 'string', 'required': True, 'label': 'Food Name'},
-                        {'name': 'meal_type', 'type': 'enum', 'values': ['breakfast', 'lunch', 'dinner', 'snack'], 'required': True, 'label': 'Meal Type'},
-                        {'name': 'serving_size', 'type': 'number', 'required': True, 'label': 'Serving Size'},
-                        {'name': 'serving_unit', 'type': 'string', 'required': True, 'label': 'Serving Unit'},
-                        {'name': 'calories', 'type': 'number', 'unit': 'kcal', 'label': 'Calories'},
-                        {'name': 'protein', 'type': 'number', 'unit': 'g', 'label': 'Protein'},
-                        {'name': 'carbs', 'type': 'number', 'unit': 'g', 'label': 'Carbohydrates'},
-                        {'name': 'fat', 'type': 'number', 'unit': 'g', 'label': 'Fat'},
-                        {'name': 'cholesterol', 'type': 'number', 'unit': 'mg', 'label': 'Cholesterol'},
-                        {'name': 'sodium', 'type': 'number', 'unit': 'mg', 'label': 'Sodium'},
-                        {'name': 'fiber', 'type': 'number', 'unit': 'g', 'label': 'Fiber'},
-                        {'name': 'sugar', 'type': 'number', 'unit': 'g', 'label': 'Sugar'},
-                        {'name': 'saturated_fat', 'type': 'number', 'unit': 'g', 'label': 'Saturated Fat'},
-                        {'name': 'trans_fat', 'type': 'number', 'unit': 'g', 'label': 'Trans Fat'},
-                        {'name': 'polyunsaturated_fat', 'type': 'number', 'unit': 'g', 'label': 'Polyunsaturated Fat'},
-                        {'name': 'monounsaturated_fat', 'type': 'number', 'unit': 'g', 'label': 'Monounsaturated Fat'},
-                        {'name': 'added_sugar', 'type': 'number', 'unit': 'g', 'label': 'Added Sugar'},
-                        {'name': 'vitamin_d', 'type': 'number', 'unit': 'mcg', 'label': 'Vitamin D'},
-                        {'name': 'calcium', 'type': 'number', 'unit': 'mg', 'label': 'Calcium'},
-                        {'name': 'iron', 'type': 'number', 'unit': 'mg', 'label': 'Iron'},
-                        {'name': 'potassium', 'type': 'number', 'unit': 'mg', 'label': 'Potassium'},
-                        {'name': 'vitamin_c', 'type': 'number', 'unit': 'mg', 'label': 'Vitamin C'}
-                    ]
-                }
-            },
-
-            {
-                'id': 'weight',
-                'user_id': None,
-                'category': 'Health',
-                'name': 'Body Weight',
-                'icon': '⚖️',
-                'color': '#2196F3',
-                'aggregation_type': 'last',
-                'primary_unit': 'lbs',
-                'tracking_type': 'number',
-                'field_schema': {
-                    'fields': [
-                        {'name': 'weight', 'type': 'number', 'required': True, 'unit': 'lbs', 'label': 'Weight'},
-                        {'name': 'body_fat_pct', 'type': 'number', 'unit': '%', 'label': 'Body Fat %'}
-                    ]
-                }
-            },
-
-            {
-                'id': 'steps',
-                'user_id': None,
-                'category': 'Fitness',
-                'name': 'Steps',
-                'icon': '👣',
-                'color': '#FF5722',
-                'aggregation_type': 'max',  # We want the highest value to represent the day (accumulating)
-                'primary_unit': 'steps',
-                'tracking_type': 'number',
-                'field_schema': {
-                    'fields': [
-                        {'name': 'count', 'type': 'number', 'required': True, 'unit': 'steps', 'label': 'Count'}
-                    ]
-                }
-            }
-        ]
-        
-        # Insert each event type (upsert to avoid duplicates)
-        for event_type in system_event_types:
-            cur.execute("""
-                INSERT INTO event_types (id, user_id, category, name, icon, color, field_schema, aggregation_type, primary_unit, tracking_type)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE SET
-                    tracking_type = EXCLUDED.tracking_type
-            """, (
-                event_type['id'],
-                event_type['user_id'],
-                event_type['category'],
-                event_type['name'],
-                event_type['icon'],
-                event_type['color'],
-                json.dumps(event_type['field_schema']),
-                event_type['aggregation_type'],
-                event_type['primary_unit'],
-                event_type.get('tracking_type', 'count')
-            ))
-            
-        # Cleanup deprecated event types
-        deprecated_types = ['pushups', 'cardio', 'water']
-        if deprecated_types:
-            cur.execute("DELETE FROM events WHERE event_type_id = ANY(%s)", (deprecated_types,))
-            cur.execute("DELETE FROM favorite_event_types WHERE event_type_id = ANY(%s)", (deprecated_types,))
-            cur.execute("DELETE FROM goals WHERE event_type_id = ANY(%s)", (deprecated_types,))
-            cur.execute("DELETE FROM event_types WHERE id = ANY(%s)", (deprecated_types,))
-            print(f"Cleaned up deprecated types: {deprecated_types}")
-        
-        conn.commit()
-        print("System event types seeded successfully")
+        with db_connection() as conn:
+            write_system_event_types(conn.cursor())
+            conn.commit()
+            print("System event types seeded successfully")
     except Exception as e:
         print(f"Error seeding event types: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def _meal_record(m):
     """Map a meals row into the JSON shape the frontend and API expect."""
@@ -437,41 +391,130 @@ def _meal_record(m):
         'timestamp': m['timestamp']
     }
 
+def _event_record(event):
+    """Map an events row into the JSON shape the frontend and API expect."""
+    return {
+        'id': event['id'],
+        'userId': event['user_id'],
+        'eventTypeId': event['event_type_id'],
+        'timestamp': event['timestamp'],
+        'category': event['category'],
+        'data': event['data'],
+        'notes': event['notes'],
+        'createdAt': event['created_at'].isoformat() if event['created_at'] else None
+    }
+
+def _event_type_record(et):
+    """Map an event_types row into the JSON shape get_event_type returns."""
+    return {
+        'id': et['id'],
+        'userId': et['user_id'],
+        'category': et['category'],
+        'name': et['name'],
+        'icon': et['icon'],
+        'color': et['color'],
+        'fieldSchema': et['field_schema'],
+        'aggregationType': et['aggregation_type'],
+        'primaryUnit': et['primary_unit'],
+        'trackingType': et.get('tracking_type', 'count'),
+        'isFavorite': et.get('is_favorite', False),
+        'isActive': et['is_active'],
+        'createdAt': et['created_at'].isoformat() if et['created_at'] else None,
+        'updatedAt': et['updated_at'].isoformat() if et['updated_at'] else None
+    }
+
+def _goal_record(g):
+    """Map a goals row into the JSON shape the frontend and API expect."""
+    return {
+        'id': g['id'],
+        'userId': g['user_id'],
+        'eventTypeId': g['event_type_id'],
+        'targetValue': g['target_value'],
+        'period': g['period'],
+        'createdAt': g['created_at'].isoformat() if g['created_at'] else None
+    }
+
 def get_user_meals(user_id):
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM meals WHERE user_id = %s ORDER BY timestamp DESC", (user_id,))
         meals = cur.fetchall()
         return [_meal_record(m) for m in meals]
-    finally:
-        conn.close()
+
+def get_meals_page(user_id, start_ms=None, end_ms=None, after=None, limit=100):
+    """
+    One page of a user's meals, newest first, optionally within a half-open
+    [start_ms, end_ms) window. Pages are keyset-paginated on (timestamp, id):
+    pass the returned next key as `after` to get the page that follows.
+    Returns (meals, next_key), next_key None on the last page.
+    """
+    query = "SELECT * FROM meals WHERE user_id = %s"
+    params = [user_id]
+    if start_ms is not None:
+        query += " AND timestamp >= %s"
+        params.append(start_ms)
+    if end_ms is not None:
+        query += " AND timestamp < %s"
+        params.append(end_ms)
+    if after is not None:
+        # Row comparison, served by idx_meals_user_timestamp_id
+        query += " AND (timestamp, id) < (%s, %s)"
+        params.extend(after)
+    # One extra row says whether there is a next page
+    query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, tuple(params))
+        rows = cur.fetchall()
+
+    next_key = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_key = (rows[-1]['timestamp'], rows[-1]['id'])
+    return [_meal_record(m) for m in rows], next_key
 
 def get_recent_meal_matches(user_id, query, limit=3):
     """
-    Return the user's most recent logged meals (within the last 30 days) whose
-    food_name or brand_name matches query (case-insensitive substring),
-    deduplicated by food_name, most recent first.
+    Return the user's logged meals (within the last 30 days) whose food_name or
+    brand_name matches query, deduplicated by food_name. Substring hits rank
+    ahead of typo-tolerant (trigram word similarity) hits, then by closeness of
+    the match, then most recent first.
     """
     import time
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cutoff_timestamp = int(time.time() * 1000) - (30 * 24 * 60 * 60 * 1000)
-        # DISTINCT ON collapses each distinct food name to its most recent entry
+        # DISTINCT ON collapses each distinct food name to its most recent entry.
+        # LIKE '%q%' and <% (word similarity) are both served by the trigram
+        # indexes on LOWER(food_name)/LOWER(brand_name); the outer ORDER BY/LIMIT
+        # keeps the ranking in the database.
         cur.execute("""
-            SELECT DISTINCT ON (LOWER(food_name)) *,
-                COALESCE(serving_size, 1.0) AS serving_size,
-                COALESCE(serving_unit, '') AS serving_unit
-            FROM meals
-            WHERE user_id = %s AND timestamp >= %s AND (LOWER(food_name) LIKE %s OR LOWER(brand_name) LIKE %s)
-            ORDER BY LOWER(food_name), timestamp DESC
-        """, (user_id, cutoff_timestamp, f'%{query}%', f'%{query}%'))
+            SELECT * FROM (
+                SELECT DISTINCT ON (LOWER(food_name)) *,
+                    COALESCE(serving_size, 1.0) AS serving_size,
+                    COALESCE(serving_unit, '') AS serving_unit,
+                    (LOWER(food_name) LIKE %(pattern)s OR COALESCE(LOWER(brand_name) LIKE %(pattern)s, false)) AS is_substring,
+                    GREATEST(word_similarity(%(query)s, LOWER(food_name)),
+                             word_similarity(%(query)s, COALESCE(LOWER(brand_name), ''))) AS match_score
+                FROM meals
+                WHERE user_id = %(user_id)s AND timestamp >= %(cutoff)s
+                AND (LOWER(food_name) LIKE %(pattern)s OR LOWER(brand_name) LIKE %(pattern)s
+                     OR %(query)s <%% LOWER(food_name) OR %(query)s <%% LOWER(brand_name))
+                ORDER BY LOWER(food_name), timestamp DESC
+            ) AS latest
+            ORDER BY is_substring DESC, match_score DESC, timestamp DESC
+            LIMIT %(limit)s
+        """, {
+            'user_id': user_id,
+            'cutoff': cutoff_timestamp,
+            'query': query.lower(),
+            'pattern': f'%{query.lower()}%',
+            'limit': limit
+        })
         rows = cur.fetchall()
 
-        rows.sort(key=lambda r: r['timestamp'], reverse=True)
-        rows = rows[:limit]
-
         results = []
         for m in rows:
             results.append({
@@ -502,62 +545,154 @@ def get_recent_meal_matches(user_id, query, limit=3):
                 'fromHistory': True
             })
         return results
-    finally:
-        conn.close()
 
-def add_meal(meal_data):
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        
-        # Handle optional fields safely
-        serving_size = meal_data.get('servingSize', 1.0)
-        serving_unit = meal_data.get('servingUnit', '')
-        nutrition = meal_data.get('nutrition', {})
-        
-        cur.execute("""
-            INSERT INTO meals (id, user_id, food_name, brand_name, meal_type, calories, protein, carbs, fat,
+class IdConflict(Exception):
+    """A write's client-made id belongs to another user's row. Routes answer 409."""
+
+def _check_replay(cur, table, row_id, user_id):
+    """
+    The existing row behind an insert that hit ON CONFLICT (id): a replay of an
+    earlier write by the same user. Raises IdConflict if another user owns the id.
+    """
+    cur.execute(f"SELECT * FROM {table} WHERE id = %s AND user_id = %s", (row_id, user_id))
+    row = cur.fetchone()
+    if row is None:
+        raise IdConflict(f"{table} id {row_id} is already in use")
+    return row
+
+# meals columns an insert writes, in _meal_row's order
+MEAL_INSERT_COLUMNS = """id, user_id, food_name, brand_name, meal_type, calories, protein, carbs, fat,
                              cholesterol, sodium, fiber, sugar, saturated_fat, trans_fat,
                              polyunsaturated_fat, monounsaturated_fat, added_sugar,
                              vitamin_d, calcium, iron, potassium, vitamin_c,
-                             serving_size, serving_unit, timestamp)
+                             serving_size, serving_unit, timestamp"""
+
+def _meal_row(meal_data):
+    """A meal record as a tuple of MEAL_INSERT_COLUMNS values."""
+    # Handle optional fields safely
+    serving_size = meal_data.get('servingSize', 1.0)
+    serving_unit = meal_data.get('servingUnit', '')
+    nutrition = meal_data.get('nutrition', {})
+    return (
+        meal_data['id'],
+        meal_data['userId'],
+        meal_data['foodName'],
+        meal_data.get('brandName'),
+        meal_data['mealType'],
+        nutrition.get('calories', 0),
+        nutrition.get('protein', 0),
+        nutrition.get('carbs', 0),
+        nutrition.get('fat', 0),
+        nutrition.get('cholesterol'),
+        nutrition.get('sodium'),
+        nutrition.get('fiber'),
+        nutrition.get('sugar'),
+        nutrition.get('saturatedFat'),
+        nutrition.get('transFat'),
+        nutrition.get('polyunsaturatedFat'),
+        nutrition.get('monounsaturatedFat'),
+        nutrition.get('addedSugar'),
+        nutrition.get('vitaminD'),
+        nutrition.get('calcium'),
+        nutrition.get('iron'),
+        nutrition.get('potassium'),
+        nutrition.get('vitaminC'),
+        serving_size,
+        serving_unit,
+        meal_data['timestamp']
+    )
+
+def add_meal(meal_data):
+    """
+    Insert a meal. Idempotent on its client-made id: posting the same meal again
+    (an offline outbox replaying after a lost response) changes nothing.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        
+        cur.execute(f"""
+            INSERT INTO meals ({MEAL_INSERT_COLUMNS})
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            meal_data['id'],
-            meal_data['userId'],
-            meal_data['foodName'],
-            meal_data.get('brandName'),
-            meal_data['mealType'],
-            nutrition.get('calories', 0),
-            nutrition.get('protein', 0),
-            nutrition.get('carbs', 0),
-            nutrition.get('fat', 0),
-            nutrition.get('cholesterol'),
-            nutrition.get('sodium'),
-            nutrition.get('fiber'),
-            nutrition.get('sugar'),
-            nutrition.get('saturatedFat'),
-            nutrition.get('transFat'),
-            nutrition.get('polyunsaturatedFat'),
-            nutrition.get('monounsaturatedFat'),
-            nutrition.get('addedSugar'),
-            nutrition.get('vitaminD'),
-            nutrition.get('calcium'),
-            nutrition.get('iron'),
-            nutrition.get('potassium'),
-            nutrition.get('vitaminC'),
-            serving_size,
-            serving_unit,
-            meal_data['timestamp']
-        ))
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id
+        """, _meal_row(meal_data))
+        if cur.fetchone() is None:
+            _check_replay(cur, 'meals', meal_data['id'], meal_data['userId'])
+            return meal_data
+        refresh_rollups(cur, meal_data['userId'], 'meal', meal_data['timestamp'])
         conn.commit()
         return meal_data
-    finally:
-        conn.close()
+
+def _batch_outcomes(cur, table, records, inserted):
+    """
+    Sort a batch insert's records into those it inserted and the rest: replays of
+    rows the same user already has ('replayed') or ids another user owns (an
+    error with code 409, as IdConflict). Returns one {'status', ...} per record,
+    in order.
+    """
+    missed = [r['id'] for r in records if r['id'] not in inserted]
+    owners = {}
+    if missed:
+        cur.execute(f"SELECT * FROM {table} WHERE id = ANY(%s)", (missed,))
+        owners = {row['id']: row for row in cur.fetchall()}
+
+    outcomes = []
+    claimed = set()
+    for record in records:
+        row_id = record['id']
+        if row_id in inserted and row_id not in claimed:
+            claimed.add(row_id)
+            outcomes.append({'status': 'created', 'row': inserted[row_id]})
+            continue
+        # A second copy of an id within this batch reads like a replay of the first
+        existing = inserted.get(row_id) or owners.get(row_id)
+        if existing is not None and existing['user_id'] == record['userId']:
+            outcomes.append({'status': 'replayed', 'row': existing})
+        else:
+            outcomes.append({'status': 'error', 'code': 409, 'error': f"{table} id {row_id} is already in use"})
+    return outcomes
+
+def _refresh_batch_rollups(cur, rows, event_type_key):
+    """refresh_rollups once per (user, event type) across the span of rows' timestamps."""
+    spans = {}
+    for row in rows:
+        key = (row['user_id'], event_type_key(row))
+        first, last = spans.get(key, (row['timestamp'], row['timestamp']))
+        spans[key] = (min(first, row['timestamp']), max(last, row['timestamp']))
+    # Sorted, so concurrent batches take the per-user rollup locks in one order
+    for (user_id, event_type_id), (first, last) in sorted(spans.items()):
+        refresh_rollups(cur, user_id, event_type_id, first, last)
+
+def add_meals(meals):
+    """
+    Insert many meals in one transaction, idempotent per id like add_meal.
+    Returns one {'status': 'created' | 'replayed' | 'error', ...} per meal, in
+    order; 'created' and 'replayed' carry the meal, 'error' an 'error' message.
+    """
+    if not meals:
+        return []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        rows = execute_values(cur, f"""
+            INSERT INTO meals ({MEAL_INSERT_COLUMNS})
+            VALUES %s
+            ON CONFLICT (id) DO NOTHING
+            RETURNING id, user_id, timestamp
+        """, [_meal_row(m) for m in meals], page_size=len(meals), fetch=True)
+        inserted = {row['id']: row for row in rows}
+
+        outcomes = _batch_outcomes(cur, 'meals', meals, inserted)
+        _refresh_batch_rollups(cur, inserted.values(), lambda row: 'meal')
+        conn.commit()
+
+    return [
+        {'status': o['status'], 'code': o['code'], 'error': o['error']} if o['status'] == 'error'
+        else {'status': o['status'], 'meal': meal}
+        for meal, o in zip(meals, outcomes)
+    ]
 
 def update_meal(meal_id, user_id, updates):
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Build dynamic update query
@@ -648,26 +783,33 @@ def update_meal(meal_id, user_id, updates):
         if not fields:
             return False
 
-        query = f"UPDATE meals SET {', '.join(fields)} WHERE id = %s AND user_id = %s"
+        # The meal's current day needs its rollups refreshed too if it moves.
+        cur.execute("SELECT timestamp FROM meals WHERE id = %s AND user_id = %s FOR UPDATE", (meal_id, user_id))
+        existing = cur.fetchone()
+
+        query = f"UPDATE meals SET {', '.join(fields)} WHERE id = %s AND user_id = %s RETURNING timestamp"
         values.extend([meal_id, user_id])
         
         cur.execute(query, tuple(values))
-        updated = cur.rowcount > 0
+        result = cur.fetchone()
+        updated = result is not None
+        if updated:
+            refresh_rollups(cur, user_id, 'meal', existing['timestamp'])
+            if result['timestamp'] != existing['timestamp']:
+                refresh_rollups(cur, user_id, 'meal', result['timestamp'])
         conn.commit()
         return updated
-    finally:
-        conn.close()
 
 def delete_meal(meal_id, user_id):
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
-        cur.execute("DELETE FROM meals WHERE id = %s AND user_id = %s", (meal_id, user_id))
-        deleted = cur.rowcount > 0
+        cur.execute("DELETE FROM meals WHERE id = %s AND user_id = %s RETURNING timestamp", (meal_id, user_id))
+        result = cur.fetchone()
+        deleted = result is not None
+        if deleted:
+            refresh_rollups(cur, user_id, 'meal', result['timestamp'])
         conn.commit()
         return deleted
-    finally:
-        conn.close()
 
 
 # ============================================================================
@@ -676,19 +818,27 @@ def delete_meal(meal_id, user_id):
 
 def get_event_types(user_id=None, category=None, include_inactive=False):
     """Get event types. If user_id is provided, includes both system and user-defined types."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
-        # Modified query to include favorite status via JOIN
+        # Modified query to include favorite status via JOIN.
+        # Last-used timestamps come from correlated MAX() subqueries, each a single
+        # probe of idx_events_user_type_timestamp / idx_meals_user_timestamp_id,
+        # rather than aggregating every event the user has logged.
         query = """
             SELECT et.*, 
-                   CASE WHEN fet.user_id IS NOT NULL THEN true ELSE false END as is_user_favorite
+                   CASE WHEN fet.user_id IS NOT NULL THEN true ELSE false END as is_user_favorite,
+                   CASE WHEN et.id = 'meal'
+                        THEN COALESCE(
+                            (SELECT MAX(m.timestamp) FROM meals m WHERE m.user_id = %s),
+                            (SELECT MAX(e.timestamp) FROM events e WHERE e.user_id = %s AND e.event_type_id = et.id))
+                        ELSE (SELECT MAX(e.timestamp) FROM events e WHERE e.user_id = %s AND e.event_type_id = et.id)
+                   END AS last_ts
             FROM event_types et
             LEFT JOIN favorite_event_types fet ON et.id = fet.event_type_id AND fet.user_id = %s
             WHERE 1=1
         """
-        params = [user_id]
+        params = [user_id, user_id, user_id, user_id]
         
         # Filter by user (system types have NULL user_id)
         if user_id is not None:
@@ -711,33 +861,10 @@ def get_event_types(user_id=None, category=None, include_inactive=False):
         cur.execute(query, tuple(params))
         event_types = cur.fetchall()
         
-        # Determine last used timestamp for each event type
-        # 1. Get max timestamp from events table grouped by event_type_id
-        et_last_used = {}
-        if user_id:
-            cur.execute("""
-                SELECT event_type_id, MAX(timestamp) as last_ts
-                FROM events
-                WHERE user_id = %s
-                GROUP BY event_type_id
-            """, (user_id,))
-            for row in cur.fetchall():
-                et_last_used[row['event_type_id']] = row['last_ts']
-            
-            # 2. Get max timestamp for meals
-            cur.execute("""
-                SELECT MAX(timestamp) as last_ts
-                FROM meals
-                WHERE user_id = %s
-            """, (user_id,))
-            meal_last = cur.fetchone()
-            if meal_last and meal_last['last_ts']:
-                 et_last_used['meal'] = meal_last['last_ts']
-
         # Convert to list of dicts with parsed field_schema
         results = []
         for et in event_types:
-            last_used = et_last_used.get(et['id'], 0)
+            last_used = et['last_ts'] or 0
             
             results.append({
                 'id': et['id'],
@@ -758,13 +885,10 @@ def get_event_types(user_id=None, category=None, include_inactive=False):
             })
         
         return results
-    finally:
-        conn.close()
 
 def get_event_type(event_type_id):
     """Get a specific event type by ID."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM event_types WHERE id = %s", (event_type_id,))
         et = cur.fetchone()
@@ -772,30 +896,11 @@ def get_event_type(event_type_id):
         if not et:
             return None
         
-        return {
-            'id': et['id'],
-            'userId': et['user_id'],
-            'category': et['category'],
-            'name': et['name'],
-            'icon': et['icon'],
-            'color': et['color'],
-            'fieldSchema': et['field_schema'],
-            'aggregationType': et['aggregation_type'],
-            'primaryUnit': et['primary_unit'],
-            'primaryUnit': et['primary_unit'],
-            'trackingType': et.get('tracking_type', 'count'),
-            'isFavorite': et.get('is_favorite', False),
-            'isActive': et['is_active'],
-            'createdAt': et['created_at'].isoformat() if et['created_at'] else None,
-            'updatedAt': et['updated_at'].isoformat() if et['updated_at'] else None
-        }
-    finally:
-        conn.close()
+        return _event_type_record(et)
 
 def create_event_type(user_id, event_type_data):
     """Create a custom event type."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Generate ID from name (lowercase, replace spaces with underscores)
@@ -837,16 +942,10 @@ def create_event_type(user_id, event_type_data):
             'isFavorite': result.get('is_favorite', False),
             'isActive': result['is_active']
         }
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
 
 def update_event_type(event_type_id, user_id, updates):
     """Update a custom event type (only user-defined types can be updated)."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Build dynamic update query
@@ -889,25 +988,19 @@ def update_event_type(event_type_id, user_id, updates):
         updated = cur.rowcount > 0
         conn.commit()
         return updated
-    finally:
-        conn.close()
 
 def delete_event_type(event_type_id, user_id):
     """Soft delete an event type."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("UPDATE event_types SET is_active = false WHERE id = %s AND user_id = %s", (event_type_id, user_id))
         deleted = cur.rowcount > 0
         conn.commit()
         return deleted
-    finally:
-        conn.close()
 
 def toggle_event_type_favorite(user_id, event_type_id, is_favorite):
     """Toggle favorite status for an event type."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         if is_favorite:
             # Add to favorites
@@ -924,8 +1017,6 @@ def toggle_event_type_favorite(user_id, event_type_id, is_favorite):
             """, (user_id, event_type_id))
         conn.commit()
         return True
-    finally:
-        conn.close()
 
 
 # ============================================================================
@@ -934,8 +1025,7 @@ def toggle_event_type_favorite(user_id, event_type_id, is_favorite):
 
 def set_goal(user_id, event_type_id, target_value, period='daily'):
     """Set or update a goal for an event type."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Check if goal exists to update or insert
@@ -965,51 +1055,36 @@ def set_goal(user_id, event_type_id, target_value, period='daily'):
             
         conn.commit()
         return {'id': goal_id, 'userId': user_id, 'eventTypeId': event_type_id, 'targetValue': target_value, 'period': period}
-    finally:
-        conn.close()
 
 def get_user_goals(user_id):
     """Get all goals for a user."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT * FROM goals WHERE user_id = %s
         """, (user_id,))
         goals = cur.fetchall()
         
-        return [{
-            'id': g['id'],
-            'userId': g['user_id'],
-            'eventTypeId': g['event_type_id'],
-            'targetValue': g['target_value'],
-            'period': g['period'],
-            'createdAt': g['created_at'].isoformat() if g['created_at'] else None
-        } for g in goals]
-    finally:
-        conn.close()
+        return [_goal_record(g) for g in goals]
 
 def delete_goal(goal_id, user_id):
     """Delete a goal."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM goals WHERE id = %s AND user_id = %s", (goal_id, user_id))
         deleted = cur.rowcount > 0
         conn.commit()
         return deleted
-    finally:
-        conn.close()
 
 def log_event(event_data):
-    """Log a new event."""
-    conn = get_db_connection()
-    try:
+    """Log a new event. Idempotent on its client-made id, like add_meal."""
+    with db_connection() as conn:
         cur = conn.cursor()
         
         cur.execute("""
             INSERT INTO events (id, user_id, event_type_id, timestamp, category, data, notes)
             VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO NOTHING
             RETURNING *
         """, (
             event_data['id'],
@@ -1022,38 +1097,71 @@ def log_event(event_data):
         ))
         
         result = cur.fetchone()
-        conn.commit()
+        if result is None:
+            return _event_record(_check_replay(cur, 'events', event_data['id'], event_data['userId']))
+        refresh_rollups(cur, result['user_id'], result['event_type_id'], result['timestamp'])
         
-        # Trigger weight auto-fill if this is a weight event
+        # Weight auto-fill runs in the background once this commits
+        refill_job = None
         if event_data['eventTypeId'] == 'weight':
-            try:
-                fill_and_interpolate_weight_data(event_data['userId'], event_data['timestamp'])
-            except Exception as e:
-                print(f"Warning: Failed to auto-fill weight data: {e}")
+            refill_job = _enqueue_weight_refill(cur, event_data['userId'], [event_data['timestamp']])
+        conn.commit()
+        jobs.dispatch(refill_job)
         
-        return {
-            'id': result['id'],
-            'userId': result['user_id'],
-            'eventTypeId': result['event_type_id'],
-            'timestamp': result['timestamp'],
-            'category': result['category'],
-            'data': result['data'],
-            'notes': result['notes'],
-            'createdAt': result['created_at'].isoformat() if result['created_at'] else None
-        }
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+        return _event_record(result)
+
+def log_events(events):
+    """
+    Log many events in one transaction, idempotent per id like log_event, with
+    at most one weight refill queued per user. Returns one {'status', ...} per
+    event, in order, like add_meals; 'created' and 'replayed' carry the event.
+    """
+    if not events:
+        return []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        rows = execute_values(cur, """
+            INSERT INTO events (id, user_id, event_type_id, timestamp, category, data, notes)
+            VALUES %s
+            ON CONFLICT (id) DO NOTHING
+            RETURNING *
+        """, [(
+            e['id'],
+            e['userId'],
+            e['eventTypeId'],
+            e['timestamp'],
+            e['category'],
+            json.dumps(e['data']),
+            e.get('notes', '')
+        ) for e in events], page_size=len(events), fetch=True)
+        inserted = {row['id']: row for row in rows}
+
+        outcomes = _batch_outcomes(cur, 'events', events, inserted)
+        _refresh_batch_rollups(cur, inserted.values(), lambda row: row['event_type_id'])
+
+        # One background weight refill per user, around every new weigh-in
+        weigh_ins = {}
+        for row in inserted.values():
+            if row['event_type_id'] == 'weight':
+                weigh_ins.setdefault(row['user_id'], []).append(row['timestamp'])
+        refill_jobs = [_enqueue_weight_refill(cur, user_id, sorted(timestamps))
+                       for user_id, timestamps in weigh_ins.items()]
+        conn.commit()
+        for job_id in refill_jobs:
+            jobs.dispatch(job_id)
+
+    return [
+        {'status': o['status'], 'code': o['code'], 'error': o['error']} if o['status'] == 'error'
+        else {'status': o['status'], 'event': _event_record(o['row'])}
+        for o in outcomes
+    ]
 
 def upsert_daily_event(user_id, event_type_id, date_str, data, category):
     """
     Update or Insert an event for a specific day.
     Useful for synced data like steps where we want the 'latest' total for the day.
     """
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Check for existing event of this type on this day
@@ -1091,7 +1199,7 @@ def upsert_daily_event(user_id, event_type_id, date_str, data, category):
         search_note = f"iOS Sync: {date_str}"
         
         cur.execute("""
-            SELECT id FROM events 
+            SELECT id, timestamp FROM events 
             WHERE user_id = %s 
             AND event_type_id = %s 
             AND notes = %s
@@ -1138,20 +1246,18 @@ def upsert_daily_event(user_id, event_type_id, date_str, data, category):
                 VALUES (%s, %s, %s, %s, %s, %s, %s)
             """, (new_id, user_id, event_type_id, timestamp, category, json.dumps(data), search_note))
             action = 'created'
+
+        refresh_rollups(cur, user_id, event_type_id, timestamp)
+        if existing and existing['timestamp'] != timestamp:
+            refresh_rollups(cur, user_id, event_type_id, existing['timestamp'])
             
         conn.commit()
         return {'id': new_id, 'action': action}
         
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
 
 def get_events(user_id, filters=None):
     """Get events with optional filtering."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         query = "SELECT * FROM events WHERE user_id = %s"
@@ -1183,27 +1289,11 @@ def get_events(user_id, filters=None):
         cur.execute(query, tuple(params))
         events = cur.fetchall()
         
-        results = []
-        for event in events:
-            results.append({
-                'id': event['id'],
-                'userId': event['user_id'],
-                'eventTypeId': event['event_type_id'],
-                'timestamp': event['timestamp'],
-                'category': event['category'],
-                'data': event['data'],
-                'notes': event['notes'],
-                'createdAt': event['created_at'].isoformat() if event['created_at'] else None
-            })
-        
-        return results
-    finally:
-        conn.close()
+        return [_event_record(event) for event in events]
 
 def get_event(event_id, user_id):
     """Get a specific event."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM events WHERE id = %s AND user_id = %s", (event_id, user_id))
         event = cur.fetchone()
@@ -1211,23 +1301,11 @@ def get_event(event_id, user_id):
         if not event:
             return None
         
-        return {
-            'id': event['id'],
-            'userId': event['user_id'],
-            'eventTypeId': event['event_type_id'],
-            'timestamp': event['timestamp'],
-            'category': event['category'],
-            'data': event['data'],
-            'notes': event['notes'],
-            'createdAt': event['created_at'].isoformat() if event['created_at'] else None
-        }
-    finally:
-        conn.close()
+        return _event_record(event)
 
 def update_event(event_id, user_id, updates):
     """Update an event."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         fields = []
@@ -1249,54 +1327,318 @@ def update_event(event_id, user_id, updates):
             return False
         
         fields.append("updated_at = CURRENT_TIMESTAMP")
+
+        # The event's current day needs its rollups refreshed too if it moves.
+        cur.execute("SELECT timestamp FROM events WHERE id = %s AND user_id = %s FOR UPDATE", (event_id, user_id))
+        existing = cur.fetchone()
         
-        query = f"UPDATE events SET {', '.join(fields)} WHERE id = %s AND user_id = %s"
+        query = f"UPDATE events SET {', '.join(fields)} WHERE id = %s AND user_id = %s RETURNING event_type_id, timestamp"
         values.extend([event_id, user_id])
         
         cur.execute(query, tuple(values))
-        updated = cur.rowcount > 0
-        conn.commit()
-        
-        # Trigger weight auto-fill if this is a weight event
+        result = cur.fetchone()
+        updated = result is not None
         if updated:
-            # Get the event type to check if it's a weight event
-            cur.execute("SELECT event_type_id FROM events WHERE id = %s", (event_id,))
-            event = cur.fetchone()
-            if event and event['event_type_id'] == 'weight':
-                try:
-                    fill_and_interpolate_weight_data(user_id)
-                except Exception as e:
-                    print(f"Warning: Failed to auto-fill weight data: {e}")
+            refresh_rollups(cur, user_id, result['event_type_id'], existing['timestamp'])
+            if result['timestamp'] != existing['timestamp']:
+                refresh_rollups(cur, user_id, result['event_type_id'], result['timestamp'])
+        
+        # Weight auto-fill runs in the background once this commits
+        refill_job = None
+        if updated and result['event_type_id'] == 'weight':
+            # Both the day it left and the day it moved to
+            refill_job = _enqueue_weight_refill(cur, user_id, [existing['timestamp'], result['timestamp']])
+        conn.commit()
+        jobs.dispatch(refill_job)
         
         return updated
-    finally:
-        conn.close()
 
 def delete_event(event_id, user_id):
     """Delete an event."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Check if this is a weight event before deleting
-        cur.execute("SELECT event_type_id FROM events WHERE id = %s AND user_id = %s", (event_id, user_id))
+        cur.execute("SELECT event_type_id, timestamp FROM events WHERE id = %s AND user_id = %s", (event_id, user_id))
         event = cur.fetchone()
         is_weight_event = event and event['event_type_id'] == 'weight'
         
         cur.execute("DELETE FROM events WHERE id = %s AND user_id = %s", (event_id, user_id))
         deleted = cur.rowcount > 0
-        conn.commit()
+        if deleted:
+            refresh_rollups(cur, user_id, event['event_type_id'], event['timestamp'])
         
-        # Trigger weight auto-fill if this was a weight event
+        # Weight auto-fill runs in the background once this commits
+        refill_job = None
         if deleted and is_weight_event:
-            try:
-                fill_and_interpolate_weight_data(user_id)
-            except Exception as e:
-                print(f"Warning: Failed to auto-fill weight data: {e}")
+            refill_job = _enqueue_weight_refill(cur, user_id, [event['timestamp']])
+        conn.commit()
+        jobs.dispatch(refill_job)
         
         return deleted
-    finally:
-        conn.close()
+
+
+# ============================================================================
+# DAILY ROLLUP FUNCTIONS
+# ============================================================================
+
+# Chartable meal fields: frontend name -> meals column. Each one gets its own
+# daily_rollups row per day.
+MEAL_FIELD_COLUMNS = {
+    'calories': 'calories',
+    'protein': 'protein',
+    'carbs': 'carbs',
+    'fat': 'fat',
+    'fiber': 'fiber',
+    'sugar': 'sugar',
+    'cholesterol': 'cholesterol',
+    'sodium': 'sodium',
+    'saturatedFat': 'saturated_fat',
+    'transFat': 'trans_fat',
+    'polyunsaturatedFat': 'polyunsaturated_fat',
+    'monounsaturatedFat': 'monounsaturated_fat',
+    'addedSugar': 'added_sugar',
+    'vitaminD': 'vitamin_d',
+    'calcium': 'calcium',
+    'iron': 'iron',
+    'potassium': 'potassium',
+    'vitaminC': 'vitamin_c'
+}
+
+NUMERIC_TEXT_RE = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+
+def _json_number(key):
+    """SQL for events.data->key as a float (JSON numbers and numeric strings), else NULL."""
+    return (f"CASE jsonb_typeof(e.data->'{key}') "
+            f"WHEN 'number' THEN (e.data->>'{key}')::float "
+            f"WHEN 'string' THEN CASE WHEN e.data->>'{key}' ~ '{NUMERIC_TEXT_RE}' THEN (e.data->>'{key}')::float END "
+            f"END")
+
+# The first numeric field of an event, in JSONB key order (which is also the order
+# psycopg2 hands the dict to Python).
+FIRST_NUMERIC_SQL = """(
+    SELECT kv.value::text::float
+    FROM jsonb_each(e.data) WITH ORDINALITY AS kv(key, value, n)
+    WHERE jsonb_typeof(kv.value) = 'number'
+    ORDER BY kv.n
+    LIMIT 1
+)"""
+
+# An event's value as get_todays_stats reads it: data.value, else the first
+# numeric field, else 0.
+STAT_VALUE_SQL = f"""COALESCE(CASE
+    WHEN jsonb_typeof(e.data) <> 'object' THEN 0
+    WHEN e.data ? 'value' THEN {_json_number('value')}
+    ELSE {FIRST_NUMERIC_SQL}
+END, 0)"""
+
+# An event's value as get_chart_data reads it without a field override.
+CHART_VALUE_SQL = "COALESCE(CASE\n    WHEN jsonb_typeof(e.data) <> 'object' THEN 0\n" + "".join(
+    f"    WHEN e.data ? '{key}' THEN {_json_number(key)}\n"
+    for key in ('value', 'count', 'amount', 'duration', 'reps', 'rating')
+) + f"    ELSE {FIRST_NUMERIC_SQL}\nEND, 0)"
+
+# Real (not auto-filled) weigh-ins, as get_maintenance_calories reads them.
+WEIGH_IN_SQL = f"""CASE
+    WHEN e.event_type_id = 'weight' AND COALESCE(e.data->>'_auto_generated', 'false') <> 'true'
+    THEN {_json_number('weight')}
+END"""
+
+# Synthetic daily_rollups fields for events, one per read path's extraction rule.
+# migrate.py keeps a frozen copy of these rules for migration 5's backfill;
+# test_rollup_backfill.py checks that the two still agree.
+EVENT_ROLLUP_FIELDS = [
+    ('_stat', STAT_VALUE_SQL),
+    ('_chart', CHART_VALUE_SQL),
+    ('_weighin', WEIGH_IN_SQL),
+]
+
+ROLLUP_UPSERT_SQL = """
+    ON CONFLICT (user_id, event_type_id, field, local_day) DO UPDATE SET
+        value_sum = EXCLUDED.value_sum,
+        value_count = EXCLUDED.value_count,
+        value_min = EXCLUDED.value_min,
+        value_max = EXCLUDED.value_max,
+        value_last = EXCLUDED.value_last,
+        last_ts = EXCLUDED.last_ts
+"""
+
+def _rollup_day(timestamp_ms):
+    """The ROLLUP_TZ calendar day a millisecond timestamp falls on."""
+    return datetime.fromtimestamp(timestamp_ms / 1000, ROLLUP_ZONE).date()
+
+def _rollup_day_start(day):
+    """Millisecond timestamp of ROLLUP_TZ midnight at the start of day."""
+    return int(datetime.combine(day, dtime.min, ROLLUP_ZONE).timestamp() * 1000)
+
+def _rollups_cover(tz_name):
+    """Whether daily_rollups' day buckets are the local days of tz_name."""
+    return bool(tz_name) and tz_name == ROLLUP_TZ
+
+def _rollup_days(first_day, last_day):
+    days = []
+    day = first_day
+    while day <= last_day:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def write_rollups(cur, user_id=None, event_type_id=None, first_day=None, last_day=None):
+    """
+    Recompute daily_rollups from the meals and events tables. Each argument narrows
+    the rebuild: one user, one event type ('meal' means the meals table) and an
+    inclusive range of ROLLUP_TZ days. Returns the number of rows written. Caller commits.
+    """
+    params = {'tz': ROLLUP_TZ, 'user_id': user_id, 'event_type_id': event_type_id}
+    source_scope = []
+    rollup_scope = []
+    if user_id is not None:
+        source_scope.append("user_id = %(user_id)s")
+        rollup_scope.append("user_id = %(user_id)s")
+    if first_day is not None:
+        params['first_day'] = first_day
+        params['start'] = _rollup_day_start(first_day)
+        source_scope.append("timestamp >= %(start)s")
+        rollup_scope.append("local_day >= %(first_day)s")
+    if last_day is not None:
+        params['last_day'] = last_day
+        params['end'] = _rollup_day_start(last_day + timedelta(days=1))
+        source_scope.append("timestamp < %(end)s")
+        rollup_scope.append("local_day <= %(last_day)s")
+    if event_type_id is not None:
+        rollup_scope.append("event_type_id = %(event_type_id)s")
+
+    cur.execute(f"""
+        DELETE FROM daily_rollups
+        {'WHERE ' + ' AND '.join(rollup_scope) if rollup_scope else ''}
+    """, params)
+
+    written = 0
+    if event_type_id in (None, 'meal'):
+        meal_fields = ', '.join(f"('{field}', m.{column}::float)" for field, column in MEAL_FIELD_COLUMNS.items())
+        cur.execute(f"""
+            INSERT INTO daily_rollups (user_id, event_type_id, field, local_day,
+                                       value_sum, value_count, value_min, value_max, value_last, last_ts)
+            SELECT
+                m.user_id,
+                'meal',
+                f.field,
+                (to_timestamp(m.timestamp / 1000.0) AT TIME ZONE %(tz)s)::date AS local_day,
+                SUM(f.value),
+                COUNT(f.value),
+                MIN(f.value),
+                MAX(f.value),
+                (ARRAY_AGG(f.value ORDER BY m.timestamp DESC) FILTER (WHERE f.value IS NOT NULL))[1],
+                MAX(m.timestamp) FILTER (WHERE f.value IS NOT NULL)
+            FROM meals m
+            CROSS JOIN LATERAL (VALUES {meal_fields}) AS f(field, value)
+            {'WHERE ' + ' AND '.join('m.' + clause for clause in source_scope) if source_scope else ''}
+            GROUP BY m.user_id, f.field, local_day
+            HAVING COUNT(f.value) > 0
+            {ROLLUP_UPSERT_SQL}
+        """, params)
+        written += cur.rowcount
+
+    if event_type_id != 'meal':
+        event_scope = ['e.' + clause for clause in source_scope] + ["e.event_type_id <> 'meal'"]
+        if event_type_id is not None:
+            event_scope.append("e.event_type_id = %(event_type_id)s")
+        event_fields = ', '.join(f"('{field}', {expression})" for field, expression in EVENT_ROLLUP_FIELDS)
+        cur.execute(f"""
+            INSERT INTO daily_rollups (user_id, event_type_id, field, local_day,
+                                       value_sum, value_count, value_min, value_max, value_last, last_ts)
+            SELECT
+                e.user_id,
+                e.event_type_id,
+                f.field,
+                (to_timestamp(e.timestamp / 1000.0) AT TIME ZONE %(tz)s)::date AS local_day,
+                SUM(f.value),
+                COUNT(f.value),
+                MIN(f.value),
+                MAX(f.value),
+                (ARRAY_AGG(f.value ORDER BY e.timestamp DESC) FILTER (WHERE f.value IS NOT NULL))[1],
+                MAX(e.timestamp) FILTER (WHERE f.value IS NOT NULL)
+            FROM events e
+            CROSS JOIN LATERAL (VALUES {event_fields}) AS f(field, value)
+            WHERE {' AND '.join(event_scope)}
+            GROUP BY e.user_id, e.event_type_id, f.field, local_day
+            HAVING COUNT(f.value) > 0
+            {ROLLUP_UPSERT_SQL}
+        """, params)
+        written += cur.rowcount
+
+    return written
+
+def refresh_rollups(cur, user_id, event_type_id, start_ms, end_ms=None):
+    """
+    Recompute one user's rollups of one event type for every day between start_ms
+    and end_ms, inside the caller's write transaction. Caller commits.
+    """
+    if end_ms is None:
+        end_ms = start_ms
+    start_ms, end_ms = min(start_ms, end_ms), max(start_ms, end_ms)
+    cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (ROLLUP_LOCK_ID, user_id))
+    write_rollups(cur, user_id, event_type_id, _rollup_day(start_ms), _rollup_day(end_ms))
+
+def rebuild_rollups(user_id=None):
+    """Recompute daily_rollups for one user, or for everyone. Returns rows written."""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        if user_id is not None:
+            cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (ROLLUP_LOCK_ID, user_id))
+        written = write_rollups(cur, user_id)
+        conn.commit()
+        return written
+
+def _stat_value(aggr_type, value_sum, value_count, value_last, value_max):
+    """Apply an aggregation_type the way get_todays_stats does ('max' starts at 0)."""
+    if aggr_type in ('sum', 'sum_today'):
+        return value_sum
+    if aggr_type == 'count':
+        return value_count
+    if aggr_type == 'last':
+        return value_last
+    if aggr_type == 'max':
+        return max(value_max, 0)
+    return 0
+
+def _stats_from_rollups(cur, user_id, first_day, last_day):
+    """get_daily_stats' result for whole ROLLUP_TZ days, read from daily_rollups."""
+    cur.execute("SELECT id, aggregation_type, primary_unit FROM event_types WHERE user_id = %s OR user_id IS NULL", (user_id,))
+    event_types = {et['id']: et for et in cur.fetchall()}
+
+    results = {}
+    for day in _rollup_days(first_day, last_day):
+        results[day.isoformat()] = {'meal': {'value': 0, 'unit': 'kcal'}} if 'meal' in event_types else {}
+
+    cur.execute("""
+        SELECT event_type_id, field, local_day, value_sum, value_count, value_last, value_max
+        FROM daily_rollups
+        WHERE user_id = %s AND local_day >= %s AND local_day <= %s
+        AND ((event_type_id = 'meal' AND field IN ('calories', 'protein', 'carbs', 'fat')) OR field = '_stat')
+    """, (user_id, first_day, last_day))
+
+    for row in cur.fetchall():
+        et_id = row['event_type_id']
+        if et_id not in event_types:
+            continue
+
+        stats = results[row['local_day'].isoformat()]
+        if et_id == 'meal':
+            if row['field'] == 'calories':
+                stats['meal'] = {'value': row['value_sum'], 'unit': 'kcal'}
+            else:
+                stats[row['field']] = {'value': row['value_sum'], 'unit': 'g'}
+            continue
+
+        et = event_types[et_id]
+        stats[et_id] = {
+            'value': _stat_value(et.get('aggregation_type', 'sum'), row['value_sum'], row['value_count'],
+                                 row['value_last'], row['value_max']),
+            'unit': et.get('primary_unit', '')
+        }
+
+    return _add_virtual_weight_stats(cur, user_id, results, ROLLUP_ZONE)
 
 
 # ============================================================================
@@ -1305,8 +1647,7 @@ def delete_event(event_id, user_id):
 
 def get_stats_summary(user_id, start_date=None, end_date=None):
     """Get overall stats summary across all categories."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         query = """
@@ -1347,13 +1688,10 @@ def get_stats_summary(user_id, start_date=None, end_date=None):
             summary[category]['eventTypes'][row['event_type_id']] = row['event_count']
         
         return list(summary.values())
-    finally:
-        conn.close()
 
 def get_category_stats(user_id, category, start_date=None, end_date=None):
     """Get detailed stats for a specific category."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         query = """
@@ -1401,13 +1739,10 @@ def get_category_stats(user_id, category, start_date=None, end_date=None):
                     stats[event_type_id]['aggregatedData'][key] += value
         
         return list(stats.values())
-    finally:
-        conn.close()
 
 def get_event_type_stats(user_id, event_type_id, start_date=None, end_date=None):
     """Get detailed stats for a specific event type."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         query = """
@@ -1460,8 +1795,6 @@ def get_event_type_stats(user_id, event_type_id, start_date=None, end_date=None)
             }
         
         return stats
-    finally:
-        conn.close()
 
 def get_todays_stats(user_id, start_timestamp=None, end_timestamp=None):
     """Get aggregated stats for today for all event types."""
@@ -1478,9 +1811,14 @@ def get_todays_stats(user_id, start_timestamp=None, end_timestamp=None):
         # Default to 24 hour window
         end_timestamp = start_timestamp + (24 * 60 * 60 * 1000)
 
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
+
+        # A window that is exactly one ROLLUP_TZ day is a single rollup lookup.
+        day = _rollup_day(start_timestamp)
+        if (_rollup_day_start(day) == start_timestamp
+                and _rollup_day_start(day + timedelta(days=1)) == end_timestamp):
+            return _stats_from_rollups(cur, user_id, day, day)[day.isoformat()]
         
         results = {}
         
@@ -1576,17 +1914,120 @@ def get_todays_stats(user_id, start_timestamp=None, end_timestamp=None):
                 'value': val,
                 'unit': event_types[et_id].get('primary_unit', '')
             }
+        
+        # The window carries no zone; take its day as the ROLLUP_TZ day it starts on
+        day = _rollup_day(start_timestamp).isoformat()
+        return _add_virtual_weight_stats(cur, user_id, {day: results}, ROLLUP_ZONE)[day]
             
-        return results
-            
-    finally:
-        conn.close()
-
-# ============================================================================
-# CHART DATA FUNCTIONS
-# ============================================================================
 
-def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_overrides=None, field_overrides=None, granularity='day', timezone_offset=0):
+def get_daily_stats(user_id, start_timestamp, end_timestamp, tz_name):
+    """
+    get_todays_stats for every local day in [start_timestamp, end_timestamp) at once.
+
+    Rows are bucketed by local calendar day in the IANA zone tz_name and each event
+    type's aggregation_type is applied in SQL, so any range costs two queries rather
+    than three per day. Returns {'YYYY-MM-DD': stats} with an entry for every local
+    day the window touches, each in get_todays_stats' shape.
+
+    When tz_name is ROLLUP_TZ the days come straight from daily_rollups instead.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        if _rollups_cover(tz_name):
+            return _stats_from_rollups(cur, user_id, _rollup_day(start_timestamp), _rollup_day(end_timestamp - 1))
+
+        # 1. Meal totals per local day, with every day in the window present so
+        #    empty days still report 0 kcal like get_todays_stats does.
+        cur.execute("""
+            WITH days AS (
+                SELECT d::date AS local_day
+                FROM generate_series(
+                    (to_timestamp(%(start)s / 1000.0) AT TIME ZONE %(tz)s)::date,
+                    (to_timestamp((%(end)s - 1) / 1000.0) AT TIME ZONE %(tz)s)::date,
+                    interval '1 day'
+                ) AS d
+            ),
+            meal_days AS (
+                SELECT
+                    (to_timestamp(timestamp / 1000.0) AT TIME ZONE %(tz)s)::date AS local_day,
+                    SUM(calories) AS total_calories,
+                    SUM(protein) AS total_protein,
+                    SUM(carbs) AS total_carbs,
+                    SUM(fat) AS total_fat
+                FROM meals
+                WHERE user_id = %(user_id)s AND timestamp >= %(start)s AND timestamp < %(end)s
+                GROUP BY 1
+            )
+            SELECT days.local_day, meal_days.total_calories, meal_days.total_protein,
+                   meal_days.total_carbs, meal_days.total_fat,
+                   EXISTS (
+                       SELECT 1 FROM event_types
+                       WHERE id = 'meal' AND (user_id = %(user_id)s OR user_id IS NULL)
+                   ) AS has_meal_type
+            FROM days LEFT JOIN meal_days USING (local_day)
+            ORDER BY days.local_day
+        """, {'user_id': user_id, 'start': start_timestamp, 'end': end_timestamp, 'tz': tz_name})
+
+        results = {}
+        for row in cur.fetchall():
+            stats = {}
+            if row['has_meal_type']:
+                stats['meal'] = {'value': row['total_calories'] or 0, 'unit': 'kcal'}
+                if row['total_protein'] is not None:
+                    stats['protein'] = {'value': row['total_protein'], 'unit': 'g'}
+                if row['total_carbs'] is not None:
+                    stats['carbs'] = {'value': row['total_carbs'], 'unit': 'g'}
+                if row['total_fat'] is not None:
+                    stats['fat'] = {'value': row['total_fat'], 'unit': 'g'}
+            results[row['local_day'].isoformat()] = stats
+
+        # 2. Every other event type per local day, valued as get_todays_stats
+        #    values them (STAT_VALUE_SQL).
+        cur.execute(f"""
+            WITH valued AS (
+                SELECT
+                    e.event_type_id,
+                    e.timestamp,
+                    (to_timestamp(e.timestamp / 1000.0) AT TIME ZONE %(tz)s)::date AS local_day,
+                    et.aggregation_type,
+                    et.primary_unit,
+                    {STAT_VALUE_SQL} AS value
+                FROM events e
+                JOIN event_types et
+                    ON et.id = e.event_type_id AND (et.user_id = %(user_id)s OR et.user_id IS NULL)
+                WHERE e.user_id = %(user_id)s AND e.timestamp >= %(start)s AND e.timestamp < %(end)s
+                AND e.event_type_id <> 'meal'
+            )
+            SELECT
+                local_day,
+                event_type_id,
+                MAX(aggregation_type) AS aggregation_type,
+                MAX(primary_unit) AS primary_unit,
+                SUM(value) AS sum_value,
+                COUNT(*) AS count_value,
+                (ARRAY_AGG(value ORDER BY timestamp DESC))[1] AS last_value,
+                MAX(value) AS max_value
+            FROM valued
+            GROUP BY local_day, event_type_id
+        """, {'user_id': user_id, 'start': start_timestamp, 'end': end_timestamp, 'tz': tz_name})
+
+        for row in cur.fetchall():
+            day = results.setdefault(row['local_day'].isoformat(), {})
+            day[row['event_type_id']] = {
+                'value': _stat_value(row['aggregation_type'], row['sum_value'], row['count_value'],
+                                     row['last_value'], row['max_value']),
+                'unit': row['primary_unit']
+            }
+
+        return _add_virtual_weight_stats(cur, user_id, results, ZoneInfo(tz_name))
+
+
+# ============================================================================
+# CHART DATA FUNCTIONS
+# ============================================================================
+
+def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_overrides=None, field_overrides=None, granularity='day', timezone_offset=0, tz_name=None, max_points=None):
     """
     Get chart data for multiple event types, aggregated by day or hour.
     
@@ -1597,12 +2038,18 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
         end_date: End timestamp in milliseconds (UTC timestamp of user's local end time)
         aggregation_overrides: Dict of {eventTypeId: aggregationType} for per-series overrides
         field_overrides: Dict of {eventTypeId: fieldName} for specifying which field to extract
-        granularity: 'day' (default) or 'hour'
+        granularity: 'day' (default), 'hour', 'week' (Monday start), 'month' or 'year'
         timezone_offset: Client timezone offset in minutes (UTC - Local). e.g. PST is 480.
+            Only used when tz_name is missing or unknown.
+        tz_name: Optional client IANA timezone; buckets follow its local time across
+            DST changes. Day and longer charts in ROLLUP_TZ (without event field
+            overrides) are read from daily_rollups.
+        max_points: Optional cap on the number of labels. Longer charts are thinned
+            with LTTB (see timeseries.py), keeping each series' peaks and troughs.
     
     Returns:
         {
-            labels: ["2026-01-12", "2026-01-13", ...],
+            labels: ["2026-01-12", "2026-01-13", ...],  # "2026-01" for months, "2026" for years
             datasets: [...]
         }
     """
@@ -1612,9 +2059,16 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
         aggregation_overrides = {}
     if field_overrides is None:
         field_overrides = {}
+
+    # Rollups only hold each event's default value, so a field override on an
+    # event series needs the raw rows. Meal fields are all rolled up.
+    use_rollups = (
+        granularity != 'hour'
+        and _rollups_cover(tz_name)
+        and not any(et_id != 'meal' for et_id in field_overrides if et_id in event_type_ids)
+    )
     
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # 1. Get event type metadata
@@ -1628,17 +2082,32 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
         event_types = {et['id']: et for et in cur.fetchall()}
         
         # 2. Generate labels from start to end (Adjusted to Local Time)
-        # Shift timestamps to user's local time frame for iteration
+        # Local wall-clock times in the client's zone, or shifted by its fixed offset
         tz_offset_ms = timezone_offset * 60 * 1000
-        adjusted_start_ms = start_date - tz_offset_ms
-        adjusted_end_ms = end_date - tz_offset_ms
-        
-        start_dt = datetime.utcfromtimestamp(adjusted_start_ms / 1000)
-        end_dt = datetime.utcfromtimestamp(adjusted_end_ms / 1000)
+        zone = _chart_zone(tz_name)
+        if zone:
+            start_dt = datetime.fromtimestamp(start_date / 1000, zone).replace(tzinfo=None)
+            end_dt = datetime.fromtimestamp(end_date / 1000, zone).replace(tzinfo=None)
+        else:
+            start_dt = datetime.utcfromtimestamp((start_date - tz_offset_ms) / 1000)
+            end_dt = datetime.utcfromtimestamp((end_date - tz_offset_ms) / 1000)
         
+        first_day, last_day = start_dt.date(), end_dt.date()
         labels = []
         
-        if granularity == 'hour':
+        if granularity == 'hour' and zone:
+            # Hourly labels: YYYY-MM-DD HH:00, stepping real hours so DST days
+            # have 23 or 24 distinct labels (the repeated fall-back hour is one label)
+            end_label = end_dt.strftime('%Y-%m-%d %H:00')
+            current_ms = start_date
+            while True:
+                label = datetime.fromtimestamp(current_ms / 1000, zone).strftime('%Y-%m-%d %H:00')
+                if label > end_label:
+                    break
+                if not labels or labels[-1] != label:
+                    labels.append(label)
+                current_ms += 3600000
+        elif granularity == 'hour':
             # Hourly labels: YYYY-MM-DD HH:00
             current = start_dt.replace(minute=0, second=0, microsecond=0)
             # Ensure we cover until end_dt
@@ -1646,141 +2115,32 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
                 labels.append(current.strftime('%Y-%m-%d %H:00'))
                 current += timedelta(hours=1)
         else:
-            # Daily labels: YYYY-MM-DD
-            current = start_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_day = end_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-            while current <= end_day:
-                labels.append(current.strftime('%Y-%m-%d'))
-                current += timedelta(days=1)
-        
-        # Separate meal type from other event types
-        has_meal = 'meal' in event_type_ids
-        other_event_type_ids = [et_id for et_id in event_type_ids if et_id != 'meal']
-        
-        # Structure: { eventTypeId: { 'LABEL': [values], ... } }
-        grouped = {et_id: {label: [] for label in labels} for et_id in event_type_ids}
-        
-        # Helper to get label from timestamp (Adjusted to Local Time)
-        def get_label_from_ts(ts):
-            adjusted_ts = ts - tz_offset_ms
-            dt = datetime.utcfromtimestamp(adjusted_ts / 1000)
-            if granularity == 'hour':
-                return dt.strftime('%Y-%m-%d %H:00')
-            else:
-                return dt.strftime('%Y-%m-%d')
-
-        # 3a. Handle MEAL type specially (from meals table)
-        if has_meal:
-            meal_field = field_overrides.get('meal', 'calories')
-            # Map frontend field names to DB column names
-            meal_field_map = {
-                'calories': 'calories',
-                'protein': 'protein',
-                'carbs': 'carbs',
-                'fat': 'fat',
-                'fiber': 'fiber',
-                'sugar': 'sugar',
-                'cholesterol': 'cholesterol',
-                'sodium': 'sodium',
-                'saturatedFat': 'saturated_fat',
-                'transFat': 'trans_fat',
-                'polyunsaturatedFat': 'polyunsaturated_fat',
-                'monounsaturatedFat': 'monounsaturated_fat',
-                'addedSugar': 'added_sugar',
-                'vitaminD': 'vitamin_d',
-                'calcium': 'calcium',
-                'iron': 'iron',
-                'potassium': 'potassium',
-                'vitaminC': 'vitamin_c'
-            }
-            db_field = meal_field_map.get(meal_field, 'calories')
-            
-            # Fetch raw timestamp, no DATE conversion in SQL
-            cur.execute(f"""
-                SELECT 
-                    {db_field} as value,
-                    timestamp
-                FROM meals
-                WHERE user_id = %s 
-                AND timestamp >= %s 
-                AND timestamp <= %s
-                ORDER BY timestamp ASC
-            """, (user_id, start_date, end_date))
-            
-            meal_rows = cur.fetchall()
-            for row in meal_rows:
-                date_str = get_label_from_ts(row['timestamp'])
-                
-                if date_str and date_str in grouped['meal']:
-                    val = row['value']
-                    if val is not None:
-                        grouped['meal'][date_str].append(float(val))
-        
-        # 3b. Query events for other event types
-        if other_event_type_ids:
-            other_placeholders = ','.join(['%s'] * len(other_event_type_ids))
-            
-            # Widen the search window by 24h to handle timezone offsets and edge cases
-            # so we don't miss events that belong to the first/last day labels
-            query_start = start_date - 86400000
-            query_end = end_date + 86400000
-            
-            cur.execute(f"""
-                SELECT 
-                    event_type_id,
-                    data,
-                    timestamp
-                FROM events
-                WHERE user_id = %s 
-                AND event_type_id IN ({other_placeholders})
-                AND timestamp >= %s 
-                AND timestamp <= %s
-                ORDER BY timestamp ASC
-            """, (user_id, *other_event_type_ids, query_start, query_end))
-            
-            events = cur.fetchall()
-            
-            for event in events:
-                et_id = event['event_type_id']
-                date_str = get_label_from_ts(event['timestamp'])
-                
-                if not date_str or date_str not in grouped[et_id]:
-                    continue
-                
-                # Extract numeric value from data
-                data = event['data']
-                value = 0
-                
-                # Use field override if specified
-                selected_field = field_overrides.get(et_id)
-                if selected_field and selected_field in data:
-                    val = data[selected_field]
-                    if isinstance(val, (int, float)) and not isinstance(val, bool):
-                        value = float(val)
-                elif 'value' in data:
-                    value = float(data['value'])
-                elif 'count' in data:
-                    value = float(data['count'])
-                elif 'amount' in data:
-                    value = float(data['amount'])
-                elif 'duration' in data:
-                    value = float(data['duration'])
-                elif 'reps' in data:
-                    value = float(data['reps'])
-                elif 'rating' in data:
-                    value = float(data['rating'])
-                elif isinstance(data, dict):
-                    # Fallback: take first numeric value
-                    for k, v in data.items():
-                        if isinstance(v, (int, float)) and not isinstance(v, bool):
-                            value = float(v)
-                            break
-                
-                grouped[et_id][date_str].append(value)
+            # YYYY-MM-DD days and week starts, YYYY-MM months, YYYY years
+            labels = _bucket_labels(first_day, last_day, granularity)
+        
+        # Structure: { eventTypeId: { 'LABEL': cell } }, where a cell summarizes the
+        # label's values as {sum, count, min, max, last}, or is None if it has none.
+        if use_rollups:
+            cells = _chart_cells_from_rollups(cur, user_id, event_type_ids, field_overrides, labels,
+                                              first_day, last_day, granularity)
+        else:
+            cells = _chart_cells_from_sql(cur, user_id, event_type_ids, field_overrides, labels,
+                                          start_date, end_date, first_day, last_day, granularity,
+                                          tz_name if zone else None, tz_offset_ms)
+        
+        # 3b. Weigh-ins that WEIGHT_FILL_MODE 'virtual' doesn't store
+        if WEIGHT_FILL_MODE == 'virtual' and 'weight' in cells and granularity == 'day' and labels:
+            tzinfo = zone or timezone(timedelta(minutes=-timezone_offset))
+            virtual = _virtual_weight_days(cur, user_id, first_day, last_day, tzinfo)
+            for day, values in virtual.items():
+                label = day.isoformat()
+                if label in cells['weight'] and cells['weight'][label] is None:
+                    value = _virtual_weight_value(values, field_overrides.get('weight'))
+                    if value is not None:
+                        cells['weight'][label] = _chart_cell([value])
         
         # 3c. Post-processing for Body Weight (Linear Interpolation)
-        if 'weight' in event_type_ids and 'weight' in grouped:
+        if 'weight' in event_type_ids and 'weight' in cells:
              # Find the latest weight BEFORE the start date for forward filling initial gap
              cur.execute("""
                  SELECT data, timestamp
@@ -1802,54 +2162,22 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
              # Flatten the daily values to a single list (taking the last value if multiple exist for a day)
              daily_weights = []
              for label in labels:
-                 vals = grouped['weight'][label]
-                 if vals:
-                     daily_weights.append(vals[-1]) # Use last value of the day
+                 cell = cells['weight'][label]
+                 if cell:
+                     daily_weights.append(cell['last']) # Use last value of the day
                  else:
                      daily_weights.append(None)
              
-             # Perform Interpolation
-             n = len(daily_weights)
-             for i in range(n):
-                 if daily_weights[i] is not None:
-                     last_val = daily_weights[i]
-                     continue
-                
-                 # Value is None, need to fill
-                 if last_val is None:
-                     # Start of chart and no history: leave as None
-                     continue
-                
-                 # We have a last_val, look ahead for next value
-                 next_val = None
-                 
-                 for j in range(i + 1, n):
-                     if daily_weights[j] is not None:
-                         next_val = daily_weights[j]
-                         # Gap calculation
-                         # i is the current empty slot index
-                         # prev_index would be i - 1 (where last_val came from)
-                         # gap width = j - (i - 1)
-                         gap_width = j - (i - 1)
-                         
-                         slope = (next_val - last_val) / gap_width
-                         interpolated_val = last_val + slope
-                         
-                         daily_weights[i] = interpolated_val
-                         last_val = interpolated_val # Update for potential next iteration check
-                         break
-                 
-                 if next_val is None:
-                     # Forward Fill (no future value found)
-                     daily_weights[i] = last_val
+             # Interpolate gaps (the earlier weight sits just before the first label),
+             # then forward-fill past the last known value
+             series = timeseries.forward_fill(timeseries.interpolate_linear([last_val] + daily_weights))
+             daily_weights = series[1:]
             
-             # Update grouped['weight'] with filled values
+             # Update cells['weight'] with filled values
              for idx, label in enumerate(labels):
                  val = daily_weights[idx]
-                 if val is not None:
-                     grouped['weight'][label] = [val]
-                 else:
-                     grouped['weight'][label] = [] # Keep empty if no start value
+                 # Keep empty if no start value
+                 cells['weight'][label] = _chart_cell([val]) if val is not None else None
 
         # 4. Aggregate values by type's aggregation method
         datasets = []
@@ -1876,9 +2204,9 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
             
             data_points = []
             for label in labels:
-                values = grouped[et_id][label]
+                cell = cells[et_id][label]
                 
-                if not values:
+                if not cell:
                     # For cumulative metrics (sum/count), missing data implies 0.
                     # For state metrics (average/min/max/last), missing data is just missing (gap).
                     if agg_type in ['sum', 'sum_today', 'count']:
@@ -1886,19 +2214,19 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
                     else:
                          data_points.append(None)
                 elif agg_type == 'sum' or agg_type == 'sum_today':
-                    data_points.append(sum(values))
+                    data_points.append(cell['sum'])
                 elif agg_type == 'average':
-                    data_points.append(sum(values) / len(values))
+                    data_points.append(cell['sum'] / cell['count'])
                 elif agg_type == 'count':
-                    data_points.append(len(values))
+                    data_points.append(cell['count'])
                 elif agg_type == 'last':
-                    data_points.append(values[-1])
+                    data_points.append(cell['last'])
                 elif agg_type == 'max':
-                    data_points.append(max(values))
+                    data_points.append(cell['max'])
                 elif agg_type == 'min':
-                    data_points.append(min(values))
+                    data_points.append(cell['min'])
                 else:
-                    data_points.append(sum(values))  # Default to sum
+                    data_points.append(cell['sum'])  # Default to sum
             
             datasets.append({
                 'eventTypeId': et_id,
@@ -1911,16 +2239,223 @@ def get_chart_data(user_id, event_type_ids, start_date, end_date, aggregation_ov
                 'data': data_points
             })
         
+        # 5. Thin long charts down to max_points labels, shared by every series
+        if max_points and len(labels) > max_points:
+            keep = timeseries.downsample_shared([ds['data'] for ds in datasets], max_points)
+            labels = [labels[i] for i in keep]
+            for ds in datasets:
+                ds['data'] = [ds['data'][i] for i in keep]
+        
         return {
             'labels': labels,
             'datasets': datasets
         }
 
-    finally:
-        conn.close()
 
+def _chart_cell(values):
+    """Summarize one chart label's values (in time order), or None if there are none."""
+    if not values:
+        return None
+    return {
+        'sum': sum(values),
+        'count': len(values),
+        'min': min(values),
+        'max': max(values),
+        'last': values[-1]
+    }
+
+
+# Postgres to_char formats for chart labels, by date_trunc unit. Weeks are
+# labelled by their Monday.
+CHART_BUCKET_FORMATS = {
+    'hour': 'YYYY-MM-DD HH24:00',
+    'day': 'YYYY-MM-DD',
+    'week': 'YYYY-MM-DD',
+    'month': 'YYYY-MM',
+    'year': 'YYYY'
+}
+
+def _chart_zone(tz_name):
+    """ZoneInfo for a client-supplied IANA name, or None if it is missing or unknown."""
+    if not tz_name:
+        return None
+    try:
+        return ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+def _bucket_labels(first_day, last_day, granularity):
+    """Labels of every day/week/month/year bucket touching [first_day, last_day]."""
+    if granularity == 'week':
+        first_day -= timedelta(days=first_day.weekday())
+    elif granularity == 'month':
+        first_day = first_day.replace(day=1)
+    elif granularity == 'year':
+        first_day = first_day.replace(month=1, day=1)
+
+    labels = []
+    current = first_day
+    while current <= last_day:
+        if granularity == 'month':
+            labels.append(current.strftime('%Y-%m'))
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        elif granularity == 'year':
+            labels.append(current.strftime('%Y'))
+            current = current.replace(year=current.year + 1)
+        else:
+            labels.append(current.isoformat())
+            current += timedelta(days=7 if granularity == 'week' else 1)
+    return labels
+
+
+def _chart_cells_from_rollups(cur, user_id, event_type_ids, field_overrides, labels, first_day, last_day, granularity='day'):
+    """Chart cells for whole ROLLUP_TZ days, folded from daily_rollups into day/week/month/year buckets."""
+    cells = {et_id: {label: None for label in labels} for et_id in event_type_ids}
+    if not labels:
+        return cells
+
+    meal_field = field_overrides.get('meal', 'calories')
+    if meal_field not in MEAL_FIELD_COLUMNS:
+        meal_field = 'calories'
+
+    series = [(et_id, meal_field if et_id == 'meal' else '_chart') for et_id in event_type_ids]
+    cur.execute("""
+        SELECT
+            event_type_id,
+            to_char(date_trunc(%s, local_day), %s) AS label,
+            SUM(value_sum) AS value_sum,
+            SUM(value_count) AS value_count,
+            MIN(value_min) AS value_min,
+            MAX(value_max) AS value_max,
+            (ARRAY_AGG(value_last ORDER BY last_ts DESC))[1] AS value_last
+        FROM daily_rollups
+        WHERE user_id = %s
+        AND (event_type_id, field) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+        AND local_day >= %s AND local_day <= %s
+        GROUP BY event_type_id, label
+    """, (granularity, CHART_BUCKET_FORMATS[granularity], user_id,
+          [et_id for et_id, _ in series], [field for _, field in series], first_day, last_day))
+
+    for row in cur.fetchall():
+        if row['label'] not in cells[row['event_type_id']]:
+            continue
+        cells[row['event_type_id']][row['label']] = {
+            'sum': row['value_sum'],
+            'count': row['value_count'],
+            'min': row['value_min'],
+            'max': row['value_max'],
+            'last': row['value_last']
+        }
+    return cells
 
-def get_maintenance_calories(user_id, start_date, end_date, timezone_offset=0):
+
+def _chart_cells_from_sql(cur, user_id, event_type_ids, field_overrides, labels, start_date, end_date, first_day, last_day, granularity, tz_name=None, tz_offset_ms=0):
+    """
+    Chart cells for hour/day/week/month/year buckets, extracted, grouped and
+    aggregated in Postgres so only one row per series per bucket comes back.
+
+    Rows are bucketed by local time in the IANA zone tz_name when given (right
+    across DST changes), else by the client's fixed tz_offset_ms.
+    """
+    cells = {et_id: {label: None for label in labels} for et_id in event_type_ids}
+    if not labels:
+        return cells
+
+    params = {
+        'user_id': user_id,
+        'start': start_date,
+        'end': end_date,
+        'tz': tz_name,
+        'offset_ms': tz_offset_ms,
+        'unit': granularity,
+        'fmt': CHART_BUCKET_FORMATS[granularity]
+    }
+    # Local wall-clock time of a row
+    if tz_name:
+        local_sql = "to_timestamp({ts} / 1000.0) AT TIME ZONE %(tz)s"
+    else:
+        local_sql = "to_timestamp(({ts} - %(offset_ms)s) / 1000.0) AT TIME ZONE 'UTC'"
+    label_sql = f"to_char(date_trunc(%(unit)s, {local_sql}), %(fmt)s)"
+    aggregates_sql = """
+            SUM(value) AS value_sum,
+            COUNT(*) AS value_count,
+            MIN(value) AS value_min,
+            MAX(value) AS value_max,
+            (ARRAY_AGG(value ORDER BY timestamp DESC))[1] AS value_last"""
+
+    rows = []
+    if 'meal' in event_type_ids:
+        db_field = MEAL_FIELD_COLUMNS.get(field_overrides.get('meal', 'calories'), 'calories')
+        cur.execute(f"""
+            SELECT 'meal' AS event_type_id, label, {aggregates_sql}
+            FROM (
+                SELECT {label_sql.format(ts='timestamp')} AS label, {db_field}::float AS value, timestamp
+                FROM meals
+                WHERE user_id = %(user_id)s
+                AND timestamp >= %(start)s
+                AND timestamp <= %(end)s
+                AND {db_field} IS NOT NULL
+            ) m
+            GROUP BY label
+        """, params)
+        rows.extend(cur.fetchall())
+
+    other_event_type_ids = [et_id for et_id in event_type_ids if et_id != 'meal']
+    if other_event_type_ids:
+        # A field override reads that JSON number (0 if it isn't one) whenever the
+        # field is present, and the default extraction otherwise.
+        overrides = [(et_id, field) for et_id, field in field_overrides.items()
+                     if et_id in other_event_type_ids and field]
+        # Events count for every local day in [first_day, last_day], even just
+        # outside [start_date, end_date]; the timestamp window only narrows the scan.
+        params.update({
+            'events_start': start_date - 86400000,
+            'events_end': end_date + 86400000,
+            'first_day': first_day,
+            'last_day': last_day,
+            'event_type_ids': other_event_type_ids,
+            'override_ids': [et_id for et_id, _ in overrides],
+            'override_fields': [field for _, field in overrides]
+        })
+        cur.execute(f"""
+            SELECT event_type_id, label, {aggregates_sql}
+            FROM (
+                SELECT
+                    e.event_type_id,
+                    {label_sql.format(ts='e.timestamp')} AS label,
+                    CASE
+                        WHEN o.field IS NOT NULL AND jsonb_typeof(e.data) = 'object' AND e.data ? o.field
+                        THEN CASE WHEN jsonb_typeof(e.data->o.field) = 'number' THEN (e.data->>o.field)::float ELSE 0 END
+                        ELSE {CHART_VALUE_SQL}
+                    END AS value,
+                    e.timestamp
+                FROM events e
+                LEFT JOIN unnest(%(override_ids)s::text[], %(override_fields)s::text[]) AS o(event_type_id, field)
+                    ON o.event_type_id = e.event_type_id
+                WHERE e.user_id = %(user_id)s
+                AND e.event_type_id = ANY(%(event_type_ids)s)
+                AND e.timestamp >= %(events_start)s
+                AND e.timestamp <= %(events_end)s
+                AND ({local_sql.format(ts='e.timestamp')})::date BETWEEN %(first_day)s AND %(last_day)s
+            ) ev
+            GROUP BY event_type_id, label
+        """, params)
+        rows.extend(cur.fetchall())
+
+    for row in rows:
+        if row['label'] not in cells[row['event_type_id']]:
+            continue
+        cells[row['event_type_id']][row['label']] = {
+            'sum': row['value_sum'],
+            'count': row['value_count'],
+            'min': row['value_min'],
+            'max': row['value_max'],
+            'last': row['value_last']
+        }
+    return cells
+
+
+def get_maintenance_calories(user_id, start_date, end_date, timezone_offset=0, tz_name=None):
     """
     Estimate true maintenance calories from logged weight + calorie data over a date range.
 
@@ -1934,19 +2469,23 @@ def get_maintenance_calories(user_id, start_date, end_date, timezone_offset=0):
         start_date: Start timestamp in milliseconds
         end_date: End timestamp in milliseconds
         timezone_offset: Minutes to offset from UTC (JS getTimezoneOffset() convention)
+        tz_name: Optional client IANA timezone; in ROLLUP_TZ the per-day calorie totals
+            and weigh-ins are read from daily_rollups.
 
     Returns dict with estimate, mean_daily_intake, weight trend, coverage stats, and warnings.
     """
     from datetime import datetime
 
     tz_offset_ms = timezone_offset * 60 * 1000
+    use_rollups = _rollups_cover(tz_name)
 
     def local_day_label(ts):
+        if use_rollups:
+            return _rollup_day(ts).isoformat()
         adjusted_ts = ts - tz_offset_ms
         return datetime.utcfromtimestamp(adjusted_ts / 1000).strftime('%Y-%m-%d')
 
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
 
         # Build the list of local-day labels covered by the range (for range_days / missing-day counts)
@@ -1956,48 +2495,67 @@ def get_maintenance_calories(user_id, start_date, end_date, timezone_offset=0):
         end_dt = datetime.strptime(end_label, '%Y-%m-%d')
         range_days = (end_dt - start_dt).days + 1
 
-        # 1. Weight events in range, split real vs auto-generated
-        cur.execute("""
-            SELECT data, timestamp
-            FROM events
-            WHERE user_id = %s
-            AND event_type_id = 'weight'
-            AND timestamp >= %s AND timestamp <= %s
-            ORDER BY timestamp ASC
-        """, (user_id, start_date, end_date))
-        weight_rows = cur.fetchall()
+        if use_rollups:
+            # Latest real weigh-in and total calories per whole local day
+            cur.execute("""
+                SELECT event_type_id, local_day, value_sum, value_last
+                FROM daily_rollups
+                WHERE user_id = %s
+                AND ((event_type_id = 'weight' AND field = '_weighin')
+                     OR (event_type_id = 'meal' AND field = 'calories'))
+                AND local_day >= %s AND local_day <= %s
+                ORDER BY local_day
+            """, (user_id, start_dt.date(), end_dt.date()))
+            real_points_by_day = {}
+            calories_by_day = {}
+            for row in cur.fetchall():
+                if row['event_type_id'] == 'weight':
+                    real_points_by_day[row['local_day'].isoformat()] = float(row['value_last'])
+                else:
+                    calories_by_day[row['local_day'].isoformat()] = float(row['value_sum'])
+        else:
+            # 1. Weight events in range, split real vs auto-generated
+            cur.execute("""
+                SELECT data, timestamp
+                FROM events
+                WHERE user_id = %s
+                AND event_type_id = 'weight'
+                AND timestamp >= %s AND timestamp <= %s
+                ORDER BY timestamp ASC
+            """, (user_id, start_date, end_date))
+            weight_rows = cur.fetchall()
 
-        real_points_by_day = {}
-        for row in weight_rows:
-            weight_val = row['data'].get('weight')
-            if weight_val is None:
-                continue
-            is_auto = row['data'].get('_auto_generated') in ('true', True)
-            if is_auto:
-                continue
-            day_label = local_day_label(row['timestamp'])
-            # If multiple real entries land on the same day, keep the latest
-            real_points_by_day[day_label] = float(weight_val)
+            real_points_by_day = {}
+            for row in weight_rows:
+                weight_val = row['data'].get('weight')
+                if weight_val is None:
+                    continue
+                is_auto = row['data'].get('_auto_generated') in ('true', True)
+                if is_auto:
+                    continue
+                day_label = local_day_label(row['timestamp'])
+                # If multiple real entries land on the same day, keep the latest
+                real_points_by_day[day_label] = float(weight_val)
 
-        real_weigh_in_count = len(real_points_by_day)
+            # 2. Meal calories in range, grouped by local day
+            cur.execute("""
+                SELECT calories, timestamp
+                FROM meals
+                WHERE user_id = %s
+                AND timestamp >= %s AND timestamp <= %s
+                ORDER BY timestamp ASC
+            """, (user_id, start_date, end_date))
+            meal_rows = cur.fetchall()
 
-        # 2. Meal calories in range, grouped by local day
-        cur.execute("""
-            SELECT calories, timestamp
-            FROM meals
-            WHERE user_id = %s
-            AND timestamp >= %s AND timestamp <= %s
-            ORDER BY timestamp ASC
-        """, (user_id, start_date, end_date))
-        meal_rows = cur.fetchall()
+            calories_by_day = {}
+            for row in meal_rows:
+                if row['calories'] is None:
+                    continue
+                day_label = local_day_label(row['timestamp'])
+                calories_by_day.setdefault(day_label, 0.0)
+                calories_by_day[day_label] += float(row['calories'])
 
-        calories_by_day = {}
-        for row in meal_rows:
-            if row['calories'] is None:
-                continue
-            day_label = local_day_label(row['timestamp'])
-            calories_by_day.setdefault(day_label, 0.0)
-            calories_by_day[day_label] += float(row['calories'])
+        real_weigh_in_count = len(real_points_by_day)
 
         days_with_meals = len(calories_by_day)
         days_missing_calories = range_days - days_with_meals
@@ -2087,8 +2645,6 @@ def get_maintenance_calories(user_id, start_date, end_date, timezone_offset=0):
             'warnings': warnings
         }
 
-    finally:
-        conn.close()
 
 
 # ============================================================================
@@ -2097,8 +2653,7 @@ def get_maintenance_calories(user_id, start_date, end_date, timezone_offset=0):
 
 def get_user_profile(user_id):
     """Get user profile by user ID."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM user_profiles WHERE user_id = %s", (user_id,))
         profile = cur.fetchone()
@@ -2114,14 +2669,11 @@ def get_user_profile(user_id):
             'createdAt': profile['created_at'].isoformat() if profile['created_at'] else None,
             'updatedAt': profile['updated_at'].isoformat() if profile['updated_at'] else None
         }
-    finally:
-        conn.close()
 
 
 def create_or_update_user_profile(user_id, profile_data):
     """Create or update user profile."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         cur.execute("""
@@ -2151,17 +2703,11 @@ def create_or_update_user_profile(user_id, profile_data):
             'createdAt': result['created_at'].isoformat() if result['created_at'] else None,
             'updatedAt': result['updated_at'].isoformat() if result['updated_at'] else None
         }
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
 
 
 def get_latest_body_weight(user_id):
     """Get the most recent body weight from events table."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Get the latest weight event for this user
@@ -2182,214 +2728,437 @@ def get_latest_body_weight(user_id):
             'weight': result['data'].get('weight'),
             'timestamp': result['timestamp']
         }
-    finally:
-        conn.close()
+
+# Weigh-in fields that fill_and_interpolate_weight_data fills, each independently.
+WEIGHT_FILL_FIELDS = ('weight', 'body_fat_pct')
+
+# pg_advisory_xact_lock(WEIGHT_FILL_LOCK_ID, hashtext(user_id)) serializes a user's
+# weight refills across processes.
+WEIGHT_FILL_LOCK_ID = 7324003
+
+# Users with a weight refill running in this process, each with the triggers
+# handed over since it started ('full' if any asked for a whole-history refill).
+_weight_refills = {}
+_weight_refills_lock = threading.Lock()
+
+REAL_WEIGH_INS_SQL = """
+    SELECT data, timestamp
+    FROM events
+    WHERE user_id = %s
+    AND event_type_id = 'weight'
+    AND (data->>'_auto_generated' IS NULL OR data->>'_auto_generated' = 'false')
+"""
+
+def _weight_gap_fills(user_data_by_date, fill_through=None, first_day=None, last_day=None):
+    """
+    Yield (date, {field: value}) for every day between consecutive user entries
+    in user_data_by_date ({date: event data}), and after the last entry through
+    fill_through if given. Each WEIGHT_FILL_FIELDS field is interpolated towards
+    the next entry if it has one, else forward-filled; days where the previous
+    entry has neither field are skipped. Values are rounded to 2 places.
+    Optionally only days in [first_day, last_day] are yielded.
+    """
+    user_dates = sorted(user_data_by_date)
+    for idx, prev_date in enumerate(user_dates):
+        prev_data = user_data_by_date[prev_date]
+        if idx + 1 < len(user_dates):
+            next_date = user_dates[idx + 1]
+            next_data = user_data_by_date[next_date]
+        elif fill_through is not None:
+            next_date = fill_through + timedelta(days=1)
+            next_data = None
+        else:
+            break
+        
+        total_days = (next_date - prev_date).days
+        start = 1 if first_day is None else max(1, (first_day - prev_date).days)
+        stop = total_days if last_day is None else min(total_days, (last_day - prev_date).days + 1)
+        if start >= stop:
+            continue
+        
+        # Each field's daily series across the gap, prev entry at 0 and next at total_days
+        filled = {}
+        for field in WEIGHT_FILL_FIELDS:
+            if prev_data.get(field) is None:
+                continue
+            gap = [float(prev_data[field])] + [None] * (total_days - 1)
+            if next_data and next_data.get(field) is not None:
+                # Interpolate
+                filled[field] = timeseries.interpolate_linear(gap + [float(next_data[field])])
+            else:
+                # Forward-fill
+                filled[field] = timeseries.forward_fill(gap)
+        if not filled:
+            continue
+        
+        for days_from_prev in range(start, stop):
+            values = {field: round(series[days_from_prev], 2) for field, series in filled.items()}
+            yield prev_date + timedelta(days=days_from_prev), values
+
+def _virtual_weight_days(cur, user_id, first_day, last_day, tzinfo):
+    """
+    {date: {field: value}} for the local days (in tzinfo) in [first_day, last_day]
+    that have no real weigh-in, filled from the nearest real weigh-ins the same
+    way fill_and_interpolate_weight_data would store them. Used in place of
+    auto-generated rows when WEIGHT_FILL_MODE is 'virtual'.
+    """
+    start_ms = int(datetime.combine(first_day, dtime.min, tzinfo).timestamp() * 1000)
+    end_ms = int(datetime.combine(last_day + timedelta(days=1), dtime.min, tzinfo).timestamp() * 1000)
+
+    rows = []
+    cur.execute(REAL_WEIGH_INS_SQL + " AND timestamp < %s ORDER BY timestamp DESC LIMIT 1", (user_id, start_ms))
+    rows.extend(cur.fetchall())
+    cur.execute(REAL_WEIGH_INS_SQL + " AND timestamp >= %s AND timestamp < %s ORDER BY timestamp ASC",
+                (user_id, start_ms, end_ms))
+    rows.extend(cur.fetchall())
+    cur.execute(REAL_WEIGH_INS_SQL + " AND timestamp >= %s ORDER BY timestamp ASC LIMIT 1", (user_id, end_ms))
+    rows.extend(cur.fetchall())
+
+    # Last entry of a day wins
+    user_data_by_date = {}
+    for row in rows:
+        user_data_by_date[datetime.fromtimestamp(row['timestamp'] / 1000, tzinfo).date()] = row['data']
+
+    today = datetime.now(tzinfo).date()
+    return dict(_weight_gap_fills(user_data_by_date, today, first_day, last_day))
+
+def _virtual_weight_value(values, field=None):
+    """The value an auto-generated row with these values would chart/stat as."""
+    if field and field in values:
+        return values[field]
+    # First numeric field in JSONB key order, which puts 'weight' first
+    return values.get('weight', values.get('body_fat_pct'))
+
+def _add_virtual_weight_stats(cur, user_id, results, tzinfo):
+    """
+    Fill in the weight stat of every day in results ({'YYYY-MM-DD': stats}) that
+    has none, when WEIGHT_FILL_MODE is 'virtual'. Returns results.
+    """
+    if WEIGHT_FILL_MODE != 'virtual' or not results:
+        return results
+
+    cur.execute("""
+        SELECT aggregation_type, primary_unit FROM event_types
+        WHERE id = 'weight' AND (user_id = %s OR user_id IS NULL)
+        LIMIT 1
+    """, (user_id,))
+    et = cur.fetchone()
+    if not et:
+        return results
+
+    days = sorted(results)
+    virtual = _virtual_weight_days(cur, user_id, date.fromisoformat(days[0]), date.fromisoformat(days[-1]), tzinfo)
+    for day, values in virtual.items():
+        stats = results.get(day.isoformat())
+        if stats is None or 'weight' in stats:
+            continue
+        value = _virtual_weight_value(values)
+        stats['weight'] = {
+            'value': _stat_value(et.get('aggregation_type', 'sum'), value, 1, value, value),
+            'unit': et.get('primary_unit', '')
+        }
+    return results
+
+def _enqueue_weight_refill(cur, user_id, timestamps):
+    """
+    Queue a weight refill around timestamps in cur's transaction.
+
+    If the user already has a refill queued and not yet claimed, by any process,
+    the timestamps are merged into it instead, so a burst of writes across
+    instances costs one refill. Returns the job id to jobs.dispatch() after
+    committing, or None when there is nothing new to dispatch (merged, or
+    WEIGHT_FILL_MODE is 'virtual').
+    """
+    if WEIGHT_FILL_MODE == 'virtual':
+        return None
+
+    # Locked until this write commits, so the job can't be claimed before it
+    # sees the merged timestamps; one being claimed right now is skipped
+    cur.execute("""
+        SELECT id, payload FROM jobs
+        WHERE kind = 'weight_refill' AND status = 'queued' AND payload->>'userId' = %s
+        ORDER BY created_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """, (user_id,))
+    queued = cur.fetchone()
+    if queued is None:
+        return jobs.enqueue('weight_refill', {'userId': user_id, 'timestamps': timestamps}, cur)
+
+    merged = queued['payload'].get('timestamps')
+    if merged is not None:
+        # The refill only depends on the earliest and latest trigger
+        merged = None if timestamps is None else [min(merged + timestamps), max(merged + timestamps)]
+    cur.execute("UPDATE jobs SET payload = %s WHERE id = %s",
+                (json.dumps(dict(queued['payload'], timestamps=merged)), queued['id']))
+    return None
 
 def fill_and_interpolate_weight_data(user_id, trigger_timestamp=None):
     """
     Fill and interpolate weight and body fat % data.
     
     This function:
-    1. Finds all user-entered weight events (not auto-generated)
+    1. Finds the user-entered weight events (not auto-generated) around the change
     2. For gaps between user entries: performs linear interpolation
     3. For dates after the latest entry: forward-fills with the latest values
-    4. Creates/updates events with auto-generated flag
+    4. Replaces the auto-generated events in that segment in one batch insert
+    
+    Filled days only depend on the nearest user entries either side, so a change
+    on some day can only affect the gaps between the user entries just before and
+    just after it. With a trigger only that segment is rebuilt, making a single
+    weigh-in O(gap) rather than O(history).
+    
+    Does nothing when WEIGHT_FILL_MODE is 'virtual'; reads fill the gaps instead.
+    
+    Queued refills are coalesced per user across processes: a write merges its
+    triggers into the user's refill job if one is still queued (see
+    _enqueue_weight_refill). Running refills are only coalesced within a
+    process: if one is already running here, the triggers are handed to it and
+    this call returns at once. The running refill folds everything handed over
+    before its batch insert into that pass, and whatever arrives later into one
+    further pass. If it fails, the handed-over triggers (whose own jobs have
+    finished) are queued again as a new job. Across processes, running refills
+    of one user are serialized by an advisory lock, each at full cost.
     
     Args:
         user_id: User ID
-        trigger_timestamp: Optional timestamp that triggered this (for optimization)
+        trigger_timestamp: Timestamp (or list of timestamps) of the user entries
+            that were added, changed or removed. None refills the whole history.
+    """
+    if WEIGHT_FILL_MODE == 'virtual':
+        return
+
+    if trigger_timestamp is None:
+        triggers = None
+    elif isinstance(trigger_timestamp, (list, tuple, set)):
+        triggers = [ts for ts in trigger_timestamp if ts is not None]
+    else:
+        triggers = [trigger_timestamp]
+
+    with _weight_refills_lock:
+        pending = _weight_refills.get(user_id)
+        if pending is not None:
+            # A refill is running; it picks these up
+            pending['full'] = pending['full'] or triggers is None
+            pending['triggers'].extend(triggers or [])
+            return
+        _weight_refills[user_id] = {'full': False, 'triggers': []}
+
+    # Handed over by other calls and taken into the pass in progress: lost with
+    # it if it fails, so they are queued again then
+    adopted = {'full': False, 'triggers': []}
+
+    def adopt(current):
+        """
+        (triggers, changed): current merged with the triggers handed over since
+        the last call, and whether that widened the refill.
+        """
+        with _weight_refills_lock:
+            pending = _weight_refills[user_id]
+            _weight_refills[user_id] = {'full': False, 'triggers': []}
+        if not pending['full'] and not pending['triggers']:
+            return current, False
+        adopted['full'] = adopted['full'] or pending['full']
+        adopted['triggers'].extend(pending['triggers'])
+        if current is None:
+            return None, False
+        if pending['full']:
+            return None, True
+        return current + pending['triggers'], True
+
+    try:
+        while True:
+            _refill_weight_segment(user_id, triggers, adopt)
+            adopted.update(full=False, triggers=[])
+            # Anything handed over during the insert itself needs one more pass
+            with _weight_refills_lock:
+                pending = _weight_refills[user_id]
+                if not pending['full'] and not pending['triggers']:
+                    del _weight_refills[user_id]
+                    return
+                _weight_refills[user_id] = {'full': False, 'triggers': []}
+            adopted.update(pending)
+            triggers = None if pending['full'] else pending['triggers']
+    except Exception:
+        with _weight_refills_lock:
+            leftover = _weight_refills.pop(user_id, None) or {'full': False, 'triggers': []}
+        full = adopted['full'] or leftover['full']
+        lost = adopted['triggers'] + leftover['triggers']
+        if full or lost:
+            try:
+                jobs.enqueue('weight_refill', {'userId': user_id, 'timestamps': None if full else lost})
+            except Exception as e:
+                print(f"Warning: Failed to requeue weight refill triggers for {user_id}: {e}")
+        raise
+
+def _weight_segment_plan(cur, user_id, triggers):
+    """
+    _refill_weight_segment's plan: the segment's bounding user entries (lo_day,
+    hi_day; None where open) and the auto-generated rows that should fill it.
     """
     from datetime import datetime, timedelta, timezone
+
+    def utc_day(ts):
+        return datetime.fromtimestamp(ts / 1000, timezone.utc).date()
+
+    def day_start_ms(day):
+        return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+    # 1. The segment to rebuild runs from the nearest user entry before the
+    # earliest trigger to the nearest one after the latest (open if none)
+    lo_day = hi_day = None
+    if triggers:
+        cur.execute(REAL_WEIGH_INS_SQL + " AND timestamp < %s ORDER BY timestamp DESC LIMIT 1",
+                    (user_id, day_start_ms(utc_day(min(triggers)))))
+        row = cur.fetchone()
+        if row:
+            lo_day = utc_day(row['timestamp'])
+        cur.execute(REAL_WEIGH_INS_SQL + " AND timestamp >= %s ORDER BY timestamp ASC LIMIT 1",
+                    (user_id, day_start_ms(utc_day(max(triggers)) + timedelta(days=1))))
+        row = cur.fetchone()
+        if row:
+            hi_day = utc_day(row['timestamp'])
     
-    conn = get_db_connection()
-    try:
+    # 2. User-entered data by date within the segment (last entry of a day wins)
+    bounds_sql = ""
+    params = [user_id]
+    if lo_day is not None:
+        bounds_sql += " AND timestamp >= %s"
+        params.append(day_start_ms(lo_day))
+    if hi_day is not None:
+        bounds_sql += " AND timestamp < %s"
+        params.append(day_start_ms(hi_day + timedelta(days=1)))
+    cur.execute(REAL_WEIGH_INS_SQL + bounds_sql + " ORDER BY timestamp ASC", tuple(params))
+    
+    user_data_by_date = {}
+    for event in cur.fetchall():
+        user_data_by_date[utc_day(event['timestamp'])] = event['data']
+    
+    # 3. Fill each gap between user entries, and forward-fill after the last
+    # one through today unless the segment ends at a later entry
+    today = datetime.now(timezone.utc).date()
+    new_rows = []
+    for date_obj, values in _weight_gap_fills(user_data_by_date, None if hi_day is not None else today):
+        event_data = {'_auto_generated': True}
+        event_data.update(values)
+        # Timestamp at noon UTC for this date
+        new_rows.append((
+            f"evt_{uuid.uuid4().hex[:12]}",
+            user_id,
+            'weight',
+            day_start_ms(date_obj) + 12 * 3600000,
+            'Health',
+            json.dumps(event_data),
+            'Auto-generated'
+        ))
+    return lo_day, hi_day, new_rows
+
+def _refill_weight_segment(user_id, triggers, adopt=None):
+    """
+    fill_and_interpolate_weight_data's refill: the segments around triggers, or
+    everything if None. adopt(triggers) returns them merged with any handed over
+    meanwhile, and whether that changed them; the plan is redone until it doesn't.
+    """
+    from datetime import datetime, timedelta, timezone
+
+    def day_start_ms(day):
+        return int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+    with db_connection() as conn:
         cur = conn.cursor()
+        # One refill per user at a time, across every process
+        cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (WEIGHT_FILL_LOCK_ID, user_id))
+        
+        # 1-3. Plan the segment, taking in triggers that arrived while planning
+        while True:
+            lo_day, hi_day, new_rows = _weight_segment_plan(cur, user_id, triggers)
+            if adopt is None:
+                break
+            triggers, changed = adopt(triggers)
+            if not changed:
+                break
+        
+        # 4. Delete the segment's existing auto-generated events, noting the span
+        # they covered for the rollup refresh
+        bounds_sql = ""
+        params = [user_id]
+        if lo_day is not None:
+            bounds_sql += " AND timestamp >= %s"
+            params.append(day_start_ms(lo_day + timedelta(days=1)))
+        if hi_day is not None:
+            bounds_sql += " AND timestamp < %s"
+            params.append(day_start_ms(hi_day))
+        cur.execute(f"""
+            WITH removed AS (
+                DELETE FROM events
+                WHERE user_id = %s
+                AND event_type_id = 'weight'
+                AND data->>'_auto_generated' = 'true'
+                {bounds_sql}
+                RETURNING timestamp
+            )
+            SELECT MIN(timestamp) AS first_ts, MAX(timestamp) AS last_ts FROM removed
+        """, tuple(params))
+        removed = cur.fetchone()
         
-        # 1. Get all user-entered weight events (where _auto_generated is not true)
-        cur.execute("""
-            SELECT id, data, timestamp
-            FROM events
-            WHERE user_id = %s 
-            AND event_type_id = 'weight'
-            AND (data->>'_auto_generated' IS NULL OR data->>'_auto_generated' = 'false')
-            ORDER BY timestamp ASC
-        """, (user_id,))
-        
-        user_events = cur.fetchall()
-        
-        if not user_events:
-            # No user data, nothing to fill
-            return
-        
-        # 2. Determine the date range to fill
-        first_event_ts = user_events[0]['timestamp']
-        last_event_ts = user_events[-1]['timestamp']
-        
-        # Convert to dates (UTC)
-        first_date = datetime.utcfromtimestamp(first_event_ts / 1000).replace(hour=0, minute=0, second=0, microsecond=0)
-        last_date = datetime.utcfromtimestamp(last_event_ts / 1000).replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        # Extend forward-fill to today
-        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
-        end_date = max(last_date, today)
-        
-        # 3. Build a map of user-entered data by date
-        user_data_by_date = {}
-        for event in user_events:
-            event_date = datetime.utcfromtimestamp(event['timestamp'] / 1000).replace(hour=0, minute=0, second=0, microsecond=0)
-            date_str = event_date.strftime('%Y-%m-%d')
-            user_data_by_date[date_str] = {
-                'weight': event['data'].get('weight'),
-                'body_fat_pct': event['data'].get('body_fat_pct'),
-                'timestamp': event['timestamp']
-            }
-        
-        # 4. Generate all dates in range and fill/interpolate
-        current_date = first_date
-        dates_to_process = []
-        
-        while current_date <= end_date:
-            date_str = current_date.strftime('%Y-%m-%d')
-            dates_to_process.append((date_str, current_date))
-            current_date += timedelta(days=1)
-        
-        # 5. For each date, determine the value (user data, interpolated, or forward-filled)
-        filled_data = {}
-        
-        for date_str, date_obj in dates_to_process:
-            if date_str in user_data_by_date:
-                # User has data for this date, skip
-                continue
-            
-            # Find previous and next user data points
-            prev_date = None
-            prev_data = None
-            next_date = None
-            next_data = None
-            
-            # Look backwards for previous data
-            check_date = date_obj - timedelta(days=1)
-            while check_date >= first_date:
-                check_str = check_date.strftime('%Y-%m-%d')
-                if check_str in user_data_by_date:
-                    prev_date = check_str
-                    prev_data = user_data_by_date[check_str]
-                    break
-                check_date -= timedelta(days=1)
-            
-            # Look forwards for next data
-            check_date = date_obj + timedelta(days=1)
-            while check_date <= end_date:
-                check_str = check_date.strftime('%Y-%m-%d')
-                if check_str in user_data_by_date:
-                    next_date = check_str
-                    next_data = user_data_by_date[check_str]
-                    break
-                check_date += timedelta(days=1)
-            
-            if prev_data is None:
-                # No previous data, skip (shouldn't happen since we start from first_date)
-                continue
-            
-            # Calculate values for weight and body_fat_pct independently
-            weight_val = None
-            body_fat_val = None
-            
-            # Handle weight
-            if prev_data.get('weight') is not None:
-                if next_data and next_data.get('weight') is not None:
-                    # Interpolate weight
-                    prev_weight = float(prev_data['weight'])
-                    next_weight = float(next_data['weight'])
-                    
-                    # Calculate days between
-                    prev_dt = datetime.strptime(prev_date, '%Y-%m-%d')
-                    next_dt = datetime.strptime(next_date, '%Y-%m-%d')
-                    current_dt = date_obj
-                    
-                    total_days = (next_dt - prev_dt).days
-                    days_from_prev = (current_dt - prev_dt).days
-                    
-                    if total_days > 0:
-                        weight_val = prev_weight + (next_weight - prev_weight) * (days_from_prev / total_days)
-                else:
-                    # Forward-fill weight
-                    weight_val = float(prev_data['weight'])
-            
-            # Handle body_fat_pct
-            if prev_data.get('body_fat_pct') is not None:
-                if next_data and next_data.get('body_fat_pct') is not None:
-                    # Interpolate body fat
-                    prev_bf = float(prev_data['body_fat_pct'])
-                    next_bf = float(next_data['body_fat_pct'])
-                    
-                    prev_dt = datetime.strptime(prev_date, '%Y-%m-%d')
-                    next_dt = datetime.strptime(next_date, '%Y-%m-%d')
-                    current_dt = date_obj
-                    
-                    total_days = (next_dt - prev_dt).days
-                    days_from_prev = (current_dt - prev_dt).days
-                    
-                    if total_days > 0:
-                        body_fat_val = prev_bf + (next_bf - prev_bf) * (days_from_prev / total_days)
-                else:
-                    # Forward-fill body fat
-                    body_fat_val = float(prev_data['body_fat_pct'])
-            
-            # Store the filled data if we have at least one value
-            if weight_val is not None or body_fat_val is not None:
-                filled_data[date_str] = {
-                    'weight': weight_val,
-                    'body_fat_pct': body_fat_val,
-                    'date_obj': date_obj
-                }
-        
-        
-        # 6. Delete ALL existing auto-generated events in the full range
-        # This ensures we don't have duplicates and can recreate them fresh
-        cur.execute("""
-            DELETE FROM events
-            WHERE user_id = %s 
-            AND event_type_id = 'weight'
-            AND data->>'_auto_generated' = 'true'
-            AND timestamp >= %s
-            AND timestamp <= %s
-        """, (user_id, int(first_date.timestamp() * 1000), int((end_date + timedelta(days=1)).timestamp() * 1000)))
-        
-        
-        # 7. Create new auto-generated events (only for dates without user data)
-        for date_str, data_info in filled_data.items():
-            # Skip if user already has data for this date
-            if date_str in user_data_by_date:
-                continue
-                
-            # Create timestamp at noon UTC for this date
-            date_obj = data_info['date_obj']
-            timestamp = int(date_obj.replace(hour=12).timestamp() * 1000)
-            
-            # Build data object
-            event_data = {
-                '_auto_generated': True
-            }
-            if data_info['weight'] is not None:
-                event_data['weight'] = round(data_info['weight'], 2)
-            if data_info['body_fat_pct'] is not None:
-                event_data['body_fat_pct'] = round(data_info['body_fat_pct'], 2)
-            
-            # Create event
-            event_id = f"evt_{uuid.uuid4().hex[:12]}"
-            cur.execute("""
+        # 5. Create the new auto-generated events in one batch
+        if new_rows:
+            execute_values(cur, """
                 INSERT INTO events (id, user_id, event_type_id, timestamp, category, data, notes)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (event_id, user_id, 'weight', timestamp, 'Health', json.dumps(event_data), 'Auto-generated'))
+                VALUES %s
+            """, new_rows, page_size=500)
+        
+        # Every day the refill touched, padded a day each side for the UTC-noon
+        # timestamps landing on a different ROLLUP_TZ day.
+        touched = [row[3] for row in new_rows[:1] + new_rows[-1:]]
+        if removed and removed['first_ts'] is not None:
+            touched += [removed['first_ts'], removed['last_ts']]
+        if touched:
+            refresh_rollups(cur, user_id, 'weight', min(touched) - 86400000, max(touched) + 86400000)
         
         conn.commit()
         
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+
+def purge_auto_weights(cur, user_id=None):
+    """
+    Delete stored auto-generated weigh-ins (for one user or everyone) and rebuild
+    the affected weight rollups. Returns the number of rows deleted. Caller commits.
+    """
+    scope = "AND user_id = %s" if user_id is not None else ""
+    cur.execute(f"""
+        DELETE FROM events
+        WHERE event_type_id = 'weight'
+        AND data->>'_auto_generated' = 'true'
+        {scope}
+    """, (user_id,) if user_id is not None else ())
+    deleted = cur.rowcount
+    if deleted:
+        write_rollups(cur, user_id, 'weight')
+    return deleted
+
+def sync_weight_fill_mode(user_id=None):
+    """
+    Bring stored weigh-ins in line with WEIGHT_FILL_MODE after switching it:
+    'virtual' purges the auto-generated rows, 'materialized' recreates them for
+    every user with real weigh-ins. Returns a short description of what changed.
+    """
+    if WEIGHT_FILL_MODE == 'virtual':
+        with db_connection() as conn:
+            cur = conn.cursor()
+            deleted = purge_auto_weights(cur, user_id)
+            conn.commit()
+        return f"purged {deleted} auto-generated weigh-ins"
+
+    if user_id is not None:
+        user_ids = [user_id]
+    else:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT DISTINCT user_id FROM events WHERE event_type_id = 'weight'")
+            user_ids = [row['user_id'] for row in cur.fetchall()]
+    for uid in user_ids:
+        fill_and_interpolate_weight_data(uid)
+    return f"refilled weigh-ins for {len(user_ids)} user(s)"
 
 def user_exists(user_id):
     """
@@ -2403,8 +3172,7 @@ def user_exists(user_id):
     if not user_id:
         return False
 
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT (
@@ -2419,8 +3187,6 @@ def user_exists(user_id):
         """, (user_id,) * 7)
         row = cur.fetchone()
         return bool(row and row['found'])
-    finally:
-        conn.close()
 
 def list_known_users():
     """
@@ -2428,8 +3194,7 @@ def list_known_users():
     and the most recent activity timestamp (ms) so a remote caller can identify
     which id is theirs. Read-only; never creates anything.
     """
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT user_id,
@@ -2460,16 +3225,13 @@ def list_known_users():
             'eventCount': int(row['event_count'] or 0),
             'lastActivity': int(row['last_ts']) if row['last_ts'] else None
         } for row in cur.fetchall()]
-    finally:
-        conn.close()
 
 def get_meals_in_range(user_id, start_ms, end_ms, limit=None):
     """
     Meals for a user within a half-open [start_ms, end_ms) window, newest first.
     Same record shape as get_user_meals.
     """
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         query = """
             SELECT * FROM meals
@@ -2483,24 +3245,18 @@ def get_meals_in_range(user_id, start_ms, end_ms, limit=None):
 
         cur.execute(query, tuple(params))
         return [_meal_record(m) for m in cur.fetchall()]
-    finally:
-        conn.close()
 
 def get_meal(meal_id, user_id):
     """Get a single meal scoped to its owner, or None."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM meals WHERE id = %s AND user_id = %s", (meal_id, user_id))
         row = cur.fetchone()
         return _meal_record(row) if row else None
-    finally:
-        conn.close()
 
 def get_user_data_range(user_id):
     """Earliest and latest activity timestamps (ms) across meals and events."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT MIN(first_ts) AS first_ts, MAX(last_ts) AS last_ts
@@ -2517,13 +3273,10 @@ def get_user_data_range(user_id):
             'first': int(row['first_ts']) if row and row['first_ts'] else None,
             'last': int(row['last_ts']) if row and row['last_ts'] else None
         }
-    finally:
-        conn.close()
 
 def create_user_category(user_id, name, icon):
     """Create a new user category."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         category_id = str(uuid.uuid4())
         
@@ -2545,13 +3298,10 @@ def create_user_category(user_id, name, icon):
                 'icon': result['icon']
             }
         return None  # Already exists
-    finally:
-        conn.close()
 
 def get_user_categories(user_id):
     """Get all categories for a user."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT name, icon FROM user_categories
@@ -2561,13 +3311,10 @@ def get_user_categories(user_id):
         
         rows = cur.fetchall()
         return [{'name': row['name'], 'icon': row['icon']} for row in rows]
-    finally:
-        conn.close()
 
 def update_user_category(user_id, category_name, new_name, new_icon):
     """Update a user category."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         
         # Check if new name already exists (if name changed)
@@ -2594,13 +3341,10 @@ def update_user_category(user_id, category_name, new_name, new_icon):
 
         conn.commit()
         return bool(result)
-    finally:
-        conn.close()
 
 def delete_user_category(user_id, category_name):
     """Delete (soft delete) a user category."""
-    conn = get_db_connection()
-    try:
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("""
             UPDATE user_categories
@@ -2612,5 +3356,163 @@ def delete_user_category(user_id, category_name):
         result = cur.fetchone()
         conn.commit()
         return bool(result)
-    finally:
-        conn.close()
+
+# Delta sync (/api/sync). Every insert/update on these tables stamps the row with
+# its transaction's id and the next value of one change_seq sequence, and deletes
+# leave tombstones stamped the same way (migration 10), so "everything since a
+# position" is one indexed range per table.
+# Each entry: table, response key, the row's JSON shape.
+SYNC_TABLES = [
+    ('meals', 'meals', _meal_record),
+    ('events', 'events', _event_record),
+    ('event_types', 'eventTypes', _event_type_record),
+    ('goals', 'goals', _goal_record),
+    ('user_categories', 'categories', lambda c: {
+        'id': c['id'], 'name': c['name'], 'icon': c['icon'], 'isActive': c['is_active']}),
+    # Favorites are identified by event type id
+    ('favorite_event_types', 'favorites', lambda f: f['event_type_id']),
+]
+
+# Tombstones are kept this long; a client that hasn't synced within it has to
+# start over from an empty replica
+SYNC_TOMBSTONE_DAYS = int(os.getenv('LIFESTATS_SYNC_TOMBSTONE_DAYS', 30))
+# get_changes queues a prune_sync_tombstones job at most this often per process
+SYNC_PRUNE_EVERY_S = 60 * 60
+
+_sync_prune_lock = threading.Lock()
+_last_sync_prune = 0.0
+
+class SyncExpired(Exception):
+    """A sync position older than the pruned tombstones. Routes answer 410."""
+
+def prune_sync_tombstones(days=None):
+    """
+    Delete tombstones older than `days` (SYNC_TOMBSTONE_DAYS) and move the sync
+    horizon up to the newest one deleted. Returns the number deleted.
+    """
+    days = SYNC_TOMBSTONE_DAYS if days is None else days
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT change_xid::text AS change_xid, change_seq FROM sync_tombstones
+            WHERE deleted_at < LOCALTIMESTAMP - make_interval(days => %s)
+            ORDER BY change_xid DESC, change_seq DESC
+            LIMIT 1
+        """, (days,))
+        newest = cur.fetchone()
+        if newest is None:
+            conn.rollback()
+            return 0
+
+        # By position, so nothing at or below the horizon survives
+        cur.execute("""
+            DELETE FROM sync_tombstones WHERE (change_xid, change_seq) <= (%s::xid8, %s)
+        """, (newest['change_xid'], newest['change_seq']))
+        pruned = cur.rowcount
+        cur.execute("""
+            UPDATE sync_horizon SET change_xid = %s::xid8, change_seq = %s
+            WHERE (change_xid, change_seq) < (%s::xid8, %s)
+        """, (newest['change_xid'], newest['change_seq'], newest['change_xid'], newest['change_seq']))
+        conn.commit()
+        return pruned
+
+def _queue_tombstone_prune():
+    """Queue a prune_sync_tombstones job if this process hasn't in SYNC_PRUNE_EVERY_S."""
+    global _last_sync_prune
+    with _sync_prune_lock:
+        due = time.time() - _last_sync_prune >= SYNC_PRUNE_EVERY_S
+        if due:
+            _last_sync_prune = time.time()
+    if due:
+        try:
+            jobs.enqueue('prune_sync_tombstones', {})
+        except Exception as e:
+            print(f"Warning: Failed to queue sync tombstone pruning: {e}")
+
+def get_changes(user_id, since=(0, 0), limit=1000):
+    """
+    Everything that changed for a user after sync position `since`: changed rows
+    per table (system event types included) and the ids deleted since.
+    Returns {'changes': {key: [records]}, 'deleted': {key: [ids]}, 'next':
+    position, 'more': bool}. Apply `deleted` before `changes` (a row deleted and
+    then re-created is in both), and pass `next` as `since` on the next call;
+    `more` means a table had over `limit` changes and the rest follow from `next`.
+    Raises SyncExpired if deletions after `since` have been pruned.
+
+    A position is (change_xid, change_seq): rows are read in the order of the
+    transactions that wrote them, and only up to the oldest transaction still
+    running. change_seq alone can't be a cursor: a transaction can stamp a row
+    and commit after a later-stamped row is already synced (e.g. while it waits
+    on a rollup lock), and would be skipped. Every transaction that can still
+    commit has an xid at or above that horizon, so its rows come after `next`.
+
+    Also queues the periodic tombstone prune, so it runs wherever clients sync.
+    """
+    since = (int(since[0]), int(since[1]))
+    _queue_tombstone_prune()
+    pages = {}
+    with db_connection() as conn:
+        cur = conn.cursor()
+        # Deletes behind the horizon are gone: only a sync from scratch is complete
+        if since != (0, 0):
+            cur.execute("SELECT change_xid::text AS change_xid, change_seq FROM sync_horizon")
+            pruned = cur.fetchone()
+            if pruned and since < (int(pruned['change_xid']), pruned['change_seq']):
+                raise SyncExpired(f"Sync position {since} is older than the kept deletions")
+
+        # Everything below this xid has committed or aborted, and is visible to
+        # the reads that follow (each later snapshot sees at least as much)
+        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS horizon")
+        horizon = int(cur.fetchone()['horizon'])
+
+        for table, _, _ in SYNC_TABLES:
+            owner = "(user_id = %s OR user_id IS NULL)" if table == 'event_types' else "user_id = %s"
+            cur.execute(f"""
+                SELECT *, change_xid::text AS change_xid
+                FROM {table}
+                WHERE {owner} AND (change_xid, change_seq) > (%s::text::xid8, %s)
+                  AND change_xid < %s::text::xid8
+                ORDER BY change_xid, change_seq
+                LIMIT %s
+            """, (user_id, since[0], since[1], horizon, limit + 1))
+            pages[table] = cur.fetchall()
+
+        # System rows (user_id NULL) can be deleted too, by seeding
+        cur.execute("""
+            SELECT table_name, row_id, change_seq, change_xid::text AS change_xid
+            FROM sync_tombstones
+            WHERE (user_id = %s OR user_id IS NULL)
+              AND (change_xid, change_seq) > (%s::text::xid8, %s)
+              AND change_xid < %s::text::xid8
+            ORDER BY change_xid, change_seq
+            LIMIT %s
+        """, (user_id, since[0], since[1], horizon, limit + 1))
+        pages['sync_tombstones'] = cur.fetchall()
+
+    def position(row):
+        return (int(row['change_xid']), row['change_seq'])
+
+    # A truncated table bounds this response at the last row it returned;
+    # the other tables' rows past that come again next time
+    bound = None
+    for rows in pages.values():
+        if len(rows) > limit:
+            del rows[limit:]
+            bound = position(rows[-1]) if bound is None else min(bound, position(rows[-1]))
+    for table, rows in pages.items():
+        pages[table] = [r for r in rows if bound is None or position(r) <= bound]
+
+    next_position = bound if bound is not None else max(since, (horizon, 0))
+
+    deleted = {key: [] for _, key, _ in SYNC_TABLES}
+    keys = {table: key for table, key, _ in SYNC_TABLES}
+    for tombstone in pages.pop('sync_tombstones'):
+        if tombstone['table_name'] in keys:
+            deleted[keys[tombstone['table_name']]].append(tombstone['row_id'])
+
+    return {
+        'changes': {key: [record(r) for r in pages[table]] for table, key, record in SYNC_TABLES},
+        'deleted': deleted,
+        'next': next_position,
+        'more': bound is not None
+    }
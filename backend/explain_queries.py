@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN the hot read queries and confirm they can use index scans.
+
+The statements are recorded by running the app's own db functions (stats,
+rollup and SQL-bucketed charts, the keyset meal page, search, sync), so they
+never drift from the SQL the app runs. Each one is planned twice: once as the
+planner would normally choose (small tables can legitimately prefer a
+sequential scan), and once with sequential scans disabled, which fails if no
+index can serve the query at all.
+
+Usage: python explain_queries.py [userId]
+"""
+
+import sys
+import time
+from datetime import timedelta
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from psycopg2.extras import RealDictCursor
+
+import db
+from db import db_connection, list_known_users, request_scope
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+# Tables whose indexes the hot paths depend on
+HOT_TABLES = ('meals', 'events', 'daily_rollups', 'sync_tombstones')
+
+# Statements recorded by RecordingCursor, as (sql, params)
+_recorded = []
+
+
+class RecordingCursor(RealDictCursor):
+    """A RealDictCursor that also keeps every SELECT it runs, for planning."""
+
+    def execute(self, query, vars=None):
+        if query.lstrip().upper().startswith(('SELECT', 'WITH')):
+            _recorded.append((query, vars))
+        return super().execute(query, vars)
+
+
+def hot_paths(user_id):
+    """(label, call) for the db reads behind every screen load and sync."""
+    now = int(time.time() * 1000)
+    year_ago = now - 365 * DAY_MS
+    month_ago = now - 30 * DAY_MS
+    today = db._rollup_day(now)
+    today_start = db._rollup_day_start(today)
+    tomorrow_start = db._rollup_day_start(today + timedelta(days=1))
+
+    return [
+        ('get_todays_stats (rollup day)', lambda: db.get_todays_stats(user_id, today_start, tomorrow_start)),
+        ('get_todays_stats (raw window)', lambda: db.get_todays_stats(user_id, now - DAY_MS, now)),
+        ('get_daily_stats', lambda: db.get_daily_stats(user_id, month_ago, now, db.ROLLUP_TZ)),
+        ('get_chart_data (rollups)', lambda: db.get_chart_data(
+            user_id, ['meal', 'weight', 'steps'], year_ago, now, tz_name=db.ROLLUP_TZ)),
+        ('get_chart_data (SQL buckets)', lambda: db.get_chart_data(
+            user_id, ['meal', 'weight', 'steps'], month_ago, now, granularity='hour', tz_name='UTC')),
+        ('get_meals_page', lambda: db.get_meals_page(user_id, month_ago, now, None, 100)),
+        ('get_meals_page (next page)', lambda: db.get_meals_page(user_id, month_ago, now, (now - DAY_MS, 'meal-'), 100)),
+        ('get_recent_meal_matches', lambda: db.get_recent_meal_matches(user_id, 'chikn')),
+        ('get_user_data_range', lambda: db.get_user_data_range(user_id)),
+        ('get_event_types', lambda: db.get_event_types(user_id)),
+        ('get_changes', lambda: db.get_changes(user_id, (0, 0), 1000)),
+    ]
+
+
+def hot_queries(user_id):
+    """
+    (label, sql, params) for every SELECT the hot paths run, recorded from the
+    db functions themselves so the plans always match the app's SQL.
+    """
+    queries = []
+    with request_scope(), db_connection() as conn:
+        factory = conn.cursor_factory
+        conn.cursor_factory = RecordingCursor
+        try:
+            for label, call in hot_paths(user_id):
+                del _recorded[:]
+                call()
+                for i, (sql, params) in enumerate(_recorded, 1):
+                    queries.append((f"{label} #{i}" if len(_recorded) > 1 else label, sql, params))
+        finally:
+            conn.cursor_factory = factory
+            conn.rollback()
+    return queries
+
+
+def plan_nodes(plan):
+    """Flatten an EXPLAIN (FORMAT JSON) plan tree into its node dicts."""
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def scans_on(cur, sql, params):
+    """Return [(node type, relation)] for every scan node touching HOT_TABLES."""
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    row = cur.fetchone()
+    plan = list(row.values())[0][0]['Plan']
+    return [(n['Node Type'], n.get('Relation Name'))
+            for n in plan_nodes(plan)
+            if n.get('Relation Name') in HOT_TABLES]
+
+
+def explain_all(user_id):
+    failures = 0
+    with db_connection() as conn:
+        cur = conn.cursor()
+        for label, sql, params in hot_queries(user_id):
+            natural = scans_on(cur, sql, params)
+            if not natural:
+                continue  # Only small lookup tables (event types, goals)
+
+            cur.execute("SET LOCAL enable_seqscan = off")
+            forced = scans_on(cur, sql, params)
+            conn.rollback()
+
+            indexed = all(node != 'Seq Scan' for node, _ in forced)
+            mark = "✓" if indexed else "✗"
+            print(f"\n{mark} {label}")
+            print(f"    planner choice:  {', '.join(f'{n} on {r}' for n, r in natural)}")
+            print(f"    seqscan off:     {', '.join(f'{n} on {r}' for n, r in forced)}")
+            if not indexed:
+                failures += 1
+
+    return failures
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        target_user = sys.argv[1]
+    else:
+        users = list_known_users()
+        if not users:
+            print("No users in the database to plan against")
+            sys.exit(1)
+        target_user = users[0]['userId']
+
+    print("=" * 60)
+    print(f"EXPLAINING HOT QUERIES FOR {target_user}")
+    print("=" * 60)
+
+    failed = explain_all(target_user)
+    print("\n" + "=" * 60)
+    print("✓ ALL QUERIES CAN USE AN INDEX" if not failed else f"✗ {failed} QUERIES HAVE NO USABLE INDEX")
+    print("=" * 60)
+    sys.exit(1 if failed else 0)
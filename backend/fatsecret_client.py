@@ -0,0 +1,198 @@
+"""
+Client for the FatSecret proxy.
+
+Every call goes through one pooled requests.Session (keep-alive, so repeat calls
+skip the TCP/TLS handshake), is retried on request errors (connection errors,
+timeouts, broken responses) and 5xx
+with jittered exponential backoff, and never takes longer than DEADLINE_S in
+total. A circuit breaker stops calling the proxy after BREAKER_FAILURES calls
+in a row fail: for BREAKER_RESET_S every call raises CircuitOpen at once, then
+a single trial call decides whether it closes again.
+"""
+
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = os.getenv('FATSECRET_PROXY_URL', 'https://fatsecret-proxy-production-e380.up.railway.app')
+# Whole call, retries included (the old single request's timeout)
+DEADLINE_S = float(os.getenv('FATSECRET_DEADLINE', '5'))
+ATTEMPT_TIMEOUT_S = 2.5
+RETRIES = 2
+BACKOFF_S = 0.2
+BREAKER_FAILURES = 5
+BREAKER_RESET_S = 30
+POOL_SIZE = 10
+
+
+class CircuitOpen(Exception):
+    """The proxy has been failing; calls are refused until the breaker resets."""
+
+
+class CircuitBreaker:
+    """Closed until `failures` calls in a row fail, then open for `reset_s`, then half-open."""
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_s=BREAKER_RESET_S):
+        self.failures = failures
+        self.reset_s = reset_s
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self):
+        """Whether a call may go ahead now. In half-open state only one trial call may."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_s and not self._trial_running:
+                self._trial_running = True
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._trial_running or (self._opened_at is None and self._consecutive >= self.failures):
+                self._opened_at = time.monotonic()
+                self._stats['opened'] += 1
+            self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_s:
+                return 'half-open'
+            return 'open'
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return dict(self._stats, state=state, consecutive_failures=self._consecutive)
+
+
+class Client:
+    def __init__(self, base_url=BASE_URL, deadline_s=DEADLINE_S, attempt_timeout_s=ATTEMPT_TIMEOUT_S,
+                 retries=RETRIES, backoff_s=BACKOFF_S, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.deadline_s = deadline_s
+        self.attempt_timeout_s = attempt_timeout_s
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'attempts': 0, 'retries': 0, 'failures': 0}
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def get(self, path, params=None):
+        """
+        GET base_url + path. Returns the response once it is not a 5xx (4xx
+        included); after the last attempt, the last 5xx response or the last
+        connection error/timeout. Raises CircuitOpen while the breaker is open.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen(f"FatSecret proxy circuit open after {self.breaker.failures} failures")
+
+        self._count('calls')
+        try:
+            response = self._attempts(path, params)
+        except BaseException:
+            # Whatever went wrong, the call is over: settle the breaker so a
+            # half-open trial can't leave it waiting on a result forever
+            self._count('failures')
+            self.breaker.record_failure()
+            raise
+        if response.status_code < 500:
+            self.breaker.record_success()
+        else:
+            self._count('failures')
+            self.breaker.record_failure()
+        return response
+
+    def _attempts(self, path, params):
+        """get()'s attempts: the first response under 500, else the last 5xx or error."""
+        deadline = time.monotonic() + self.deadline_s
+        last_response = last_error = None
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if attempt:
+                self._count('retries')
+            self._count('attempts')
+            try:
+                response = self.session.get(f'{self.base_url}{path}', params=params,
+                                            timeout=min(self.attempt_timeout_s, remaining))
+            except requests.RequestException as e:
+                # Connection errors and timeouts, but also truncated or undecodable
+                # bodies and redirect loops
+                last_error = e
+            else:
+                if response.status_code < 500:
+                    return response
+                last_response, last_error = response, None
+
+            if attempt < self.retries:
+                # Full jitter, so retries from many workers don't arrive together
+                delay = random.uniform(0, self.backoff_s * 2 ** attempt)
+                remaining = deadline - time.monotonic()
+                if delay >= remaining:
+                    break
+                time.sleep(delay)
+
+        if last_error is None and last_response is None:
+            last_error = requests.Timeout(f"FatSecret proxy deadline of {self.deadline_s}s exceeded")
+        if last_error is not None:
+            raise last_error
+        return last_response
+
+    def search(self, query):
+        return self.get('/search', {'query': query})
+
+    def food(self, food_id):
+        return self.get('/food', {'food_id': food_id})
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['breaker'] = self.breaker.stats()
+        return stats
+
+
+# The process-wide client the app uses
+client = Client()
+
+
+def search(query):
+    """The proxy's /search response for query."""
+    return client.search(query)
+
+
+def food(food_id):
+    """The proxy's /food response for food_id."""
+    return client.food(food_id)
+
+
+def stats():
+    return client.stats()
@@ -0,0 +1,240 @@
+"""
+Food and search caches, on one of two backends:
+
+  postgres  food_cache/search_cache on the app's own database (pg_food_cache),
+            plain SQL on the pooled connection
+  supabase  the separate Supabase food cache project over its REST API
+            (supabase_client), one HTTPS request per call
+
+LIFESTATS_FOOD_CACHE picks one. It defaults to 'supabase' when that project is
+configured (FOOD_CACHE_SUPABASE_URL/_SERVICE_ROLE_KEY), since that is where
+existing cached and custom foods live, and to 'postgres' otherwise.
+`python bench_food_cache.py --copy` copies the Supabase rows across.
+
+Search results get a second, in-process tier in front of the backend: an LRU of
+recent queries, so a repeat search answers from memory. Entries are fresh for
+SEARCH_TTL_S after they were fetched from FatSecret; after that they are still
+served for up to SEARCH_MAX_STALE_S while the caller refreshes them in the
+background, and then dropped. evict_search_cache() removes persistent rows that
+are past that, or expired and rarely read.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pg_food_cache
+import supabase_client
+
+BACKENDS = {
+    'postgres': pg_food_cache,
+    'supabase': supabase_client
+}
+
+BACKEND = os.getenv('LIFESTATS_FOOD_CACHE') or ('supabase' if supabase_client.supabase else 'postgres')
+if BACKEND not in BACKENDS:
+    raise ValueError(f"LIFESTATS_FOOD_CACHE must be one of {', '.join(BACKENDS)}, not {BACKEND!r}")
+
+_backend = BACKENDS[BACKEND]
+
+get_cached_food = _backend.get_cached_food
+get_cached_foods = _backend.get_cached_foods
+cache_food = _backend.cache_food
+cache_foods = _backend.cache_foods
+add_custom_food = _backend.add_custom_food
+list_custom_foods = _backend.list_custom_foods
+update_custom_food = _backend.update_custom_food
+delete_custom_food = _backend.delete_custom_food
+search_food_in_db = _backend.search_food_in_db
+
+SEARCH_TTL_S = int(os.getenv('LIFESTATS_SEARCH_CACHE_TTL', str(7 * 24 * 60 * 60)))
+SEARCH_MAX_STALE_S = int(os.getenv('LIFESTATS_SEARCH_CACHE_MAX_STALE', str(30 * 24 * 60 * 60)))
+SEARCH_MEMORY_ENTRIES = int(os.getenv('LIFESTATS_SEARCH_CACHE_ENTRIES', '1000'))
+# Expired persistent rows read fewer times than this are evicted without waiting
+# out the stale window.
+SEARCH_EVICT_MIN_HITS = 2
+# evict_search_cache runs at most this often per process, queued after a write.
+SEARCH_EVICT_EVERY_S = 60 * 60
+
+# FatSecret lookups that failed or found nothing are remembered briefly, so a
+# query that keeps failing doesn't reach the proxy on every keystroke.
+NEGATIVE_EMPTY_TTL_S = int(os.getenv('LIFESTATS_NEGATIVE_CACHE_EMPTY_TTL', '600'))
+NEGATIVE_ERROR_TTL_S = int(os.getenv('LIFESTATS_NEGATIVE_CACHE_ERROR_TTL', '30'))
+
+_search_memory = OrderedDict()  # query -> (results, cached_at)
+_negative = {}  # (kind, key) -> (outcome, expires_at)
+_search_lock = threading.Lock()
+_search_refreshing = set()
+_last_eviction = 0.0
+_search_stats = {
+    'memory_hits': 0,
+    'persistent_hits': 0,
+    'misses': 0,
+    'stale': 0,
+    'refreshes': 0,
+    'refresh_errors': 0,
+    'memory_evictions': 0,
+    'negative_hits': 0
+}
+
+
+def _count(stat):
+    with _search_lock:
+        _search_stats[stat] += 1
+
+
+def _remember(query, results, cached_at):
+    with _search_lock:
+        _search_memory[query] = (results, cached_at)
+        _search_memory.move_to_end(query)
+        while len(_search_memory) > SEARCH_MEMORY_ENTRIES:
+            _search_memory.popitem(last=False)
+            _search_stats['memory_evictions'] += 1
+
+
+def get_search_results(query: str):
+    """
+    Cached search results for query, from memory or the persistent tier.
+
+    Returns (results, stale): results is None on a miss, and stale means they are
+    past SEARCH_TTL_S and should be refreshed (see refresh_search_results).
+    """
+    now = time.time()
+    with _search_lock:
+        entry = _search_memory.get(query)
+        if entry:
+            _search_memory.move_to_end(query)
+    if entry:
+        results, cached_at = entry
+        age = now - cached_at
+        if age < SEARCH_TTL_S:
+            _count('memory_hits')
+            return results, False
+        if age < SEARCH_TTL_S + SEARCH_MAX_STALE_S:
+            _count('memory_hits')
+            _count('stale')
+            return results, True
+        with _search_lock:
+            _search_memory.pop(query, None)
+
+    results, cached_at = _backend.get_cached_search(query)
+    if results is None:
+        _count('misses')
+        return None, False
+    # Rows from before ages were recorded count as fresh as of now
+    cached_at = cached_at or now
+    age = now - cached_at
+    if age >= SEARCH_TTL_S + SEARCH_MAX_STALE_S:
+        _count('misses')
+        return None, False
+    _remember(query, results, cached_at)
+    _count('persistent_hits')
+    if age >= SEARCH_TTL_S:
+        _count('stale')
+        return results, True
+    return results, False
+
+
+def get_cached_results(query: str):
+    """Cached search results for query (fresh or stale), or None."""
+    return get_search_results(query)[0]
+
+
+def remember_results(query: str, results: dict):
+    """Keep freshly fetched results in the memory tier only (the caller persists them)."""
+    _remember(query, results, time.time())
+
+
+def cache_results(query: str, results: dict):
+    """Save freshly fetched search results to both tiers."""
+    global _last_eviction
+    _remember(query, results, time.time())
+    _backend.cache_results(query, results)
+
+    with _search_lock:
+        evict = time.time() - _last_eviction >= SEARCH_EVICT_EVERY_S
+        if evict:
+            _last_eviction = time.time()
+    if evict:
+        try:
+            import jobs
+            jobs.enqueue('evict_search_cache', {})
+        except Exception as e:
+            print(f"Warning: Failed to queue search cache eviction: {e}")
+
+
+def refresh_search_results(query: str, fetch):
+    """
+    Re-fetch stale results for query in the background with fetch(), which returns
+    fresh results or None. At most one refresh per query runs at a time.
+    """
+    with _search_lock:
+        if query in _search_refreshing:
+            return
+        _search_refreshing.add(query)
+
+    def refresh():
+        try:
+            results = fetch()
+            if results is None:
+                _count('refresh_errors')
+                return
+            cache_results(query, results)
+            _count('refreshes')
+        except Exception as e:
+            print(f"Error refreshing search cache for {query!r}: {e}")
+            _count('refresh_errors')
+        finally:
+            with _search_lock:
+                _search_refreshing.discard(query)
+
+    threading.Thread(target=refresh, name='lifestats-search-refresh', daemon=True).start()
+
+
+def evict_search_cache():
+    """Delete persistent search rows past the stale window, or expired and rarely read."""
+    evicted = _backend.evict_search_cache(SEARCH_TTL_S + SEARCH_MAX_STALE_S, SEARCH_TTL_S, SEARCH_EVICT_MIN_HITS)
+    print(f"Evicted {evicted} search cache rows")
+    return evicted
+
+
+def remember_failure(kind: str, key, outcome, ttl_s: int):
+    """Remember for ttl_s that the FatSecret lookup (kind, key) came to outcome: an error or nothing."""
+    now = time.time()
+    with _search_lock:
+        if len(_negative) >= SEARCH_MEMORY_ENTRIES:
+            for expired in [k for k, (_, expires_at) in _negative.items() if expires_at <= now]:
+                del _negative[expired]
+            if len(_negative) >= SEARCH_MEMORY_ENTRIES:
+                del _negative[next(iter(_negative))]
+        _negative[(kind, key)] = (outcome, now + ttl_s)
+
+
+def known_failure(kind: str, key):
+    """The outcome remembered by remember_failure for (kind, key), or None if there is none current."""
+    with _search_lock:
+        entry = _negative.get((kind, key))
+        if not entry:
+            return None
+        outcome, expires_at = entry
+        if expires_at <= time.time():
+            del _negative[(kind, key)]
+            return None
+        _search_stats['negative_hits'] += 1
+        return outcome
+
+
+def search_cache_stats():
+    """Hit, miss and stale counters for this process, plus the memory tier's size."""
+    with _search_lock:
+        stats = dict(_search_stats)
+        stats['memory_entries'] = len(_search_memory)
+        stats['negative_entries'] = len(_negative)
+        stats['refreshing'] = len(_search_refreshing)
+    lookups = stats['memory_hits'] + stats['persistent_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['memory_hits'] + stats['persistent_hits']) / lookups, 3) if lookups else None
+    stats['backend'] = BACKEND
+    stats['ttl_s'] = SEARCH_TTL_S
+    stats['max_stale_s'] = SEARCH_MAX_STALE_S
+    return stats
@@ -0,0 +1,31 @@
+-- Trigram search over food_cache (the Supabase food cache project, not the
+-- Postgres database that migrate.py manages).
+--
+-- Run once in the Supabase SQL editor. search_food_in_db calls the
+-- search_food_cache RPC and falls back to a plain ILIKE scan until it exists.
+-- On Supabase pg_trgm lives in the "extensions" schema, which is already on the
+-- search_path of the API roles.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Serves both LIKE '%q%' and the <% word-similarity operator
+CREATE INDEX IF NOT EXISTS idx_food_cache_food_name_trgm
+    ON food_cache USING GIN (LOWER(food_name) gin_trgm_ops);
+
+ANALYZE food_cache;
+
+-- Substring matches first, then typo-tolerant matches, each ranked by how
+-- closely the query matches a word run in the name; shorter names win ties.
+CREATE OR REPLACE FUNCTION search_food_cache(query text, max_results integer DEFAULT 5)
+RETURNS SETOF food_cache
+LANGUAGE sql STABLE
+AS $$
+    SELECT fc.*
+    FROM food_cache fc
+    WHERE LOWER(fc.food_name) LIKE ('%' || LOWER(query) || '%')
+       OR LOWER(query) <% LOWER(fc.food_name)
+    ORDER BY (LOWER(fc.food_name) LIKE ('%' || LOWER(query) || '%')) DESC,
+             word_similarity(LOWER(query), LOWER(fc.food_name)) DESC,
+             LENGTH(fc.food_name)
+    LIMIT max_results;
+$$;
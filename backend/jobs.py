@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Background jobs for work that can happen after a write endpoint responds
+(weight refills, search-cache writes and eviction), and periodic cleanup
+(sync tombstone pruning).
+
+Every job is a row in the Postgres jobs table before it runs, so work is never
+lost with the process that queued it: each process runs jobs on a small thread
+pool, and the first dispatch in a process (or `python jobs.py`) also picks up
+anything left queued, or stuck running, by one that stopped.
+
+Usage:
+    python jobs.py            # queue the tombstone prune, run every pending job, exit
+    python jobs.py --status   # print queue depth and latency
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+WORKERS = int(os.getenv('LIFESTATS_JOB_WORKERS', '2'))
+MAX_ATTEMPTS = 3
+# A job 'running' for longer than this is assumed lost with its process.
+STALE_AFTER_MS = 5 * 60 * 1000
+# Finished jobs are kept this long for the status endpoint's latency figures.
+KEEP_DONE_MS = 24 * 60 * 60 * 1000
+# Run jobs synchronously in the enqueueing thread instead (scripts and tests).
+INLINE = os.getenv('LIFESTATS_JOBS_INLINE', '0') == '1'
+
+_handlers = {}
+_executor = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {
+    'submitted': 0,
+    'completed': 0,
+    'retried': 0,
+    'failed': 0,
+    'in_flight': 0
+}
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def handler(kind):
+    """Register fn(payload) as the handler for jobs of this kind."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+@handler('weight_refill')
+def _weight_refill(payload):
+    db.fill_and_interpolate_weight_data(payload['userId'], payload.get('timestamps'))
+
+
+@handler('cache_search_results')
+def _cache_search_results(payload):
+    import food_cache
+    food_cache.cache_results(payload['query'], payload['results'])
+
+
+@handler('evict_search_cache')
+def _evict_search_cache(payload):
+    import food_cache
+    food_cache.evict_search_cache()
+
+
+@handler('prune_sync_tombstones')
+def _prune_sync_tombstones(payload):
+    pruned = db.prune_sync_tombstones()
+    if pruned:
+        print(f"Pruned {pruned} sync tombstones")
+
+
+def enqueue(kind, payload, cur=None):
+    """
+    Record a job and return its id.
+
+    With cur, the job is inserted in the caller's transaction, so it exists only
+    if the write it follows commits; call dispatch(job_id) after committing.
+    Without, it is committed and dispatched at once.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    sql = "INSERT INTO jobs (kind, payload, created_at) VALUES (%s, %s, %s) RETURNING id"
+    params = (kind, json.dumps(payload), _now_ms())
+    if cur is not None:
+        cur.execute(sql, params)
+        return cur.fetchone()['id']
+
+    with db.db_connection() as conn:
+        own_cur = conn.cursor()
+        own_cur.execute(sql, params)
+        job_id = own_cur.fetchone()['id']
+        conn.commit()
+    dispatch(job_id)
+    return job_id
+
+
+def dispatch(job_id):
+    """Hand a committed job to this process's worker pool (or run it now if INLINE)."""
+    if job_id is None:
+        return
+    if INLINE:
+        _run(job_id)
+        return
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='lifestats-job')
+            # First job in this process: also adopt whatever others left behind
+            _executor.submit(recover)
+        executor = _executor
+    with _stats_lock:
+        _stats['submitted'] += 1
+        _stats['in_flight'] += 1
+    executor.submit(_run_counted, job_id)
+
+
+def _run_counted(job_id):
+    try:
+        _run(job_id)
+    finally:
+        with _stats_lock:
+            _stats['in_flight'] -= 1
+
+
+def _run(job_id):
+    """Claim a job, run its handler and record the outcome. False if it wasn't ours to run."""
+    now = _now_ms()
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        # Only one process may claim a job; stale 'running' jobs are fair game
+        cur.execute("""
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, started_at = %s
+            WHERE id = %s
+            AND (status = 'queued' OR (status = 'running' AND started_at < %s))
+            RETURNING kind, payload, attempts
+        """, (now, job_id, now - STALE_AFTER_MS))
+        job = cur.fetchone()
+        conn.commit()
+    if not job:
+        return False
+
+    try:
+        _handlers[job['kind']](job['payload'])
+    except Exception as e:
+        print(f"Job {job_id} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+        traceback.print_exc()
+        retry = job['attempts'] < MAX_ATTEMPTS
+        with db.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE jobs SET status = %s, last_error = %s, finished_at = %s
+                WHERE id = %s
+            """, ('queued' if retry else 'failed', str(e), _now_ms(), job_id))
+            conn.commit()
+        with _stats_lock:
+            _stats['retried' if retry else 'failed'] += 1
+        if retry and not INLINE:
+            timer = threading.Timer(2 ** job['attempts'], dispatch, (job_id,))
+            timer.daemon = True
+            timer.start()
+        return True
+
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE jobs SET status = 'done', last_error = NULL, finished_at = %s
+            WHERE id = %s
+        """, (_now_ms(), job_id))
+        conn.commit()
+    with _stats_lock:
+        _stats['completed'] += 1
+    return True
+
+
+def _pending_ids(cur):
+    cur.execute("""
+        SELECT id FROM jobs
+        WHERE status = 'queued' OR (status = 'running' AND started_at < %s)
+        ORDER BY created_at
+    """, (_now_ms() - STALE_AFTER_MS,))
+    return [row['id'] for row in cur.fetchall()]
+
+
+def recover():
+    """Dispatch every queued or stale job, and drop old finished ones."""
+    try:
+        with db.db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM jobs WHERE status = 'done' AND finished_at < %s",
+                        (_now_ms() - KEEP_DONE_MS,))
+            job_ids = _pending_ids(cur)
+            conn.commit()
+        for job_id in job_ids:
+            dispatch(job_id)
+    except Exception as e:
+        print(f"Error recovering jobs: {e}")
+
+
+def run_pending():
+    """Run every queued or stale job in this thread. Returns how many ran."""
+    with db.db_connection() as conn:
+        job_ids = _pending_ids(conn.cursor())
+        conn.commit()
+    return sum(1 for job_id in job_ids if _run(job_id))
+
+
+def queue_status():
+    """Queue depth by status plus enqueue-to-finish latency over the last hour."""
+    now = _now_ms()
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT status, COUNT(*) AS count, MIN(created_at) AS oldest FROM jobs GROUP BY status")
+        by_status = {row['status']: row for row in cur.fetchall()}
+        cur.execute("""
+            SELECT
+                COUNT(*) AS count,
+                AVG(finished_at - created_at) AS avg_ms,
+                percentile_cont(0.95) WITHIN GROUP (ORDER BY finished_at - created_at) AS p95_ms,
+                MAX(finished_at - created_at) AS max_ms,
+                AVG(finished_at - started_at) AS avg_run_ms
+            FROM jobs
+            WHERE status = 'done' AND finished_at >= %s
+        """, (now - 60 * 60 * 1000,))
+        latency = cur.fetchone()
+
+    queued = by_status.get('queued')
+    with _stats_lock:
+        process = dict(_stats)
+    process['workers'] = WORKERS
+    process['inline'] = INLINE
+
+    return {
+        'depth': sum(by_status[s]['count'] for s in ('queued', 'running') if s in by_status),
+        'by_status': {status: row['count'] for status, row in by_status.items()},
+        'oldest_queued_age_ms': now - queued['oldest'] if queued else None,
+        'latency_last_hour_ms': {
+            'jobs': latency['count'],
+            'avg': float(latency['avg_ms']) if latency['avg_ms'] is not None else None,
+            'p95': float(latency['p95_ms']) if latency['p95_ms'] is not None else None,
+            'max': latency['max_ms'],
+            'avg_run': float(latency['avg_run_ms']) if latency['avg_run_ms'] is not None else None
+        },
+        'process': process
+    }
+
+
+if __name__ == '__main__':
+    if not db.DATABASE_URL:
+        print("POSTGRES_URL is not set")
+        sys.exit(1)
+
+    if sys.argv[1:] == ['--status']:
+        print(json.dumps(queue_status(), indent=2))
+    elif not sys.argv[1:]:
+        started = time.time()
+        # Cron-able: prunes tombstones even where nothing syncs
+        with db.db_connection() as conn:
+            enqueue('prune_sync_tombstones', {}, conn.cursor())
+            conn.commit()
+        ran = run_pending()
+        print(f"✓ Ran {ran} pending jobs in {time.time() - started:.1f}s")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,728 @@
+"""
+Versioned schema migrations.
+
+Each entry in MIGRATIONS runs exactly once, in order, in its own transaction,
+and is recorded in the schema_version table. init_db() calls migrate() on
+startup, which costs a single version check once the database is current.
+Deploys can apply pending migrations ahead of traffic instead:
+
+    python backend/migrate.py           # apply anything pending
+    python backend/migrate.py --status  # list applied and pending versions
+
+A migration is either a SQL string or a function taking a cursor. Never edit
+one that has shipped; append a new version instead.
+"""
+
+import sys
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import db
+
+# Arbitrary constant key for pg_advisory_lock, so concurrent cold starts take
+# turns instead of racing through the same DDL.
+MIGRATION_LOCK_ID = 7324001
+
+SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Tables as they stood before versioned migrations existed.
+BASELINE_TABLES_SQL = """
+    CREATE TABLE IF NOT EXISTS meals (
+        id VARCHAR(50) PRIMARY KEY,
+        user_id VARCHAR(50) NOT NULL,
+        food_name TEXT NOT NULL,
+        brand_name TEXT,
+        meal_type VARCHAR(20) NOT NULL,
+        calories INTEGER DEFAULT 0,
+        protein FLOAT DEFAULT 0,
+        carbs FLOAT DEFAULT 0,
+        fat FLOAT DEFAULT 0,
+        serving_size FLOAT DEFAULT 1.0,
+        serving_unit VARCHAR(50) DEFAULT '',
+        cholesterol FLOAT DEFAULT 0,
+        sodium FLOAT DEFAULT 0,
+        fiber FLOAT DEFAULT 0,
+        sugar FLOAT DEFAULT 0,
+        saturated_fat FLOAT DEFAULT 0,
+        trans_fat FLOAT DEFAULT 0,
+        polyunsaturated_fat FLOAT DEFAULT 0,
+        monounsaturated_fat FLOAT DEFAULT 0,
+        added_sugar FLOAT DEFAULT 0,
+        vitamin_d FLOAT DEFAULT 0,
+        calcium FLOAT DEFAULT 0,
+        iron FLOAT DEFAULT 0,
+        potassium FLOAT DEFAULT 0,
+        vitamin_c FLOAT DEFAULT 0,
+        timestamp BIGINT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS search_cache (
+        query TEXT PRIMARY KEY,
+        results JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Event Types Table: Defines what event types exist and their schemas
+    CREATE TABLE IF NOT EXISTS event_types (
+        id VARCHAR(50) PRIMARY KEY,
+        user_id VARCHAR(50),
+        category VARCHAR(50) NOT NULL,
+        name VARCHAR(100) NOT NULL,
+        icon VARCHAR(50),
+        color VARCHAR(20),
+        field_schema JSONB NOT NULL,
+        aggregation_type VARCHAR(20) DEFAULT 'sum',
+        primary_unit VARCHAR(50),
+        tracking_type VARCHAR(20) DEFAULT 'count',
+        is_active BOOLEAN DEFAULT true,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- User Favorites Table: Linking users to their favorite event types (system or custom)
+    CREATE TABLE IF NOT EXISTS favorite_event_types (
+        user_id VARCHAR(50) NOT NULL,
+        event_type_id VARCHAR(50) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, event_type_id)
+    );
+
+    -- Events Table: Unified storage for all event types
+    CREATE TABLE IF NOT EXISTS events (
+        id VARCHAR(50) PRIMARY KEY,
+        user_id VARCHAR(50) NOT NULL,
+        event_type_id VARCHAR(50) NOT NULL,
+        timestamp BIGINT NOT NULL,
+        category VARCHAR(50) NOT NULL,
+        data JSONB NOT NULL,
+        notes TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- User Profiles Table: Stores user profile information
+    CREATE TABLE IF NOT EXISTS user_profiles (
+        user_id VARCHAR(50) PRIMARY KEY,
+        sex VARCHAR(10),
+        birthdate DATE,
+        height_inches FLOAT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Goals Table: User defined goals for event types
+    CREATE TABLE IF NOT EXISTS goals (
+        id VARCHAR(50) PRIMARY KEY,
+        user_id VARCHAR(50) NOT NULL,
+        event_type_id VARCHAR(50) NOT NULL,
+        target_value FLOAT NOT NULL,
+        period VARCHAR(20) DEFAULT 'daily',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- User Categories Table: dedicated table for custom categories
+    CREATE TABLE IF NOT EXISTS user_categories (
+        id VARCHAR(50) PRIMARY KEY,
+        user_id VARCHAR(50) NOT NULL,
+        name VARCHAR(50) NOT NULL,
+        icon VARCHAR(10),
+        is_active BOOLEAN DEFAULT true,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, name)
+    );
+"""
+
+# Columns added to those tables over time, tolerant of ones that already exist.
+BASELINE_COLUMNS_SQL = """
+    DO $$
+    BEGIN
+        -- Meals Table Columns and Defaults
+        BEGIN
+            ALTER TABLE meals ADD COLUMN serving_size FLOAT DEFAULT 1.0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN serving_unit VARCHAR(50) DEFAULT '';
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN cholesterol FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN sodium FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN fiber FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN sugar FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN saturated_fat FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN trans_fat FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN polyunsaturated_fat FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN monounsaturated_fat FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN added_sugar FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN vitamin_d FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN calcium FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN iron FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN potassium FLOAT DEFAULT 0;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE meals ADD COLUMN vitamin_c FLOAT DEFAULT NULL;
+            -- Update existing defaults to NULL for all extended nutrients
+            ALTER TABLE meals ALTER COLUMN cholesterol DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN sodium DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN fiber DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN sugar DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN saturated_fat DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN trans_fat DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN polyunsaturated_fat DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN monounsaturated_fat DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN added_sugar DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN vitamin_d DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN calcium DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN iron DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN potassium DROP DEFAULT;
+            ALTER TABLE meals ALTER COLUMN vitamin_c DROP DEFAULT;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+
+        BEGIN
+            ALTER TABLE meals ADD COLUMN brand_name TEXT;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+
+        -- Event Types Schema Updates
+        BEGIN
+            ALTER TABLE event_types ADD COLUMN tracking_type VARCHAR(20) DEFAULT 'count';
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+        BEGIN
+            ALTER TABLE event_types ADD COLUMN is_favorite BOOLEAN DEFAULT false;
+        EXCEPTION
+            WHEN duplicate_column THEN NULL;
+        END;
+    END $$;
+"""
+
+# Indexes for event_types and events.
+BASELINE_INDEXES_SQL = """
+    -- Indexes for event_types
+    CREATE INDEX IF NOT EXISTS idx_event_types_user_category
+        ON event_types(user_id, category);
+    CREATE INDEX IF NOT EXISTS idx_event_types_active
+        ON event_types(is_active);
+
+    -- Indexes for events
+    CREATE INDEX IF NOT EXISTS idx_events_user_timestamp
+        ON events(user_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_events_user_category
+        ON events(user_id, category);
+    CREATE INDEX IF NOT EXISTS idx_events_type
+        ON events(event_type_id);
+    CREATE INDEX IF NOT EXISTS idx_events_data_gin
+        ON events USING GIN (data);
+"""
+
+# Version 3: meals had no secondary index, so every per-user window query was a
+# sequential scan over all users' rows.
+MEAL_INDEXES_SQL = """
+    -- Per-user time windows (today stats, charts, ranges, first/last activity)
+    CREATE INDEX IF NOT EXISTS idx_meals_user_timestamp
+        ON meals(user_id, timestamp DESC);
+
+    -- DISTINCT ON (LOWER(food_name)) in get_recent_meal_matches
+    CREATE INDEX IF NOT EXISTS idx_meals_user_food_name
+        ON meals(user_id, LOWER(food_name), timestamp DESC);
+
+    -- Per-type windows (chart series, weight lookups, last-used); the
+    -- user_id prefix makes the old single-column type index redundant.
+    CREATE INDEX IF NOT EXISTS idx_events_user_type_timestamp
+        ON events(user_id, event_type_id, timestamp);
+    DROP INDEX IF EXISTS idx_events_type;
+
+    ANALYZE meals;
+    ANALYZE events;
+"""
+
+# Version 4: the search box matches meal history on substrings of the food and
+# brand name, which a btree cannot serve. Trigram GIN indexes cover LIKE '%q%'
+# as well as the word_similarity operators used for typo-tolerant matches.
+MEAL_TRIGRAM_SQL = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+    CREATE INDEX IF NOT EXISTS idx_meals_food_name_trgm
+        ON meals USING GIN (LOWER(food_name) gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_meals_brand_name_trgm
+        ON meals USING GIN (LOWER(brand_name) gin_trgm_ops);
+"""
+
+# Version 5: per-day aggregates that charts, today stats and summaries read
+# instead of re-aggregating raw rows (see db.write_rollups).
+DAILY_ROLLUPS_SQL = """
+    CREATE TABLE IF NOT EXISTS daily_rollups (
+        user_id VARCHAR(50) NOT NULL,
+        event_type_id VARCHAR(50) NOT NULL,
+        field TEXT NOT NULL,
+        local_day DATE NOT NULL,
+        value_sum DOUBLE PRECISION NOT NULL,
+        value_count INTEGER NOT NULL,
+        value_min DOUBLE PRECISION,
+        value_max DOUBLE PRECISION,
+        value_last DOUBLE PRECISION,
+        last_ts BIGINT,
+        PRIMARY KEY (user_id, event_type_id, field, local_day)
+    );
+
+    -- Today stats / summaries read every type for a span of days
+    CREATE INDEX IF NOT EXISTS idx_daily_rollups_user_day
+        ON daily_rollups(user_id, local_day);
+"""
+
+# Version 5's backfill, as db.write_rollups computed rollups when it shipped:
+# frozen here so later changes to db's rollup fields don't change what this
+# migration does. Days are bucketed in %(tz)s (db.ROLLUP_TZ).
+_V5_NUMERIC_TEXT_RE = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+
+
+def _v5_json_number(key):
+    return (f"CASE jsonb_typeof(e.data->'{key}') "
+            f"WHEN 'number' THEN (e.data->>'{key}')::float "
+            f"WHEN 'string' THEN CASE WHEN e.data->>'{key}' ~ '{_V5_NUMERIC_TEXT_RE}' THEN (e.data->>'{key}')::float END "
+            f"END")
+
+
+_V5_FIRST_NUMERIC = """(
+    SELECT kv.value::text::float
+    FROM jsonb_each(e.data) WITH ORDINALITY AS kv(key, value, n)
+    WHERE jsonb_typeof(kv.value) = 'number'
+    ORDER BY kv.n
+    LIMIT 1
+)"""
+
+_V5_ROLLUP_UPSERT = """
+    ON CONFLICT (user_id, event_type_id, field, local_day) DO UPDATE SET
+        value_sum = EXCLUDED.value_sum,
+        value_count = EXCLUDED.value_count,
+        value_min = EXCLUDED.value_min,
+        value_max = EXCLUDED.value_max,
+        value_last = EXCLUDED.value_last,
+        last_ts = EXCLUDED.last_ts
+"""
+
+DAILY_ROLLUPS_MEALS_BACKFILL_SQL = f"""
+    INSERT INTO daily_rollups (user_id, event_type_id, field, local_day,
+                               value_sum, value_count, value_min, value_max, value_last, last_ts)
+    SELECT
+        m.user_id,
+        'meal',
+        f.field,
+        (to_timestamp(m.timestamp / 1000.0) AT TIME ZONE %(tz)s)::date AS local_day,
+        SUM(f.value),
+        COUNT(f.value),
+        MIN(f.value),
+        MAX(f.value),
+        (ARRAY_AGG(f.value ORDER BY m.timestamp DESC) FILTER (WHERE f.value IS NOT NULL))[1],
+        MAX(m.timestamp) FILTER (WHERE f.value IS NOT NULL)
+    FROM meals m
+    CROSS JOIN LATERAL (VALUES
+        ('calories', m.calories::float), ('protein', m.protein::float),
+        ('carbs', m.carbs::float), ('fat', m.fat::float),
+        ('fiber', m.fiber::float), ('sugar', m.sugar::float),
+        ('cholesterol', m.cholesterol::float), ('sodium', m.sodium::float),
+        ('saturatedFat', m.saturated_fat::float), ('transFat', m.trans_fat::float),
+        ('polyunsaturatedFat', m.polyunsaturated_fat::float),
+        ('monounsaturatedFat', m.monounsaturated_fat::float),
+        ('addedSugar', m.added_sugar::float), ('vitaminD', m.vitamin_d::float),
+        ('calcium', m.calcium::float), ('iron', m.iron::float),
+        ('potassium', m.potassium::float), ('vitaminC', m.vitamin_c::float)
+    ) AS f(field, value)
+    GROUP BY m.user_id, f.field, local_day
+    HAVING COUNT(f.value) > 0
+    {_V5_ROLLUP_UPSERT}
+"""
+
+DAILY_ROLLUPS_EVENTS_BACKFILL_SQL = f"""
+    INSERT INTO daily_rollups (user_id, event_type_id, field, local_day,
+                               value_sum, value_count, value_min, value_max, value_last, last_ts)
+    SELECT
+        e.user_id,
+        e.event_type_id,
+        f.field,
+        (to_timestamp(e.timestamp / 1000.0) AT TIME ZONE %(tz)s)::date AS local_day,
+        SUM(f.value),
+        COUNT(f.value),
+        MIN(f.value),
+        MAX(f.value),
+        (ARRAY_AGG(f.value ORDER BY e.timestamp DESC) FILTER (WHERE f.value IS NOT NULL))[1],
+        MAX(e.timestamp) FILTER (WHERE f.value IS NOT NULL)
+    FROM events e
+    CROSS JOIN LATERAL (VALUES
+        ('_stat', COALESCE(CASE
+            WHEN jsonb_typeof(e.data) <> 'object' THEN 0
+            WHEN e.data ? 'value' THEN {_v5_json_number('value')}
+            ELSE {_V5_FIRST_NUMERIC}
+        END, 0)),
+        ('_chart', COALESCE(CASE
+            WHEN jsonb_typeof(e.data) <> 'object' THEN 0
+            WHEN e.data ? 'value' THEN {_v5_json_number('value')}
+            WHEN e.data ? 'count' THEN {_v5_json_number('count')}
+            WHEN e.data ? 'amount' THEN {_v5_json_number('amount')}
+            WHEN e.data ? 'duration' THEN {_v5_json_number('duration')}
+            WHEN e.data ? 'reps' THEN {_v5_json_number('reps')}
+            WHEN e.data ? 'rating' THEN {_v5_json_number('rating')}
+            ELSE {_V5_FIRST_NUMERIC}
+        END, 0)),
+        ('_weighin', CASE
+            WHEN e.event_type_id = 'weight' AND COALESCE(e.data->>'_auto_generated', 'false') <> 'true'
+            THEN {_v5_json_number('weight')}
+        END)
+    ) AS f(field, value)
+    WHERE e.event_type_id <> 'meal'
+    GROUP BY e.user_id, e.event_type_id, f.field, local_day
+    HAVING COUNT(f.value) > 0
+    {_V5_ROLLUP_UPSERT}
+"""
+
+# Version 6: follow-up work queued by write endpoints (see jobs.py).
+JOBS_SQL = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload JSONB NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at BIGINT NOT NULL,
+        started_at BIGINT,
+        finished_at BIGINT
+    );
+
+    -- Recovery scans queued/running jobs oldest first; status reads recent ones
+    CREATE INDEX IF NOT EXISTS idx_jobs_status_created
+        ON jobs(status, created_at);
+"""
+
+# Version 7: the food and search caches on this database, for
+# LIFESTATS_FOOD_CACHE=postgres (see food_cache.py). search_cache has existed
+# since the baseline; food_cache mirrors the Supabase project's table.
+FOOD_CACHE_SQL = """
+    CREATE TABLE IF NOT EXISTS food_cache (
+        food_id TEXT PRIMARY KEY,
+        source TEXT,
+        brand TEXT,
+        food_name TEXT NOT NULL,
+        calories FLOAT,
+        protein FLOAT,
+        carbs FLOAT,
+        fat FLOAT,
+        cholesterol FLOAT,
+        sodium FLOAT,
+        fiber FLOAT,
+        sugar FLOAT,
+        saturated_fat FLOAT,
+        trans_fat FLOAT,
+        polyunsaturated_fat FLOAT,
+        monounsaturated_fat FLOAT,
+        added_sugar FLOAT,
+        vitamin_d FLOAT,
+        calcium FLOAT,
+        iron FLOAT,
+        potassium FLOAT,
+        vitamin_c FLOAT,
+        serving_size FLOAT DEFAULT 1.0,
+        serving_unit TEXT DEFAULT 'serving',
+        food_data JSONB,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Search box substring and typo-tolerant matches (pg_trgm from version 4)
+    CREATE INDEX IF NOT EXISTS idx_food_cache_food_name_trgm
+        ON food_cache USING GIN (LOWER(food_name) gin_trgm_ops);
+    -- A user's custom foods, listed by name
+    CREATE INDEX IF NOT EXISTS idx_food_cache_source_name
+        ON food_cache(source, food_name);
+"""
+
+# Version 8: read counts for the persistent search cache tier, so rarely read
+# expired rows can be evicted early (see food_cache.evict_search_cache).
+SEARCH_CACHE_EVICTION_SQL = """
+    ALTER TABLE search_cache ADD COLUMN IF NOT EXISTS hit_count INTEGER NOT NULL DEFAULT 0;
+
+    CREATE INDEX IF NOT EXISTS idx_search_cache_created
+        ON search_cache(created_at);
+"""
+
+# Version 9: /api/meals pages on (timestamp, id); with id in the index, the
+# keyset comparison and ORDER BY ... id DESC are served without a sort. The
+# old (user_id, timestamp) index is a prefix of this one.
+MEAL_KEYSET_INDEX_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_meals_user_timestamp_id
+        ON meals(user_id, timestamp DESC, id DESC);
+    DROP INDEX IF EXISTS idx_meals_user_timestamp;
+"""
+
+# Version 10: a change sequence for /api/sync. Every insert or update on a
+# synced table stamps the row with the next change_seq value, and every delete
+# leaves a tombstone carrying one, so a client can ask for everything after the
+# last value it saw (see db.get_changes).
+# Every change is stamped with the next change_seq and the transaction that
+# made it: /api/sync reads changes in transaction order and only up to the
+# oldest transaction still running, so one that commits late can't be skipped
+# (see db.get_changes).
+SYNC_SQL = """
+    CREATE SEQUENCE IF NOT EXISTS change_seq;
+
+    CREATE TABLE IF NOT EXISTS sync_tombstones (
+        change_seq BIGINT PRIMARY KEY DEFAULT nextval('change_seq'),
+        change_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+        table_name VARCHAR(50) NOT NULL,
+        row_id VARCHAR(50) NOT NULL,
+        user_id VARCHAR(50),
+        deleted_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_sync_tombstones_user_change_xid
+        ON sync_tombstones(user_id, change_xid, change_seq);
+    CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted_at ON sync_tombstones(deleted_at);
+
+    -- The newest sync position whose tombstones have been pruned; /api/sync
+    -- sends clients behind it back to a full resync (see db.prune_sync_tombstones)
+    CREATE TABLE IF NOT EXISTS sync_horizon (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        change_xid xid8 NOT NULL DEFAULT '0',
+        change_seq BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO sync_horizon (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+    -- clock_timestamp(), not the transaction's start, so updated_at is when
+    -- the row was written
+    CREATE OR REPLACE FUNCTION stamp_change() RETURNS trigger AS $$
+    BEGIN
+        NEW.change_seq := nextval('change_seq');
+        NEW.change_xid := pg_current_xact_id();
+        NEW.updated_at := clock_timestamp()::timestamp;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- TG_ARGV[0] names the column that identifies the row to clients
+    CREATE OR REPLACE FUNCTION record_tombstone() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO sync_tombstones (table_name, row_id, user_id, deleted_at)
+        VALUES (TG_TABLE_NAME, to_jsonb(OLD) ->> TG_ARGV[0], OLD.user_id, clock_timestamp()::timestamp);
+        RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# Synced tables and the column /api/sync identifies their rows by
+SYNC_TABLES = [
+    ('meals', 'id'),
+    ('events', 'id'),
+    ('event_types', 'id'),
+    ('goals', 'id'),
+    ('user_categories', 'id'),
+    ('favorite_event_types', 'event_type_id'),
+]
+
+
+def _baseline(cur):
+    """Version 1: everything init_db() used to create on every boot. Idempotent, so
+    it is safe to apply to a database that predates schema_version."""
+    cur.execute(BASELINE_TABLES_SQL)
+    cur.execute(BASELINE_COLUMNS_SQL)
+    cur.execute(BASELINE_INDEXES_SQL)
+
+
+def _seed_system_event_types(cur):
+    """Version 2: system event types, and removal of the deprecated ones."""
+    db.write_system_event_types(cur)
+
+
+def _daily_rollups(cur):
+    """Version 5: create daily_rollups and backfill it from every existing row."""
+    cur.execute(DAILY_ROLLUPS_SQL)
+    cur.execute("DELETE FROM daily_rollups")
+    cur.execute(DAILY_ROLLUPS_MEALS_BACKFILL_SQL, {'tz': db.ROLLUP_TZ})
+    cur.execute(DAILY_ROLLUPS_EVENTS_BACKFILL_SQL, {'tz': db.ROLLUP_TZ})
+
+
+def _change_sequence(cur):
+    """
+    Version 10: stamp every existing row of the synced tables with a change_seq
+    (and change_xid 0, which orders them before every later change), then keep
+    both current with triggers.
+    """
+    cur.execute(SYNC_SQL)
+    for table, id_column in SYNC_TABLES:
+        cur.execute(f"""
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS change_seq BIGINT;
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+            UPDATE {table} SET change_seq = nextval('change_seq') WHERE change_seq IS NULL;
+            ALTER TABLE {table} ALTER COLUMN change_seq SET DEFAULT nextval('change_seq');
+            ALTER TABLE {table} ALTER COLUMN change_seq SET NOT NULL;
+            ALTER TABLE {table} ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT '0';
+            ALTER TABLE {table} ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id();
+
+            CREATE INDEX IF NOT EXISTS idx_{table}_user_change_xid ON {table}(user_id, change_xid, change_seq);
+
+            DROP TRIGGER IF EXISTS {table}_stamp_change ON {table};
+            CREATE TRIGGER {table}_stamp_change BEFORE INSERT OR UPDATE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION stamp_change();
+            DROP TRIGGER IF EXISTS {table}_tombstone ON {table};
+            CREATE TRIGGER {table}_tombstone AFTER DELETE ON {table}
+                FOR EACH ROW EXECUTE FUNCTION record_tombstone('{id_column}');
+        """)
+
+
+MIGRATIONS = [
+    (1, 'baseline schema', _baseline),
+    (2, 'seed system event types', _seed_system_event_types),
+    (3, 'meal and event window indexes', MEAL_INDEXES_SQL),
+    (4, 'trigram indexes for meal search', MEAL_TRIGRAM_SQL),
+    (5, 'daily rollups', _daily_rollups),
+    (6, 'background jobs', JOBS_SQL),
+    (7, 'food and search cache tables', FOOD_CACHE_SQL),
+    (8, 'search cache read counts', SEARCH_CACHE_EVICTION_SQL),
+    (9, 'meal keyset pagination index', MEAL_KEYSET_INDEX_SQL),
+    (10, 'change sequence and tombstones for sync', _change_sequence),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(cur):
+    """Highest applied version, or 0 for a database that has never been migrated."""
+    cur.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present")
+    if not cur.fetchone()['present']:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+    return cur.fetchone()['version']
+
+
+def migrate(verbose=True):
+    """
+    Apply every pending migration. Returns the list of versions applied, which is
+    empty (after one version check) when the database is already current.
+    """
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        if current_version(cur) >= LATEST_VERSION:
+            conn.rollback()
+            return []
+
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cur.execute(SCHEMA_VERSION_SQL)
+            conn.commit()
+
+            # Re-read under the lock: another instance may have finished while we waited.
+            version = current_version(cur)
+            applied = []
+            for number, name, step in MIGRATIONS:
+                if number <= version:
+                    continue
+                if verbose:
+                    print(f"Applying migration {number}: {name}")
+                if callable(step):
+                    step(cur)
+                else:
+                    cur.execute(step)
+                cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (number, name))
+                conn.commit()
+                applied.append(number)
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            conn.commit()
+
+
+def print_status():
+    with db.db_connection() as conn:
+        cur = conn.cursor()
+        version = current_version(cur)
+        applied_at = {}
+        if version:
+            cur.execute("SELECT version, applied_at FROM schema_version")
+            applied_at = {row['version']: row['applied_at'] for row in cur.fetchall()}
+
+    for number, name, _ in MIGRATIONS:
+        when = applied_at.get(number)
+        state = f"applied {when.isoformat()}" if when else "pending"
+        print(f"{number:>4}  {name:<40} {state}")
+
+
+if __name__ == '__main__':
+    if not db.DATABASE_URL:
+        print("POSTGRES_URL is not set")
+        sys.exit(1)
+
+    if '--status' in sys.argv[1:]:
+        print_status()
+    else:
+        applied = migrate()
+        if applied:
+            print(f"Applied {len(applied)} migration(s); schema is at version {applied[-1]}")
+        else:
+            print(f"Schema is current (version {LATEST_VERSION})")
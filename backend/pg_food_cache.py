@@ -0,0 +1,362 @@
+"""
+Food and search caches on the app's own Postgres database.
+
+Same functions and return shapes as supabase_client, but each call is plain SQL
+on the pooled connection (food_cache and search_cache, migration 7) instead of
+an HTTPS request to the Supabase REST API. food_cache.py picks which one runs.
+"""
+
+import uuid
+
+from psycopg2.extras import Json
+
+from db import db_connection
+
+# food_cache columns filled from a normalized food dict, in insert order.
+FOOD_COLUMNS = [
+    ('calories', 'calories'),
+    ('protein', 'protein'),
+    ('carbs', 'carbs'),
+    ('fat', 'fat'),
+    ('cholesterol', 'cholesterol'),
+    ('sodium', 'sodium'),
+    ('fiber', 'fiber'),
+    ('sugar', 'sugar'),
+    ('saturated_fat', 'saturatedFat'),
+    ('trans_fat', 'transFat'),
+    ('polyunsaturated_fat', 'polyunsaturatedFat'),
+    ('monounsaturated_fat', 'monounsaturatedFat'),
+    ('added_sugar', 'addedSugar'),
+    ('vitamin_d', 'vitaminD'),
+    ('calcium', 'calcium'),
+    ('iron', 'iron'),
+    ('potassium', 'potassium'),
+    ('vitamin_c', 'vitaminC'),
+]
+
+# Substring matches first, then typo-tolerant matches, each ranked by how closely
+# the query matches a word run in the name; shorter names win ties. The same
+# ordering as search_food_cache in food_cache_search.sql.
+SEARCH_SQL = """
+    SELECT food_id, food_name, brand, source, serving_size, serving_unit,
+           calories, protein, carbs, fat
+    FROM food_cache
+    WHERE LOWER(food_name) LIKE %(pattern)s
+       OR %(query)s <%% LOWER(food_name)
+    ORDER BY (LOWER(food_name) LIKE %(pattern)s) DESC,
+             word_similarity(%(query)s, LOWER(food_name)) DESC,
+             LENGTH(food_name)
+    LIMIT %(limit)s
+"""
+
+
+def _like_pattern(query):
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def _row_values(food_data, name_key, name_default, macro_default):
+    """food_cache nutrient and serving values for a normalized or custom food dict."""
+    values = {column: food_data.get(key) for column, key in FOOD_COLUMNS}
+    for column in ('calories', 'protein', 'carbs', 'fat'):
+        values[column] = food_data.get(column, macro_default)
+    values['food_name'] = food_data.get(name_key, name_default)
+    values['serving_size'] = food_data.get('servingSize', 1.0)
+    values['serving_unit'] = food_data.get('servingUnit', 'serving')
+    return values
+
+
+def _summary(food_id, values, source):
+    """The simplified object the front end expects after a custom food write."""
+    return {
+        'fdcId': food_id,
+        'description': values['food_name'],
+        'brandName': values['brand'],
+        'servingSize': values['serving_size'],
+        'servingUnit': values['serving_unit'],
+        'preCalculated': True,
+        'source': source,
+        'calories': values['calories'],
+        'protein': values['protein'],
+        'carbs': values['carbs'],
+        'fat': values['fat']
+    }
+
+
+def get_cached_search(query: str):
+    """
+    Cached search results and when they were cached (epoch seconds), counting the
+    read for evict_search_cache. (None, None) if the query isn't cached.
+    """
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE search_cache SET hit_count = hit_count + 1
+                WHERE query = %s
+                RETURNING results, EXTRACT(EPOCH FROM created_at) AS cached_at
+            """, (query,))
+            row = cur.fetchone()
+            conn.commit()
+        if row:
+            return row['results'], float(row['cached_at']) if row['cached_at'] is not None else None
+    except Exception as e:
+        print(f"Error fetching from search cache: {e}")
+    return None, None
+
+
+def get_cached_results(query: str):
+    """Retrieve cached search results."""
+    return get_cached_search(query)[0]
+
+
+def cache_results(query: str, results: dict):
+    """Save search results, overwriting any earlier results for the query."""
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO search_cache (query, results) VALUES (%s, %s)
+                ON CONFLICT (query) DO UPDATE
+                SET results = EXCLUDED.results, created_at = CURRENT_TIMESTAMP
+            """, (query, Json(results)))
+            conn.commit()
+    except Exception as e:
+        print(f"Error saving to search cache: {e}")
+
+
+def _row_to_food(row):
+    """Map a food_cache row back to the camelCase food dict."""
+    food_data = row['food_data'] or {}
+    food = {
+        'fdcId': row['food_id'],
+        'description': row['food_name'],
+        'brandName': row['brand'],
+        'source': row['source'],
+        'servingSize': row['serving_size'],
+        'servingUnit': row['serving_unit'],
+        'preCalculated': True
+    }
+    food.update({key: row[column] for column, key in FOOD_COLUMNS})
+    food['ingredients'] = food_data.get('ingredients')
+    food['isMeal'] = bool(food_data.get('isMeal'))
+    return food
+
+
+def evict_search_cache(max_age_s, expired_age_s, min_hits):
+    """
+    Delete search rows cached more than max_age_s ago, or more than expired_age_s
+    ago and read fewer than min_hits times. Returns how many were deleted.
+    """
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM search_cache
+            WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %(max_age)s)
+               OR (created_at < CURRENT_TIMESTAMP - make_interval(secs => %(expired_age)s)
+                   AND hit_count < %(min_hits)s)
+        """, {'max_age': max_age_s, 'expired_age': expired_age_s, 'min_hits': min_hits})
+        evicted = cur.rowcount
+        conn.commit()
+    return evicted
+
+
+def get_cached_food(food_id: str):
+    """Retrieve detailed food data by food_id."""
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM food_cache WHERE food_id = %s", (food_id,))
+            row = cur.fetchone()
+        if row:
+            return _row_to_food(row)
+    except Exception as e:
+        print(f"Error fetching cached food: {e}")
+    return None
+
+
+def get_cached_foods(food_ids: list):
+    """
+    Retrieve detailed food data for many food_ids in one query.
+    Returns {food_id: food} for the ids that are cached.
+    """
+    ids = list(dict.fromkeys(str(food_id) for food_id in food_ids if food_id))
+    if not ids:
+        return {}
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM food_cache WHERE food_id = ANY(%s)", (ids,))
+            rows = cur.fetchall()
+        return {row['food_id']: _row_to_food(row) for row in rows}
+    except Exception as e:
+        print(f"Error fetching cached foods: {e}")
+    return {}
+
+
+def _upsert_food(cur, food_id, source, brand, values, food_data, overwrite=True):
+    columns = ['food_id', 'source', 'brand', 'food_name', 'serving_size', 'serving_unit', 'food_data']
+    columns += [column for column, _ in FOOD_COLUMNS]
+    params = dict(values, food_id=food_id, source=source, brand=brand, food_data=Json(food_data))
+    conflict = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in columns[1:]) if overwrite else "DO NOTHING"
+    cur.execute(f"""
+        INSERT INTO food_cache ({', '.join(columns)})
+        VALUES ({', '.join(f'%({c})s' for c in columns)})
+        ON CONFLICT (food_id) {conflict}
+    """, params)
+
+
+def cache_food(food_id: str, food_data: dict, brand: str = None, source: str = None):
+    """Save detailed food data."""
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            values = _row_values(food_data, 'description', '', None)
+            _upsert_food(cur, food_id, source, brand or food_data.get('brandName'), values, food_data)
+            conn.commit()
+    except Exception as e:
+        print(f"Error saving food to cache: {e}")
+
+
+def cache_foods(foods: dict, source: str = None):
+    """Save detailed food data for several foods ({food_id: food_data}) in one transaction."""
+    if not foods:
+        return
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            for food_id, food_data in foods.items():
+                values = _row_values(food_data, 'description', '', None)
+                _upsert_food(cur, food_id, source, food_data.get('brandName'), values, food_data)
+            conn.commit()
+    except Exception as e:
+        print(f"Error saving foods to cache: {e}")
+
+
+def add_custom_food(food_data: dict):
+    """
+    Save a user-defined custom food to the food_cache table.
+    Generates a unique ID and maps fields to the DB schema.
+    """
+    custom_id = f"custom_{uuid.uuid4().hex[:12]}"
+    user_id = food_data.get('userId')
+    source = f"custom_{user_id}" if user_id else 'custom_user'
+
+    try:
+        values = _row_values(food_data, 'foodName', 'Custom Food', 0)
+        values['brand'] = food_data.get('brandName')
+        with db_connection() as conn:
+            cur = conn.cursor()
+            _upsert_food(cur, custom_id, source, values['brand'], values, food_data, overwrite=False)
+            conn.commit()
+        return _summary(custom_id, values, source)
+    except Exception as e:
+        print(f"Error adding custom food: {e}")
+        raise e
+
+
+def list_custom_foods(user_id: str):
+    """
+    List all custom foods/meals created by a given user.
+    """
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM food_cache WHERE source = %s ORDER BY food_name", (f"custom_{user_id}",))
+            rows = cur.fetchall()
+
+        results = []
+        for row in rows:
+            food_data = row['food_data'] or {}
+            food = {
+                'fdcId': row['food_id'],
+                'description': row['food_name'],
+                'brandName': row['brand'],
+                'servingSize': row['serving_size'],
+                'servingUnit': row['serving_unit']
+            }
+            food.update({key: row[column] for column, key in FOOD_COLUMNS})
+            food['isMeal'] = bool(food_data.get('isMeal'))
+            food['ingredients'] = food_data.get('ingredients', [])
+            results.append(food)
+        return results
+    except Exception as e:
+        print(f"Error listing custom foods: {e}")
+        return []
+
+
+def update_custom_food(food_id: str, user_id: str, food_data: dict):
+    """
+    Update a user-owned custom food/meal. Only allows updating rows the user owns.
+    """
+    source = f"custom_{user_id}"
+
+    try:
+        values = _row_values(food_data, 'foodName', 'Custom Food', 0)
+        values['brand'] = food_data.get('brandName')
+        columns = ['brand', 'food_name', 'serving_size', 'serving_unit'] + [column for column, _ in FOOD_COLUMNS]
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                UPDATE food_cache
+                SET {', '.join(f'{c} = %({c})s' for c in columns)}, food_data = %(food_data)s
+                WHERE food_id = %(food_id)s AND source = %(source)s
+            """, dict(values, food_data=Json(food_data), food_id=food_id, source=source))
+            updated = cur.rowcount > 0
+            conn.commit()
+
+        if not updated:
+            return None
+        return _summary(food_id, values, source)
+    except Exception as e:
+        print(f"Error updating custom food: {e}")
+        raise e
+
+
+def delete_custom_food(food_id: str, user_id: str):
+    """
+    Delete a user-owned custom food/meal. Only allows deleting rows the user owns.
+    """
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM food_cache WHERE food_id = %s AND source = %s", (food_id, f"custom_{user_id}"))
+            deleted = cur.rowcount > 0
+            conn.commit()
+        return deleted
+    except Exception as e:
+        print(f"Error deleting custom food: {e}")
+        raise e
+
+
+def search_food_in_db(query: str, limit: int = 5):
+    """
+    Search the food_cache table for foods matching the query.
+    Used to surface custom foods and previously cached items.
+
+    Substring matches come first, then typo-tolerant trigram matches, all served
+    by idx_food_cache_food_name_trgm.
+    """
+    normalized = query.lower()
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(SEARCH_SQL, {'query': normalized, 'pattern': _like_pattern(normalized), 'limit': limit})
+            rows = cur.fetchall()
+
+        return [{
+            'fdcId': row['food_id'],
+            'description': row['food_name'],
+            'brandName': row['brand'],
+            'source': row['source'],
+            'servingSize': row['serving_size'],
+            'servingUnit': row['serving_unit'],
+            'preCalculated': True,
+            'calories': row['calories'],
+            'protein': row['protein'],
+            'carbs': row['carbs'],
+            'fat': row['fat']
+        } for row in rows]
+    except Exception as e:
+        print(f"Error searching food in DB: {e}")
+        return []
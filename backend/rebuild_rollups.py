@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Recompute daily_rollups from the meals and events tables.
+
+Writes through the app keep rollups current on their own; run this after
+changing LIFESTATS_ROLLUP_TZ or LIFESTATS_WEIGHT_FILL_MODE, after editing rows
+by hand, or if a chart ever disagrees with the raw data. Stored auto-generated
+weigh-ins are purged or recreated first to match the weight fill mode.
+
+Usage:
+    python rebuild_rollups.py <userId>    # one user
+    python rebuild_rollups.py --all       # everyone
+"""
+
+import sys
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import db
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(1)
+
+    if not db.DATABASE_URL:
+        print("POSTGRES_URL is not set")
+        sys.exit(1)
+
+    user_id = None if args[0] == '--all' else args[0]
+    target = 'all users' if user_id is None else user_id
+
+    started = time.time()
+    print(f"Syncing {db.WEIGHT_FILL_MODE} weigh-ins for {target}...")
+    print(f"✓ {db.sync_weight_fill_mode(user_id).capitalize()}")
+
+    print(f"Rebuilding daily rollups for {target} (buckets in {db.ROLLUP_TZ})...")
+    written = db.rebuild_rollups(user_id)
+    print(f"✓ Wrote {written} rollup rows in {time.time() - started:.1f}s")
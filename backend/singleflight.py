@@ -0,0 +1,57 @@
+"""
+Duplicate call suppression.
+
+While a call for some key is in flight, further calls for the same key wait for
+it and get its result (or its exception) instead of repeating the work, e.g.
+several tabs typing the same search each missing the cache at once.
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """A namespace of in-flight calls, keyed by any hashable."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the run already in flight and share its outcome."""
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """Calls made, how many shared another's run, and how many are in flight now."""
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
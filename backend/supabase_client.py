@@ -1,5 +1,7 @@
 import os
 import json
+import time
+from datetime import datetime, timezone
 from supabase import create_client, Client
 
 # Initialize Supabase Client
@@ -14,21 +16,35 @@ if url and key:
     except Exception as e:
         print(f"Failed to initialize Supabase client: {e}")
 
-def get_cached_results(query: str):
+def get_cached_search(query: str):
     """
-    Retrieve cached search results from Supabase.
+    Retrieve cached search results from Supabase, and when they were cached
+    (epoch seconds, or None if unknown). (None, None) if the query isn't cached.
     """
     if not supabase:
-        return None
+        return None, None
 
     try:
-        response = supabase.table("search_cache").select("results").eq("query", query).execute()
+        response = supabase.table("search_cache").select("results, created_at").eq("query", query).execute()
         if response.data and len(response.data) > 0:
-            return response.data[0]["results"]
+            row = response.data[0]
+            cached_at = None
+            if row.get("created_at"):
+                try:
+                    cached_at = datetime.fromisoformat(row["created_at"].replace("Z", "+00:00")).timestamp()
+                except ValueError:
+                    pass
+            return row["results"], cached_at
     except Exception as e:
         print(f"Error fetching from Supabase cache: {e}")
     
-    return None
+    return None, None
+
+def get_cached_results(query: str):
+    """
+    Retrieve cached search results from Supabase.
+    """
+    return get_cached_search(query)[0]
 
 def cache_results(query: str, results: dict):
     """
@@ -41,13 +57,58 @@ def cache_results(query: str, results: dict):
         data = {
             "query": query,
             "results": results,
-            # created_at is automatic if default is set, otherwise we might need it
+            # Set explicitly so an upsert restarts the entry's age
+            "created_at": datetime.now(timezone.utc).isoformat(),
         }
         # Upsert allows overwriting if query already exists
         supabase.table("search_cache").upsert(data).execute()
     except Exception as e:
         print(f"Error saving to Supabase cache: {e}")
 
+def _row_to_food(row: dict):
+    """Map a food_cache row's snake_case columns back to the camelCase food dict."""
+    food_data = row.get('food_data') or {}
+    return {
+        'fdcId': row['food_id'],
+        'description': row['food_name'],
+        'brandName': row['brand'],
+        'source': row.get('source'),
+        'servingSize': row['serving_size'],
+        'servingUnit': row['serving_unit'],
+        'preCalculated': True,
+        'calories': row['calories'],
+        'protein': row['protein'],
+        'carbs': row['carbs'],
+        'fat': row['fat'],
+        'cholesterol': row['cholesterol'],
+        'sodium': row['sodium'],
+        'fiber': row['fiber'],
+        'sugar': row['sugar'],
+        'saturatedFat': row['saturated_fat'],
+        'transFat': row['trans_fat'],
+        'polyunsaturatedFat': row['polyunsaturated_fat'],
+        'monounsaturatedFat': row['monounsaturated_fat'],
+        'addedSugar': row['added_sugar'],
+        'vitaminD': row['vitamin_d'],
+        'calcium': row['calcium'],
+        'iron': row['iron'],
+        'potassium': row['potassium'],
+        'vitaminC': row['vitamin_c'],
+        'ingredients': food_data.get('ingredients'),
+        'isMeal': bool(food_data.get('isMeal'))
+    }
+
+def evict_search_cache(max_age_s, expired_age_s, min_hits):
+    """
+    Delete search rows cached more than max_age_s ago. Supabase's search_cache
+    keeps no read counts, so expired_age_s and min_hits don't apply here.
+    """
+    if not supabase:
+        return 0
+    cutoff = datetime.fromtimestamp(time.time() - max_age_s, timezone.utc).isoformat()
+    response = supabase.table("search_cache").delete().lt("created_at", cutoff).execute()
+    return len(response.data or [])
+
 def get_cached_food(food_id: str):
     """Retrieve detailed food data from Supabase cache by food_id."""
     if not supabase:
@@ -55,79 +116,77 @@ def get_cached_food(food_id: str):
     try:
         response = supabase.table("food_cache").select("*").eq("food_id", food_id).execute()
         if response.data and len(response.data) > 0:
-            row = response.data[0]
-            # Map snake_case columns back to camelCase dictionary
-            return {
-                'fdcId': row['food_id'],
-                'description': row['food_name'],
-                'brandName': row['brand'],
-                'source': row.get('source'),
-                'servingSize': row['serving_size'],
-                'servingUnit': row['serving_unit'],
-                'preCalculated': True,
-                'calories': row['calories'],
-                'protein': row['protein'],
-                'carbs': row['carbs'],
-                'fat': row['fat'],
-                'cholesterol': row['cholesterol'],
-                'sodium': row['sodium'],
-                'fiber': row['fiber'],
-                'sugar': row['sugar'],
-                'saturatedFat': row['saturated_fat'],
-                'transFat': row['trans_fat'],
-                'polyunsaturatedFat': row['polyunsaturated_fat'],
-                'monounsaturatedFat': row['monounsaturated_fat'],
-                'addedSugar': row['added_sugar'],
-                'vitaminD': row['vitamin_d'],
-                'calcium': row['calcium'],
-                'iron': row['iron'],
-                'potassium': row['potassium'],
-                'vitaminC': row['vitamin_c'],
-                'ingredients': (row.get('food_data') or {}).get('ingredients'),
-                'isMeal': bool((row.get('food_data') or {}).get('isMeal'))
-            }
+            return _row_to_food(response.data[0])
     except Exception as e:
         print(f"Error fetching cached food from Supabase: {e}")
     return None
 
+def get_cached_foods(food_ids: list):
+    """
+    Retrieve detailed food data for many food_ids in one request.
+    Returns {food_id: food} for the ids that are cached.
+    """
+    ids = list(dict.fromkeys(str(food_id) for food_id in food_ids if food_id))
+    if not supabase or not ids:
+        return {}
+    try:
+        response = supabase.table("food_cache").select("*").in_("food_id", ids).execute()
+        return {row['food_id']: _row_to_food(row) for row in response.data or []}
+    except Exception as e:
+        print(f"Error fetching cached foods from Supabase: {e}")
+    return {}
+
+def _food_row(food_id: str, food_data: dict, brand: str = None, source: str = None):
+    """A food_cache row for detailed food data."""
+    return {
+        'food_id': food_id,
+        'source': source,
+        'brand': brand or food_data.get('brandName'),
+        'food_name': food_data.get('description', ''),
+        'calories': food_data.get('calories'),
+        'protein': food_data.get('protein'),
+        'carbs': food_data.get('carbs'),
+        'fat': food_data.get('fat'),
+        'cholesterol': food_data.get('cholesterol'),
+        'sodium': food_data.get('sodium'),
+        'fiber': food_data.get('fiber'),
+        'sugar': food_data.get('sugar'),
+        'saturated_fat': food_data.get('saturatedFat'),
+        'trans_fat': food_data.get('transFat'),
+        'polyunsaturated_fat': food_data.get('polyunsaturatedFat'),
+        'monounsaturated_fat': food_data.get('monounsaturatedFat'),
+        'added_sugar': food_data.get('addedSugar'),
+        'vitamin_d': food_data.get('vitaminD'),
+        'calcium': food_data.get('calcium'),
+        'iron': food_data.get('iron'),
+        'potassium': food_data.get('potassium'),
+        'vitamin_c': food_data.get('vitaminC'),
+        'serving_size': food_data.get('servingSize', 1.0),
+        'serving_unit': food_data.get('servingUnit', 'serving'),
+        # Retain raw JSON structure for compatibility/backup
+        'food_data': food_data
+    }
+
 def cache_food(food_id: str, food_data: dict, brand: str = None, source: str = None):
     """Save detailed food data to Supabase cache."""
     if not supabase:
         return
     try:
-        data = {
-            'food_id': food_id,
-            'source': source,
-            'brand': brand or food_data.get('brandName'),
-            'food_name': food_data.get('description', ''),
-            'calories': food_data.get('calories'),
-            'protein': food_data.get('protein'),
-            'carbs': food_data.get('carbs'),
-            'fat': food_data.get('fat'),
-            'cholesterol': food_data.get('cholesterol'),
-            'sodium': food_data.get('sodium'),
-            'fiber': food_data.get('fiber'),
-            'sugar': food_data.get('sugar'),
-            'saturated_fat': food_data.get('saturatedFat'),
-            'trans_fat': food_data.get('transFat'),
-            'polyunsaturated_fat': food_data.get('polyunsaturatedFat'),
-            'monounsaturated_fat': food_data.get('monounsaturatedFat'),
-            'added_sugar': food_data.get('addedSugar'),
-            'vitamin_d': food_data.get('vitaminD'),
-            'calcium': food_data.get('calcium'),
-            'iron': food_data.get('iron'),
-            'potassium': food_data.get('potassium'),
-            'vitamin_c': food_data.get('vitaminC'),
-            'serving_size': food_data.get('servingSize', 1.0),
-            'serving_unit': food_data.get('servingUnit', 'serving'),
-            # Retain raw JSON structure for compatibility/backup
-            'food_data': food_data
-        }
-        supabase.table("food_cache").upsert(data).execute()
+        supabase.table("food_cache").upsert(_food_row(food_id, food_data, brand, source)).execute()
 
     except Exception as e:
         print(f"Error saving food to Supabase cache: {e}")
 
+def cache_foods(foods: dict, source: str = None):
+    """Save detailed food data for several foods ({food_id: food_data}) in one request."""
+    if not supabase or not foods:
+        return
+    try:
+        rows = [_food_row(food_id, food_data, source=source) for food_id, food_data in foods.items()]
+        supabase.table("food_cache").upsert(rows).execute()
+    except Exception as e:
+        print(f"Error saving foods to Supabase cache: {e}")
+
 def add_custom_food(food_data: dict):
     """
     Save a user-defined custom food to the food_cache table.
@@ -327,21 +386,51 @@ def delete_custom_food(food_id: str, user_id: str):
         print(f"Error deleting custom food: {e}")
         raise e
 
+# Flipped off the first time the search_food_cache RPC is missing, so a database
+# without food_cache_search.sql applied costs one failed call, not one per keystroke.
+_trigram_search_available = True
+
+# PostgREST's "function not found" (and Postgres's undefined_function): the only
+# RPC errors that mean search_food_cache isn't installed
+MISSING_RPC_CODES = ('PGRST202', '42883')
+
+def _like_pattern(query):
+    """An ILIKE pattern matching query as a literal substring."""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
 def search_food_in_db(query: str, limit: int = 5):
     """
     Search the food_cache table for foods matching the query.
     Used to surface custom foods and previously cached items.
+
+    Uses the trigram-indexed search_food_cache RPC (see food_cache_search.sql),
+    which also tolerates typos; falls back to an ILIKE scan when it's not installed.
     """
+    global _trigram_search_available
     if not supabase:
         return []
         
     try:
-        # ILIKE query for case-insensitive matching on food_name
-        response = supabase.table("food_cache") \
-            .select("*") \
-            .ilike("food_name", f"%{query}%") \
-            .limit(limit) \
-            .execute()
+        response = None
+        if _trigram_search_available:
+            try:
+                response = supabase.rpc("search_food_cache", {"query": query, "max_results": limit}).execute()
+            except Exception as e:
+                # Anything else (timeouts, 5xx) falls back for this call only
+                if getattr(e, 'code', None) in MISSING_RPC_CODES:
+                    print(f"Trigram food search not installed, falling back to ILIKE: {e}")
+                    _trigram_search_available = False
+                else:
+                    print(f"Trigram food search failed, using ILIKE for this search: {e}")
+
+        if response is None:
+            # ILIKE query for case-insensitive matching on food_name
+            response = supabase.table("food_cache") \
+                .select("*") \
+                .ilike("food_name", _like_pattern(query)) \
+                .limit(limit) \
+                .execute()
             
         results = []
         if response.data:
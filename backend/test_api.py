@@ -191,6 +191,132 @@ def test_stats():
     pushups_stats = response.json()
     print(f"Pushups Stats: {json.dumps(pushups_stats, indent=2)}")
 
+def test_meals():
+    """Test windowed, keyset-paginated meal listing."""
+    print("\n" + "=" * 60)
+    print("TESTING MEAL ENDPOINTS")
+    print("=" * 60)
+
+    # 1. Log 5 meals an hour apart, yesterday
+    day_start = int(time.time() // 86400 - 1) * 86400 * 1000
+    meal_ids = []
+    print("\n1. POST /api/meals (x5)")
+    for i in range(5):
+        meal = {
+            'id': f'meal-test-{day_start}-{i}',
+            'userId': USER_ID,
+            'foodName': f'Test Meal {i}',
+            'mealType': 'snack',
+            'nutrition': {'calories': 100, 'protein': 5, 'carbs': 10, 'fat': 2},
+            'timestamp': day_start + i * 3600 * 1000
+        }
+        response = requests.post(f"{BASE_URL}/api/meals", json=meal)
+        print(f"Status: {response.status_code}")
+        meal_ids.append(meal['id'])
+
+    # 2. Page through that day two at a time
+    print("\n2. GET /api/meals?start=...&end=...&limit=2 (following nextCursor)")
+    params = {'userId': USER_ID, 'start': day_start, 'end': day_start + 86400 * 1000, 'limit': 2}
+    seen = []
+    while True:
+        response = requests.get(f"{BASE_URL}/api/meals", params=params)
+        page = response.json()
+        print(f"Status: {response.status_code}, {len(page['meals'])} meals, nextCursor: {page['nextCursor']}")
+        seen += [m['id'] for m in page['meals']]
+        if not page['nextCursor']:
+            break
+        params['cursor'] = page['nextCursor']
+    test_seen = [meal_id for meal_id in seen if meal_id in meal_ids]
+    print(f"Test meals newest first, each once: {test_seen == meal_ids[::-1]}")
+
+    # 3. Bad cursor
+    print("\n3. GET /api/meals?cursor=not-a-cursor")
+    response = requests.get(f"{BASE_URL}/api/meals", params={'userId': USER_ID, 'cursor': 'not-a-cursor'})
+    print(f"Status: {response.status_code} (expected 400)")
+
+    # 4. Clean up
+    print("\n4. DELETE /api/meals/<id> (x5)")
+    for meal_id in meal_ids:
+        response = requests.delete(f"{BASE_URL}/api/meals/{meal_id}", params={'userId': USER_ID})
+        print(f"Status: {response.status_code}")
+
+def test_sync():
+    """Test delta sync."""
+    print("\n" + "=" * 60)
+    print("TESTING SYNC ENDPOINT")
+    print("=" * 60)
+
+    # 1. Full sync
+    print("\n1. GET /api/sync?since=0")
+    response = requests.get(f"{BASE_URL}/api/sync", params={'userId': USER_ID, 'since': 0, 'limit': 1000})
+    print(f"Status: {response.status_code}")
+    sync = response.json()
+    print(f"Changed: { {key: len(rows) for key, rows in sync['changes'].items()} }, next: {sync['next']}")
+    since = sync['next']
+
+    # 2. Log a meal and sync again: only it comes back
+    meal_id = f'meal-sync-{int(time.time() * 1000)}'
+    requests.post(f"{BASE_URL}/api/meals", json={
+        'id': meal_id, 'userId': USER_ID, 'foodName': 'Sync Test Meal', 'mealType': 'snack',
+        'nutrition': {'calories': 100, 'protein': 5, 'carbs': 10, 'fat': 2}, 'timestamp': int(time.time() * 1000)
+    })
+    print(f"\n2. GET /api/sync?since={since} after logging {meal_id}")
+    sync = requests.get(f"{BASE_URL}/api/sync", params={'userId': USER_ID, 'since': since}).json()
+    print(f"Changed meals: {[m['id'] for m in sync['changes']['meals']]}, next: {sync['next']}")
+
+    # 3. Delete it: a tombstone comes back
+    requests.delete(f"{BASE_URL}/api/meals/{meal_id}", params={'userId': USER_ID})
+    print(f"\n3. GET /api/sync?since={since} after deleting it")
+    sync = requests.get(f"{BASE_URL}/api/sync", params={'userId': USER_ID, 'since': since}).json()
+    print(f"Deleted meals: {sync['deleted']['meals']}")
+
+def test_batch_writes():
+    """Test batch meal and event logging."""
+    print("\n" + "=" * 60)
+    print("TESTING BATCH WRITE ENDPOINTS")
+    print("=" * 60)
+
+    now = int(time.time() * 1000)
+    meals = [{
+        'id': f'meal-batch-{now}-{i}',
+        'foodName': f'Batch Meal {i}',
+        'mealType': 'snack',
+        'nutrition': {'calories': 100, 'protein': 5},
+        'timestamp': now - i * 86400 * 1000
+    } for i in range(3)]
+
+    # 1. Three valid meals and one with an unknown nutrition field
+    print("\n1. POST /api/meals/batch (3 valid, 1 invalid)")
+    bad = {'id': f'meal-batch-{now}-bad', 'foodName': 'Bad', 'mealType': 'snack',
+           'nutrition': {'kcal': 100}, 'timestamp': now}
+    response = requests.post(f"{BASE_URL}/api/meals/batch", json={'userId': USER_ID, 'meals': meals + [bad]})
+    print(f"Status: {response.status_code} (expected 207)")
+    print(f"Results: {[r['status'] for r in response.json()['results']]}")
+
+    # 2. Replaying the valid ones changes nothing
+    print("\n2. POST /api/meals/batch (same 3 again)")
+    response = requests.post(f"{BASE_URL}/api/meals/batch", json={'userId': USER_ID, 'meals': meals})
+    print(f"Status: {response.status_code}, results: {[r['status'] for r in response.json()['results']]} (expected replayed)")
+
+    # 3. Two weigh-ins a day apart: one refill
+    print("\n3. POST /api/events/batch (2 weigh-ins)")
+    events = [{
+        'id': f'evt-batch-{now}-{i}',
+        'eventTypeId': 'weight',
+        'timestamp': now - (i + 1) * 86400 * 1000,
+        'data': {'weight': 180 - i}
+    } for i in range(2)]
+    response = requests.post(f"{BASE_URL}/api/events/batch", json={'userId': USER_ID, 'events': events})
+    print(f"Status: {response.status_code}")
+    print(f"Results: {[(r['status'], r.get('error')) for r in response.json()['results']]}")
+
+    # 4. Clean up
+    print("\n4. DELETE the batch meals and events")
+    for meal in meals:
+        requests.delete(f"{BASE_URL}/api/meals/{meal['id']}", params={'userId': USER_ID})
+    for event in events:
+        requests.delete(f"{BASE_URL}/api/events/{event['id']}", params={'userId': USER_ID})
+
 def main():
     """Run all tests."""
     try:
@@ -202,6 +328,15 @@ def main():
         
         # Test stats
         test_stats()
+
+        # Test meals
+        test_meals()
+
+        # Test sync
+        test_sync()
+
+        # Test batch writes
+        test_batch_writes()
         
         print("\n" + "=" * 60)
         print("✓ ALL API TESTS COMPLETED!")
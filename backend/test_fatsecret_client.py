@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Test fatsecret_client against a local stub proxy that injects latency and failures.
+
+This script checks:
+1. Keep-alive: repeat calls reuse one pooled connection
+2. Retries: 5xx and dropped connections are retried, then succeed
+3. Deadline: a proxy slower than the deadline fails within it, retries included
+4. Circuit breaker: opens after repeated failures, refuses calls without touching
+   the proxy, and closes again after a successful trial call
+5. Search while open: /api/search-food answers with local results at once
+   (needs Flask installed)
+6. Breaker trial errors: a half-open trial call that fails with any request
+   error reopens the breaker instead of leaving it stuck half-open
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+import fatsecret_client
+
+
+class StubProxy(BaseHTTPRequestHandler):
+    """Answers each request with the next scripted action: 'ok', 'error', 'drop' or 'slow:<s>'."""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    script = []
+    requests_seen = 0
+    connections = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StubProxy.lock:
+            StubProxy.requests_seen += 1
+            StubProxy.connections.add(self.client_address)
+            action = StubProxy.script.pop(0) if StubProxy.script else 'ok'
+
+        if action == 'drop':
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        if action.startswith('slow:'):
+            time.sleep(float(action.split(':')[1]))
+        status = 500 if action == 'error' else 200
+        body = json.dumps({'foods': {'food': []}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def reset_stub(*script):
+    with StubProxy.lock:
+        StubProxy.script = list(script)
+        StubProxy.requests_seen = 0
+        StubProxy.connections = set()
+
+
+def start_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubProxy)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def make_client(base_url, **options):
+    settings = dict(deadline_s=2, attempt_timeout_s=1, retries=2, backoff_s=0.01)
+    settings.update(options)
+    return fatsecret_client.Client(base_url=base_url, **settings)
+
+
+def check_keep_alive(base_url):
+    print("\nTEST 1: Repeat calls reuse a pooled connection")
+    reset_stub()
+    client = make_client(base_url)
+    for _ in range(10):
+        client.search('chicken').json()
+    if StubProxy.requests_seen != 10 or len(StubProxy.connections) != 1:
+        print(f"✗ {StubProxy.requests_seen} requests over {len(StubProxy.connections)} connections")
+        return False
+    print("✓ 10 requests over 1 connection")
+    return True
+
+
+def check_retries(base_url):
+    print("\nTEST 2: Failures retried with backoff")
+    reset_stub('error', 'drop', 'ok')
+    client = make_client(base_url)
+    response = client.search('chicken')
+    stats = client.stats()
+    if response.status_code != 200 or StubProxy.requests_seen != 3 or stats['retries'] != 2:
+        print(f"✗ Status {response.status_code} after {StubProxy.requests_seen} requests: {stats}")
+        return False
+
+    reset_stub('error', 'error', 'error')
+    response = client.search('chicken')
+    if response.status_code != 500 or StubProxy.requests_seen != 3:
+        print(f"✗ Expected the last 500 after 3 attempts, got {response.status_code}")
+        return False
+    print("✓ Succeeded on the 3rd attempt; gave up with the 500 after 3")
+    return True
+
+
+def check_deadline(base_url):
+    print("\nTEST 3: Total deadline across attempts")
+    reset_stub('slow:2', 'slow:2', 'slow:2')
+    client = make_client(base_url, deadline_s=0.6, attempt_timeout_s=0.4)
+    start = time.monotonic()
+    try:
+        client.search('chicken')
+        print("✗ Expected a timeout")
+        return False
+    except requests.Timeout:
+        elapsed = time.monotonic() - start
+    if elapsed > 0.8:
+        print(f"✗ Took {elapsed:.2f}s for a 0.6s deadline")
+        return False
+    print(f"✓ Gave up after {elapsed:.2f}s ({StubProxy.requests_seen} attempts) for a 0.6s deadline")
+    return True
+
+
+def check_circuit_breaker(base_url):
+    print("\nTEST 4: Circuit breaker")
+    reset_stub(*['error'] * 6)
+    breaker = fatsecret_client.CircuitBreaker(failures=3, reset_s=0.3)
+    client = make_client(base_url, retries=1, breaker=breaker)
+    for _ in range(3):
+        client.search('chicken')
+    seen = StubProxy.requests_seen
+
+    start = time.monotonic()
+    try:
+        client.search('chicken')
+        print("✗ Expected CircuitOpen")
+        return False
+    except fatsecret_client.CircuitOpen:
+        refused_ms = (time.monotonic() - start) * 1000
+    if breaker.state != 'open' or StubProxy.requests_seen != seen:
+        print(f"✗ Breaker {breaker.state}, proxy called while open")
+        return False
+
+    time.sleep(0.35)
+    reset_stub('ok')
+    if breaker.state != 'half-open' or client.search('chicken').status_code != 200 or breaker.state != 'closed':
+        print(f"✗ Trial call did not close the breaker ({breaker.state})")
+        return False
+    print(f"✓ Opened after 3 failures, refused in {refused_ms:.2f} ms, closed after a trial call")
+    return True
+
+
+def check_search_while_open():
+    print("\nTEST 5: Search with the breaker open")
+    try:
+        import app as app_module
+        import food_cache
+    except ImportError as e:
+        print(f"- Flask app not importable here ({e}), skipped")
+        return True
+
+    local = [{'fdcId': 'custom_1', 'description': 'Chicken Soup (mine)'}]
+    breaker = fatsecret_client.CircuitBreaker(failures=1, reset_s=60)
+    breaker.record_failure()
+    open_client = fatsecret_client.Client(base_url='http://127.0.0.1:9', breaker=breaker)
+    with mock.patch.object(fatsecret_client, 'client', open_client), \
+            mock.patch.object(food_cache, 'search_food_in_db', return_value=local), \
+            mock.patch.object(food_cache, 'get_search_results', return_value=(None, False)):
+        start = time.monotonic()
+        response = app_module.app.test_client().get('/api/search-food', query_string={'q': 'chicken soup'})
+        elapsed_ms = (time.monotonic() - start) * 1000
+
+    if response.status_code != 200 or response.get_json() != {'foods': local}:
+        print(f"✗ Expected local results, got {response.status_code} {response.get_json()}")
+        return False
+    print(f"✓ Local results in {elapsed_ms:.1f} ms")
+    return True
+
+
+def check_trial_call_errors(base_url):
+    print("\nTEST 6: Half-open trial call failing with other request errors")
+    breaker = fatsecret_client.CircuitBreaker(failures=1, reset_s=0.1)
+    client = make_client(base_url, retries=0, breaker=breaker)
+    broken = requests.exceptions.ChunkedEncodingError('Connection broken')
+    with mock.patch.object(client.session, 'get', side_effect=broken):
+        try:
+            client.search('chicken')
+        except requests.RequestException:
+            pass
+        time.sleep(0.15)
+        try:
+            client.search('chicken')  # the trial call
+        except requests.RequestException:
+            pass
+    if breaker.state != 'open':
+        print(f"✗ Failed trial left the breaker {breaker.state}")
+        return False
+
+    time.sleep(0.15)
+    reset_stub('ok')
+    if client.search('chicken').status_code != 200 or breaker.state != 'closed':
+        print(f"✗ Next trial call did not close the breaker ({breaker.state})")
+        return False
+    print("✓ Failed trial reopened the breaker; the next trial closed it")
+    return True
+
+
+def main():
+    print("=" * 80)
+    print("FATSECRET CLIENT TEST SUITE")
+    print("=" * 80)
+
+    server, base_url = start_stub()
+    try:
+        results = [
+            ("Keep-Alive", check_keep_alive(base_url)),
+            ("Retries", check_retries(base_url)),
+            ("Deadline", check_deadline(base_url)),
+            ("Circuit Breaker", check_circuit_breaker(base_url)),
+            ("Search While Open", check_search_while_open()),
+            ("Trial Call Errors", check_trial_call_errors(base_url)),
+        ]
+    finally:
+        server.shutdown()
+
+    print("\n" + "=" * 80)
+    print("TEST SUMMARY")
+    print("=" * 80)
+    for test_name, passed in results:
+        status = "✓ PASSED" if passed else "✗ FAILED"
+        print(f"{test_name:<20} {status}")
+
+    if all(passed for _, passed in results):
+        print("\n🎉 ALL TESTS PASSED!")
+        return 0
+    print("\n❌ SOME TESTS FAILED")
+    return 1
+
+
+def test_suite():
+    """pytest entry point: every check above against one stub proxy."""
+    assert main() == 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
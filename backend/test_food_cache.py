@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""
+Test food cache lookups per search (no database or Supabase project needed).
+
+This script checks:
+1. Bulk lookup: supabase_client.get_cached_foods fetches 20 foods in one request
+2. Missing ids: ids that aren't cached are left out of the result, blanks skipped
+3. Search cache miss: /api/search-food makes one bulk lookup for all FatSecret
+   results instead of one get_cached_food per result (needs Flask installed)
+4. Memory tier: a repeat search answers from memory without touching the backend
+5. Stale-while-revalidate: expired results are served and refreshed once, in
+   the background
+6. Eviction: the memory tier is bounded, and rows past the stale window are misses
+7. Single flight: a burst of identical calls runs the work once and shares the
+   result, or the exception
+8. Negative caching: empty searches and failed food details don't reach the
+   proxy again until they expire (needs Flask installed)
+9. Search fan-out: /api/search-food runs its lookups at once, keeps the merge
+   order, and answers at the deadline without a slow stage (needs Flask installed)
+10. Batch food details: cached foods come from one bulk lookup, the rest are
+    fetched in parallel with bounded concurrency and cached in one write
+    (needs Flask installed)
+"""
+
+import os
+import sys
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import food_cache
+import singleflight
+import supabase_client
+
+RESULTS_PER_SEARCH = 20
+
+
+def cache_row(food_id):
+    return {
+        'food_id': food_id, 'food_name': f'Food {food_id}', 'brand': 'Brand', 'source': 'fatsecret',
+        'serving_size': 1.0, 'serving_unit': 'serving',
+        'calories': 100, 'protein': 10, 'carbs': 5, 'fat': 2,
+        'cholesterol': None, 'sodium': None, 'fiber': None, 'sugar': None,
+        'saturated_fat': None, 'trans_fat': None, 'polyunsaturated_fat': None,
+        'monounsaturated_fat': None, 'added_sugar': None, 'vitamin_d': None,
+        'calcium': None, 'iron': None, 'potassium': None, 'vitamin_c': None,
+        'food_data': {}
+    }
+
+
+class FakeSupabase:
+    """Just enough of the supabase-py query builder, counting requests sent."""
+
+    def __init__(self, rows):
+        self.rows = {row['food_id']: row for row in rows}
+        self.requests = 0
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+class FakeQuery:
+    def __init__(self, client):
+        self.client = client
+        self.ids = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.ids = [value]
+        return self
+
+    def in_(self, column, values):
+        self.ids = list(values)
+        return self
+
+    def execute(self):
+        self.client.requests += 1
+        return mock.Mock(data=[self.client.rows[i] for i in self.ids if i in self.client.rows])
+
+
+def test_bulk_lookup():
+    print("\nTEST 1: 20 cached foods in one Supabase request")
+    ids = [str(1000 + i) for i in range(RESULTS_PER_SEARCH)]
+    fake = FakeSupabase([cache_row(i) for i in ids])
+    with mock.patch.object(supabase_client, 'supabase', fake):
+        foods = supabase_client.get_cached_foods(ids)
+
+    if fake.requests != 1:
+        print(f"✗ Expected 1 request, got {fake.requests}")
+        return False
+    if sorted(foods) != sorted(ids) or foods[ids[0]] != supabase_client._row_to_food(cache_row(ids[0])):
+        print(f"✗ Wrong foods returned: {sorted(foods)}")
+        return False
+    print(f"✓ 1 request for {len(ids)} foods")
+    return True
+
+
+def test_missing_ids():
+    print("\nTEST 2: Uncached and blank ids")
+    fake = FakeSupabase([cache_row('1'), cache_row('3')])
+    with mock.patch.object(supabase_client, 'supabase', fake):
+        foods = supabase_client.get_cached_foods(['1', '2', '3', None, '', '1'])
+        nothing = supabase_client.get_cached_foods([None, ''])
+
+    if sorted(foods) != ['1', '3']:
+        print(f"✗ Expected foods 1 and 3, got {sorted(foods)}")
+        return False
+    if nothing != {} or fake.requests != 1:
+        print(f"✗ Blank ids should not send a request ({fake.requests} sent)")
+        return False
+    print("✓ Only cached foods returned, no request for blank ids")
+    return True
+
+
+def test_search_calls():
+    print("\nTEST 3: Backend calls per /api/search-food cache miss")
+    try:
+        import app as app_module
+    except ImportError as e:
+        print(f"- Flask app not importable here ({e}), skipped")
+        return True
+
+    fatsecret_foods = [
+        {'food_id': str(2000 + i), 'food_name': f'Chicken {i}',
+         'food_description': 'Per 100g - Calories: 165kcal | Fat: 3.57g | Carbs: 0.00g | Protein: 31.02g'}
+        for i in range(RESULTS_PER_SEARCH)
+    ]
+    # Half the results have cached details
+    cached = {f['food_id']: supabase_client._row_to_food(cache_row(f['food_id'])) for f in fatsecret_foods[::2]}
+    calls = {'search_food_in_db': 0, 'get_search_results': 0, 'get_cached_food': 0, 'get_cached_foods': 0}
+
+    def counted(name, result):
+        def call(*args, **kwargs):
+            calls[name] += 1
+            return result
+        return call
+
+    response = mock.Mock(status_code=200)
+    response.json.return_value = {'foods': {'food': fatsecret_foods}}
+    with mock.patch.object(food_cache, 'search_food_in_db', counted('search_food_in_db', [])), \
+            mock.patch.object(food_cache, 'get_search_results', counted('get_search_results', (None, False))), \
+            mock.patch.object(food_cache, 'remember_results'), \
+            mock.patch.object(food_cache, 'get_cached_food', counted('get_cached_food', None)), \
+            mock.patch.object(food_cache, 'get_cached_foods', counted('get_cached_foods', cached)), \
+            mock.patch.object(app_module.fatsecret_client, 'search', return_value=response), \
+            mock.patch.object(app_module.jobs, 'enqueue'):
+        result = app_module.app.test_client().get('/api/search-food', query_string={'q': 'chicken'})
+
+    foods = result.get_json()['foods']
+    total = sum(calls.values())
+    print(f"  {calls}")
+    if calls['get_cached_food'] or calls['get_cached_foods'] != 1:
+        print("✗ Expected one bulk lookup and no per-result lookups")
+        return False
+    if total != 3:
+        print(f"✗ Expected 3 backend calls per search, got {total}")
+        return False
+    if len(foods) != RESULTS_PER_SEARCH or foods[0] != cached[fatsecret_foods[0]['food_id']]:
+        print("✗ Cached details not used in the results")
+        return False
+    print(f"✓ {total} backend calls for {RESULTS_PER_SEARCH} results")
+    return True
+
+
+class FakeSearchBackend:
+    """The persistent search tier, counting reads and writes."""
+
+    def __init__(self, rows=None):
+        self.rows = dict(rows or {})  # query -> (results, cached_at)
+        self.reads = 0
+        self.writes = 0
+
+    def get_cached_search(self, query):
+        self.reads += 1
+        return self.rows.get(query, (None, None))
+
+    def cache_results(self, query, results):
+        self.writes += 1
+        self.rows[query] = (results, time.time())
+
+
+def fresh_search_tier(backend, **settings):
+    """Patches food_cache onto backend with an empty memory tier and no eviction jobs."""
+    patches = [
+        mock.patch.object(food_cache, '_backend', backend),
+        mock.patch.object(food_cache, '_search_memory', food_cache.OrderedDict()),
+        mock.patch.object(food_cache, '_search_stats', dict.fromkeys(food_cache._search_stats, 0)),
+        mock.patch.object(food_cache, 'SEARCH_EVICT_EVERY_S', float('inf')),
+    ]
+    patches += [mock.patch.object(food_cache, name, value) for name, value in settings.items()]
+    return patches
+
+
+def test_memory_tier():
+    print("\nTEST 4: Repeat searches answer from memory")
+    results = {'foods': [{'fdcId': '1', 'description': 'Chicken Breast'}]}
+    backend = FakeSearchBackend({'chicken': (results, time.time())})
+    patches = fresh_search_tier(backend)
+    for p in patches:
+        p.start()
+    try:
+        first = food_cache.get_search_results('chicken')
+        samples = []
+        for _ in range(1000):
+            start = time.perf_counter()
+            repeat = food_cache.get_search_results('chicken')
+            samples.append(time.perf_counter() - start)
+        stats = food_cache.search_cache_stats()
+    finally:
+        for p in reversed(patches):
+            p.stop()
+
+    median_us = sorted(samples)[len(samples) // 2] * 1e6
+    print(f"  memory hit median {median_us:.1f} µs")
+    if first != (results, False) or repeat != (results, False):
+        print(f"✗ Wrong results: {first}, {repeat}")
+        return False
+    if backend.reads != 1 or stats['persistent_hits'] != 1 or stats['memory_hits'] != 1000:
+        print(f"✗ Expected 1 backend read then memory hits: {backend.reads} reads, {stats}")
+        return False
+    if median_us > 100:
+        print("✗ Memory hits should take microseconds")
+        return False
+    print("✓ 1 backend read, then memory hits")
+    return True
+
+
+def test_stale_while_revalidate():
+    print("\nTEST 5: Stale results served while refreshed in the background")
+    old = {'foods': [{'fdcId': '1', 'description': 'Old'}]}
+    new = {'foods': [{'fdcId': '2', 'description': 'New'}]}
+    backend = FakeSearchBackend({'rice': (old, time.time() - 120)})
+    release = threading.Event()
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        release.wait(5)
+        return new
+
+    patches = fresh_search_tier(backend, SEARCH_TTL_S=60, SEARCH_MAX_STALE_S=3600)
+    for p in patches:
+        p.start()
+    try:
+        served = [food_cache.get_search_results('rice') for _ in range(3)]
+        for _ in range(3):
+            food_cache.refresh_search_results('rice', fetch)
+        release.set()
+        deadline = time.time() + 5
+        while food_cache.search_cache_stats()['refreshing'] and time.time() < deadline:
+            time.sleep(0.01)
+        after = food_cache.get_search_results('rice')
+        stats = food_cache.search_cache_stats()
+    finally:
+        for p in reversed(patches):
+            p.stop()
+
+    if served != [(old, True)] * 3:
+        print(f"✗ Stale results not served as stale: {served}")
+        return False
+    if len(fetches) != 1 or stats['refreshes'] != 1:
+        print(f"✗ Expected one refresh, got {len(fetches)}")
+        return False
+    if after != (new, False) or backend.writes != 1:
+        print(f"✗ Refresh not stored in both tiers: {after}, {backend.writes} writes")
+        return False
+    print(f"✓ Served stale 3 times, refreshed once ({stats['stale']} stale lookups counted)")
+    return True
+
+
+def test_eviction():
+    print("\nTEST 6: Memory tier bounded, expired rows dropped")
+    now = time.time()
+    rows = {f'q{i}': ({'foods': [i]}, now) for i in range(4)}
+    rows['ancient'] = ({'foods': []}, now - 10 * 3600)
+    backend = FakeSearchBackend(rows)
+    patches = fresh_search_tier(backend, SEARCH_MEMORY_ENTRIES=3, SEARCH_TTL_S=60, SEARCH_MAX_STALE_S=3600)
+    for p in patches:
+        p.start()
+    try:
+        for i in range(4):
+            food_cache.get_search_results(f'q{i}')
+        reads = backend.reads
+        food_cache.get_search_results('q3')  # still in memory
+        food_cache.get_search_results('q0')  # evicted, read again
+        ancient = food_cache.get_search_results('ancient')
+        stats = food_cache.search_cache_stats()
+    finally:
+        for p in reversed(patches):
+            p.stop()
+
+    if backend.reads != reads + 2 or stats['memory_evictions'] != 2 or stats['memory_entries'] != 3:
+        print(f"✗ LRU not bounded: {stats}")
+        return False
+    if ancient != (None, False) or stats['misses'] != 1:
+        print(f"✗ Row past the stale window should be a miss: {ancient}")
+        return False
+    print(f"✓ {stats['memory_evictions']} LRU evictions, expired row treated as a miss")
+    return True
+
+
+def test_single_flight():
+    print("\nTEST 7: Identical calls in flight share one run")
+    group = singleflight.Group()
+    release = threading.Event()
+    runs = []
+    results = []
+
+    def slow(value):
+        def fn():
+            runs.append(value)
+            release.wait(5)
+            if value == 'fail':
+                raise RuntimeError('proxy down')
+            return {'foods': [value]}
+        return fn
+
+    def call(key, value):
+        try:
+            results.append((key, group.do(key, slow(value))))
+        except RuntimeError as e:
+            results.append((key, str(e)))
+
+    threads = [threading.Thread(target=call, args=(key, key)) for key in ['chicken'] * 10 + ['fail'] * 5]
+    for t in threads:
+        t.start()
+    while group.stats()['calls'] < len(threads):
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    stats = group.stats()
+
+    if sorted(runs) != ['chicken', 'fail']:
+        print(f"✗ Expected one run per key, got {runs}")
+        return False
+    expected = sorted([('chicken', {'foods': ['chicken']})] * 10 + [('fail', 'proxy down')] * 5, key=str)
+    if sorted(results, key=str) != expected or stats['shared'] != 13 or stats['in_flight'] != 0:
+        print(f"✗ Outcome not shared: {stats}")
+        return False
+    print(f"✓ {len(threads)} calls, 2 runs, {stats['shared']} shared (result and exception)")
+    return True
+
+
+def test_negative_cache():
+    print("\nTEST 8: Empty and failed FatSecret lookups remembered briefly")
+    try:
+        import app as app_module
+    except ImportError as e:
+        print(f"- Flask app not importable here ({e}), skipped")
+        return True
+
+    proxy_calls = []
+
+    def proxy(url, params=None, timeout=None):
+        proxy_calls.append(url.rsplit('/', 1)[-1])
+        if url.endswith('/search'):
+            response = mock.Mock(status_code=200)
+            response.json.return_value = {'foods': {}}
+        else:
+            response = mock.Mock(status_code=503, text='unavailable')
+        return response
+
+    # No retries, so each lookup is one proxy request
+    proxy_client = app_module.fatsecret_client.Client(base_url='http://proxy', retries=0)
+    client = app_module.app.test_client()
+    with mock.patch.object(food_cache, '_negative', {}), \
+            mock.patch.object(app_module.fatsecret_client, 'client', proxy_client), \
+            mock.patch.object(proxy_client.session, 'get', side_effect=proxy), \
+            mock.patch.object(food_cache, 'search_food_in_db', return_value=[]), \
+            mock.patch.object(food_cache, 'get_search_results', return_value=(None, False)), \
+            mock.patch.object(food_cache, 'get_cached_food', return_value=None), \
+            mock.patch.object(food_cache, 'get_cached_foods', return_value={}), \
+            mock.patch.object(app_module.jobs, 'enqueue') as enqueue:
+        searches = [client.get('/api/search-food', query_string={'q': 'xyzzy'}) for _ in range(3)]
+        details = [client.get('/api/get-food-details', query_string={'food_id': '42'}) for _ in range(3)]
+
+        food_cache._negative[('search', 'xyzzy')] = ('empty', time.time() - 1)
+        client.get('/api/search-food', query_string={'q': 'xyzzy'})
+
+    if [r.get_json() for r in searches] != [{'foods': []}] * 3 or [r.status_code for r in details] != [503] * 3:
+        print("✗ Responses changed")
+        return False
+    if proxy_calls != ['search', 'food', 'search']:
+        print(f"✗ Expected one proxy call per lookup until expiry, got {proxy_calls}")
+        return False
+    if enqueue.called:
+        print("✗ Empty results should not be written to the persistent cache")
+        return False
+    print("✓ 1 proxy call per lookup, repeated after expiry")
+    return True
+
+
+def test_search_fan_out():
+    print("\nTEST 9: /api/search-food lookups run concurrently under a deadline")
+    try:
+        import app as app_module
+        import db
+    except ImportError as e:
+        print(f"- Flask app not importable here ({e}), skipped")
+        return True
+
+    delay = 0.2
+    local = [{'fdcId': 'custom_1', 'description': 'Chicken Soup (mine)'}]
+    recent = [{'fdcId': 'recent_1', 'description': 'Chicken Wrap'}]
+    cached = [{'fdcId': '3001', 'description': 'Chicken Breast'},
+              {'fdcId': 'custom_1', 'description': 'Chicken Soup (mine)'},
+              {'fdcId': '3002', 'description': 'chicken wrap'}]
+
+    def slow(result, seconds=delay):
+        def call(*args, **kwargs):
+            time.sleep(seconds)
+            return result
+        return call
+
+    def search(recent_delay):
+        with mock.patch.object(food_cache, 'search_food_in_db', slow(local)), \
+                mock.patch.object(db, 'get_recent_meal_matches', slow(recent, recent_delay)), \
+                mock.patch.object(food_cache, 'get_search_results', slow(({'foods': cached}, False))), \
+                mock.patch.object(app_module, 'SEARCH_DEADLINE_S', 0.5):
+            start = time.monotonic()
+            response = app_module.app.test_client().get(
+                '/api/search-food', query_string={'q': 'chicken', 'userId': 'user-1'})
+            return response.get_json()['foods'], time.monotonic() - start
+
+    foods, elapsed = search(delay)
+    ids = [f['fdcId'] for f in foods]
+    if ids != ['recent_1', 'custom_1', '3001']:
+        print(f"✗ Expected recent, then local, then cached results without duplicates, got {ids}")
+        return False
+    if elapsed > 2 * delay:
+        print(f"✗ Three {delay}s lookups took {elapsed:.2f}s, not run concurrently")
+        return False
+
+    foods, elapsed = search(2)
+    ids = [f['fdcId'] for f in foods]
+    if ids != ['custom_1', '3001', '3002'] or elapsed > 0.8:
+        print(f"✗ Expected the slow recent stage dropped at the deadline, got {ids} after {elapsed:.2f}s")
+        return False
+    print(f"✓ Three {delay}s lookups answered together; a 2s stage dropped at the 0.5s deadline")
+    return True
+
+
+def test_food_details_batch():
+    print("\nTEST 10: /api/food-details/batch")
+    try:
+        import app as app_module
+    except ImportError as e:
+        print(f"- Flask app not importable here ({e}), skipped")
+        return True
+
+    delay = 0.2
+    cached = {food_id: supabase_client._row_to_food(cache_row(food_id)) for food_id in ('4001', '4002')}
+    uncached = [str(4100 + i) for i in range(8)]
+    lock = threading.Lock()
+    running = {'now': 0, 'max': 0}
+    lookups = []
+    writes = []
+
+    def get_cached_foods(ids):
+        lookups.append(list(ids))
+        return {food_id: cached[food_id] for food_id in ids if food_id in cached}
+
+    def fetch(food_id, cache=True):
+        with lock:
+            running['now'] += 1
+            running['max'] = max(running['max'], running['now'])
+        time.sleep(delay)
+        with lock:
+            running['now'] -= 1
+        if cache:
+            raise AssertionError("batch fetches must not cache one at a time")
+        if food_id == uncached[-1]:
+            return None, 404
+        return {'fdcId': food_id, 'description': f'Food {food_id}'}, None
+
+    with mock.patch.object(food_cache, 'get_cached_foods', get_cached_foods), \
+            mock.patch.object(food_cache, 'cache_foods', lambda foods, source=None: writes.append(dict(foods))), \
+            mock.patch.object(app_module, 'fetch_fatsecret_food', fetch):
+        start = time.monotonic()
+        response = app_module.app.test_client().post(
+            '/api/food-details/batch', json={'food_ids': list(cached) + uncached + ['4001']})
+        elapsed = time.monotonic() - start
+
+    body = response.get_json()
+    if response.status_code != 200 or len(lookups) != 1 or len(lookups[0]) != 10:
+        print(f"✗ Expected one bulk lookup of 10 distinct ids, got {lookups}")
+        return False
+    if set(body['foods']) != set(cached) | set(uncached[:-1]) or list(body['errors']) != [uncached[-1]]:
+        print(f"✗ Unexpected foods {sorted(body['foods'])} / errors {body['errors']}")
+        return False
+    if len(writes) != 1 or set(writes[0]) != set(uncached[:-1]):
+        print(f"✗ Expected the 7 fetched foods cached in one write, got {[sorted(w) for w in writes]}")
+        return False
+    limit = app_module._details_pool._max_workers
+    if running['max'] > limit or elapsed > len(uncached) * delay / 2:
+        print(f"✗ {running['max']} fetches at once (limit {limit}), {elapsed:.2f}s for {len(uncached)}")
+        return False
+    print(f"✓ 2 cached, 7 fetched {running['max']} at a time in {elapsed:.2f}s, 1 write, 1 error")
+    return True
+
+
+def main():
+    print("=" * 80)
+    print("FOOD CACHE TEST SUITE")
+    print("=" * 80)
+
+    results = [
+        ("Bulk Lookup", test_bulk_lookup()),
+        ("Missing Ids", test_missing_ids()),
+        ("Search Calls", test_search_calls()),
+        ("Memory Tier", test_memory_tier()),
+        ("Stale Refresh", test_stale_while_revalidate()),
+        ("Eviction", test_eviction()),
+        ("Single Flight", test_single_flight()),
+        ("Negative Cache", test_negative_cache()),
+        ("Search Fan-Out", test_search_fan_out()),
+        ("Details Batch", test_food_details_batch()),
+    ]
+
+    print("\n" + "=" * 80)
+    print("TEST SUMMARY")
+    print("=" * 80)
+    for test_name, passed in results:
+        status = "✓ PASSED" if passed else "✗ FAILED"
+        print(f"{test_name:<20} {status}")
+
+    if all(passed for _, passed in results):
+        print("\n🎉 ALL TESTS PASSED!")
+        return 0
+    print("\n❌ SOME TESTS FAILED")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Test that migration 5's frozen rollup backfill agrees with db.write_rollups.
+
+migrate.py keeps its own copy of the rollup SQL so the migration never changes
+after shipping. This runs both on the same fixture meals and events and checks
+they produce the same daily_rollups rows, so the copies can't drift unnoticed.
+
+Everything happens in one transaction that is rolled back, writing into a
+temporary daily_rollups that shadows the real one.
+"""
+
+import sys
+import os
+import unittest
+import uuid
+import json
+from datetime import datetime, timezone
+
+# Add backend to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import db
+import migrate
+
+# Test user ID
+TEST_USER_ID = "test_rollup_backfill_user"
+
+ROLLUP_COLUMNS = "event_type_id, field, local_day, value_sum, value_count, value_min, value_max, value_last, last_ts"
+
+
+def noon_ms(date_str, hour=12):
+    day = datetime.strptime(date_str, '%Y-%m-%d').replace(hour=hour, tzinfo=timezone.utc)
+    return int(day.timestamp() * 1000)
+
+
+def insert_fixture(cur):
+    """Meals and events covering the value rules both copies implement."""
+    meals = [
+        ('2026-01-05', 12, {'calories': 500, 'protein': 30, 'sodium': 900}),
+        ('2026-01-05', 19, {'calories': 700, 'fat': 25.5}),
+        ('2026-01-06', 3, {'calories': 300, 'vitamin_c': 12}),
+    ]
+    for date_str, hour, nutrition in meals:
+        columns = ['id', 'user_id', 'food_name', 'meal_type', 'timestamp'] + list(nutrition)
+        values = [f"meal-{uuid.uuid4().hex[:12]}", TEST_USER_ID, 'Fixture', 'lunch', noon_ms(date_str, hour)]
+        values += list(nutrition.values())
+        cur.execute(f"INSERT INTO meals ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(values))})", values)
+
+    events = [
+        ('2026-01-05', 'weight', {'weight': 180.5}),
+        ('2026-01-06', 'weight', {'weight': '179.8'}),
+        ('2026-01-07', 'weight', {'weight': 179.6, '_auto_generated': True}),
+        ('2026-01-05', 'water', {'value': 2}),
+        ('2026-01-05', 'water', {'value': 'not a number'}),
+        ('2026-01-05', 'pushups', {'reps': 20, 'sets': 3}),
+        ('2026-01-06', 'mood', {'note': 'fine', 'rating': 4}),
+        ('2026-01-06', 'steps', {'steps': 8000}),
+        ('2026-01-06', 'journal', {'text': 'no numbers'}),
+    ]
+    for date_str, event_type_id, data in events:
+        cur.execute("""
+            INSERT INTO events (id, user_id, event_type_id, timestamp, category, data, notes)
+            VALUES (%s, %s, %s, %s, 'Health', %s, '')
+        """, (f"evt_{uuid.uuid4().hex[:12]}", TEST_USER_ID, event_type_id, noon_ms(date_str), json.dumps(data)))
+
+
+def read_rollups(cur):
+    cur.execute(f"""
+        SELECT {ROLLUP_COLUMNS} FROM daily_rollups
+        WHERE user_id = %s
+        ORDER BY event_type_id, field, local_day
+    """, (TEST_USER_ID,))
+    rows = []
+    for row in cur.fetchall():
+        row = dict(row)
+        for key in ('value_sum', 'value_min', 'value_max', 'value_last'):
+            if row[key] is not None:
+                row[key] = round(row[key], 6)
+        rows.append(row)
+    return rows
+
+
+def test_backfill_matches_write_rollups():
+    """TEST: migration 5's backfill writes the rows db.write_rollups does."""
+    if not db.DATABASE_URL:
+        raise unittest.SkipTest("POSTGRES_URL is not set")
+
+    print("\n" + "="*80)
+    print("TEST: Migration 5 backfill vs db.write_rollups")
+    print("="*80)
+
+    conn = db.get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE daily_rollups (LIKE public.daily_rollups INCLUDING ALL) ON COMMIT DROP")
+        insert_fixture(cur)
+
+        cur.execute(migrate.DAILY_ROLLUPS_MEALS_BACKFILL_SQL, {'tz': db.ROLLUP_TZ})
+        cur.execute(migrate.DAILY_ROLLUPS_EVENTS_BACKFILL_SQL, {'tz': db.ROLLUP_TZ})
+        migrated = read_rollups(cur)
+
+        cur.execute("DELETE FROM daily_rollups")
+        db.write_rollups(cur, TEST_USER_ID)
+        rebuilt = read_rollups(cur)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    print(f"Migration 5 rows: {len(migrated)}, write_rollups rows: {len(rebuilt)}")
+    for row in migrated:
+        if row not in rebuilt:
+            print(f"  ✗ Only from migration 5: {row}")
+    for row in rebuilt:
+        if row not in migrated:
+            print(f"  ✗ Only from write_rollups: {row}")
+
+    assert migrated, "the fixture produced no rollups"
+    assert migrated == rebuilt, "migration 5's backfill and db.write_rollups disagree"
+    print("✓ Both paths wrote the same rollups")
+
+
+def main():
+    """Run all tests."""
+    print("\n" + "="*80)
+    print("ROLLUP BACKFILL TEST SUITE")
+    print("="*80)
+
+    results = []
+    for name, test in [("Backfill Matches", test_backfill_matches_write_rollups)]:
+        try:
+            test()
+            results.append((name, True))
+        except unittest.SkipTest as e:
+            print(f"Skipped: {e}")
+            return 0
+        except AssertionError as e:
+            print(f"✗ {e}")
+            results.append((name, False))
+
+    # Summary
+    print("\n" + "="*80)
+    print("TEST SUMMARY")
+    print("="*80)
+    for test_name, passed in results:
+        status = "✓ PASSED" if passed else "✗ FAILED"
+        print(f"{test_name:<20} {status}")
+
+    total_passed = sum(1 for _, passed in results if passed)
+    total_tests = len(results)
+    print(f"\nTotal: {total_passed}/{total_tests} tests passed")
+
+    if total_passed == total_tests:
+        print("\n🎉 ALL TESTS PASSED!")
+        return 0
+    else:
+        print("\n❌ SOME TESTS FAILED")
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
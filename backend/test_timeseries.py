@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Property tests for timeseries.py (no database needed).
+
+This script checks:
+1. Chart interpolation: get_chart_data's weight gap-filling via timeseries matches
+   the old per-gap forward scan on random series
+2. Weight job: _weight_gap_fills matches the old day-by-day fill on random weigh-ins
+3. Forward/back fill: against straightforward reference loops
+4. NumPy path: gives the same floats as the pure-Python path (if NumPy is installed)
+5. Cost: a sparse 5-year daily series is filled far faster than the old O(n²) scan
+6. LTTB: keeps the ends, never picks gaps, and respects the threshold
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import timeseries
+from db import WEIGHT_FILL_FIELDS, _weight_gap_fills
+
+TRIALS = 500
+
+
+def legacy_chart_fill(daily_weights, last_val):
+    """get_chart_data's weight interpolation before timeseries.py (O(n²) on sparse ranges)."""
+    daily_weights = list(daily_weights)
+    n = len(daily_weights)
+    for i in range(n):
+        if daily_weights[i] is not None:
+            last_val = daily_weights[i]
+            continue
+        if last_val is None:
+            continue
+        next_val = None
+        for j in range(i + 1, n):
+            if daily_weights[j] is not None:
+                next_val = daily_weights[j]
+                gap_width = j - (i - 1)
+                slope = (next_val - last_val) / gap_width
+                interpolated_val = last_val + slope
+                daily_weights[i] = interpolated_val
+                last_val = interpolated_val
+                break
+        if next_val is None:
+            daily_weights[i] = last_val
+    return daily_weights
+
+
+def chart_fill(daily_weights, last_val):
+    """get_chart_data's weight interpolation now."""
+    return timeseries.forward_fill(timeseries.interpolate_linear([last_val] + daily_weights))[1:]
+
+
+def legacy_weight_fill(user_data_by_date, end_date):
+    """fill_and_interpolate_weight_data's day-by-day scan before timeseries.py."""
+    first_date = min(user_data_by_date)
+    filled = {}
+    current = first_date
+    while current <= end_date:
+        if current in user_data_by_date:
+            current += timedelta(days=1)
+            continue
+        prev_date = next_date = None
+        check = current - timedelta(days=1)
+        while check >= first_date:
+            if check in user_data_by_date:
+                prev_date = check
+                break
+            check -= timedelta(days=1)
+        check = current + timedelta(days=1)
+        while check <= end_date:
+            if check in user_data_by_date:
+                next_date = check
+                break
+            check += timedelta(days=1)
+
+        prev_data = user_data_by_date[prev_date]
+        next_data = user_data_by_date[next_date] if next_date else None
+        values = {}
+        for field in WEIGHT_FILL_FIELDS:
+            if prev_data.get(field) is None:
+                continue
+            if next_data and next_data.get(field) is not None:
+                total_days = (next_date - prev_date).days
+                val = float(prev_data[field]) + (float(next_data[field]) - float(prev_data[field])) * ((current - prev_date).days / total_days)
+            else:
+                val = float(prev_data[field])
+            values[field] = round(val, 2)
+        if values:
+            filled[current] = values
+        current += timedelta(days=1)
+    return filled
+
+
+def random_series(rng, n, density):
+    return [round(rng.uniform(140, 160), 1) if rng.random() < density else None for _ in range(n)]
+
+
+def close(a, b):
+    if a is None or b is None:
+        return a is b
+    return abs(a - b) < 1e-9
+
+
+def test_chart_fill():
+    print("\nTEST 1: Chart interpolation matches the old forward scan")
+    rng = random.Random(1)
+    for trial in range(TRIALS):
+        series = random_series(rng, rng.randint(0, 120), rng.choice([0.0, 0.05, 0.3, 0.9]))
+        last_val = rng.choice([None, 150.0])
+        expected = legacy_chart_fill(series, last_val)
+        actual = chart_fill(series, last_val)
+        if len(expected) != len(actual) or not all(close(a, b) for a, b in zip(expected, actual)):
+            print(f"✗ Trial {trial}: {series} (last {last_val})\n  old {expected}\n  new {actual}")
+            return False
+    print(f"✓ {TRIALS} random series match")
+    return True
+
+
+def test_weight_fill():
+    print("\nTEST 2: Weight job fill matches the old day-by-day scan")
+    rng = random.Random(2)
+    start = date(2024, 1, 1)
+    for trial in range(TRIALS):
+        entries = {}
+        for _ in range(rng.randint(1, 8)):
+            data = {}
+            if rng.random() < 0.9:
+                data['weight'] = round(rng.uniform(140, 160), 1)
+            if rng.random() < 0.5:
+                data['body_fat_pct'] = round(rng.uniform(15, 25), 1)
+            entries[start + timedelta(days=rng.randint(0, 200))] = data
+        end_date = max(max(entries), start + timedelta(days=rng.randint(0, 260)))
+
+        expected = legacy_weight_fill(entries, end_date)
+        actual = dict(_weight_gap_fills(entries, end_date))
+        if expected != actual:
+            print(f"✗ Trial {trial}: {entries}")
+            return False
+    print(f"✓ {TRIALS} random weigh-in histories match exactly")
+    return True
+
+
+def test_fills():
+    print("\nTEST 3: Forward/back fill")
+    rng = random.Random(3)
+    for _ in range(TRIALS):
+        series = random_series(rng, rng.randint(0, 50), 0.3)
+        expected_ffill, last = [], 'seed'
+        for v in series:
+            last = v if v is not None else last
+            expected_ffill.append(last)
+        expected_bfill, nxt = [], 'end'
+        for v in reversed(series):
+            nxt = v if v is not None else nxt
+            expected_bfill.append(nxt)
+        if timeseries.forward_fill(series, 'seed') != expected_ffill:
+            print(f"✗ forward_fill({series})")
+            return False
+        if timeseries.back_fill(series, 'end') != expected_bfill[::-1]:
+            print(f"✗ back_fill({series})")
+            return False
+    print(f"✓ {TRIALS} random series match")
+    return True
+
+
+def test_numpy_path():
+    print("\nTEST 4: NumPy and pure-Python interpolation agree")
+    if timeseries.np is None:
+        print("- NumPy not installed, skipped")
+        return True
+    rng = random.Random(4)
+    saved = timeseries.NUMPY_MIN_LENGTH
+    try:
+        for _ in range(TRIALS):
+            series = random_series(rng, rng.randint(0, 400), rng.choice([0.01, 0.1, 0.5]))
+            timeseries.NUMPY_MIN_LENGTH = 10 ** 9
+            pure = timeseries.interpolate_linear(series)
+            timeseries.NUMPY_MIN_LENGTH = 0
+            vectorized = timeseries.interpolate_linear(series)
+            if pure != vectorized:
+                print(f"✗ Paths differ on {series}")
+                return False
+    finally:
+        timeseries.NUMPY_MIN_LENGTH = saved
+    print(f"✓ {TRIALS} random series identical")
+    return True
+
+
+def test_cost():
+    print("\nTEST 5: Sparse 5-year range")
+    days = 5 * 365
+    # A weigh-in about once a year: long gaps are the old scan's worst case
+    series = [150.0 + (i % 7) if i % 365 == 0 else None for i in range(days)]
+
+    start = time.perf_counter()
+    for _ in range(5):
+        expected = legacy_chart_fill(series, 149.0)
+    legacy_ms = (time.perf_counter() - start) * 200
+
+    start = time.perf_counter()
+    for _ in range(5):
+        actual = chart_fill(series, 149.0)
+    new_ms = (time.perf_counter() - start) * 200
+
+    print(f"  old {legacy_ms:.2f} ms, new {new_ms:.2f} ms per fill")
+    if not all(close(a, b) for a, b in zip(expected, actual)):
+        print("✗ Results differ")
+        return False
+    if new_ms * 5 > legacy_ms:
+        print("✗ Expected at least a 5x speedup")
+        return False
+    print("✓ Same result, linear time")
+    return True
+
+
+def test_lttb():
+    print("\nTEST 6: LTTB downsampling")
+    rng = random.Random(6)
+    for _ in range(TRIALS):
+        series = random_series(rng, rng.randint(0, 300), rng.choice([0.2, 1.0]))
+        threshold = rng.randint(3, 60)
+        kept = timeseries.lttb_indices(series, threshold)
+        real = [i for i, v in enumerate(series) if v is not None]
+        if kept != sorted(set(kept)) or any(series[i] is None for i in kept):
+            print(f"✗ Picked a gap or repeated a point: {kept}")
+            return False
+        if real and (kept[0] != real[0] or kept[-1] != real[-1]):
+            print("✗ Ends not kept")
+            return False
+        if len(kept) > max(threshold, 2) and len(kept) != len(real):
+            print(f"✗ Kept {len(kept)} points for threshold {threshold}")
+            return False
+    print(f"✓ {TRIALS} random series downsampled correctly")
+    return True
+
+
+def main():
+    print("=" * 80)
+    print("TIMESERIES TEST SUITE")
+    print("=" * 80)
+
+    results = [
+        ("Chart Fill", test_chart_fill()),
+        ("Weight Job Fill", test_weight_fill()),
+        ("Forward/Back Fill", test_fills()),
+        ("NumPy Path", test_numpy_path()),
+        ("5-Year Cost", test_cost()),
+        ("LTTB", test_lttb()),
+    ]
+
+    print("\n" + "=" * 80)
+    print("TEST SUMMARY")
+    print("=" * 80)
+    for test_name, passed in results:
+        status = "✓ PASSED" if passed else "✗ FAILED"
+        print(f"{test_name:<20} {status}")
+
+    if all(passed for _, passed in results):
+        print("\n🎉 ALL TESTS PASSED!")
+        return 0
+    print("\n❌ SOME TESTS FAILED")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
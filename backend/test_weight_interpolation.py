@@ -9,6 +9,7 @@ This script tests the following scenarios:
 4. Body fat %: Verify body fat % is also filled/interpolated
 5. Mixed fields: Weight on day 1, both weight and body fat on day 10
 6. Deletion: Delete day 1 weight, verify interpolation updates
+7. Windowed refill: Add weight inside the forward-filled tail, verify only its segment changes
 """
 
 import sys
@@ -18,6 +19,9 @@ from datetime import datetime, timedelta, timezone
 # Add backend to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
+# Refill weights as part of each write, so results can be checked straight after
+os.environ.setdefault('LIFESTATS_JOBS_INLINE', '1')
+
 from db import (
     get_db_connection,
     fill_and_interpolate_weight_data,
@@ -288,6 +292,54 @@ def test_deletion():
     
     return success
 
+def test_windowed_refill():
+    """Test 5: A weigh-in inside the forward-filled tail only rebuilds its segment."""
+    print("\n" + "="*80)
+    print("TEST 5: Windowed Refill")
+    print("="*80)
+    print("Adding weight event on 2026-01-25 with weight 146 lbs...")
+    print("This should re-interpolate 2026-01-21 through 2026-01-24 and forward-fill from 146")
+    
+    create_weight_event('2026-01-25', weight=146.0)
+    
+    events = get_weight_events()
+    print_events(events, "Result")
+    
+    # Between 148 (day 20) and 146 (day 25) = 5 days apart, -0.4 per day
+    expected_weights = {
+        '2026-01-20': 148.0,
+        '2026-01-21': 147.6,
+        '2026-01-22': 147.2,
+        '2026-01-23': 146.8,
+        '2026-01-24': 146.4,
+        '2026-01-25': 146.0,
+        '2026-01-26': 146.0,
+        '2026-01-27': 146.0
+    }
+    
+    success = True
+    dates = [e['date'] for e in events]
+    duplicates = sorted(set(d for d in dates if dates.count(d) > 1))
+    if duplicates:
+        print(f"✗ More than one weight event on {', '.join(duplicates)}")
+        success = False
+    
+    for date, expected_weight in expected_weights.items():
+        event = next((e for e in events if e['date'] == date), None)
+        if not event:
+            print(f"✗ Missing event for {date}")
+            success = False
+        elif abs(event['weight'] - expected_weight) > 0.01:
+            print(f"✗ Weight on {date} should be {expected_weight}, got {event['weight']}")
+            success = False
+    
+    if success:
+        print("\n✓ TEST 5 PASSED: Windowed refill working correctly")
+    else:
+        print("\n✗ TEST 5 FAILED")
+    
+    return success
+
 def main():
     """Run all tests."""
     print("\n" + "="*80)
@@ -301,6 +353,7 @@ def main():
         results.append(("Interpolation", test_interpolation()))
         results.append(("Body Fat %", test_body_fat()))
         results.append(("Deletion", test_deletion()))
+        results.append(("Windowed Refill", test_windowed_refill()))
     finally:
         # Cleanup
         print("\n" + "="*80)
@@ -0,0 +1,138 @@
+"""
+Helpers for evenly spaced numeric series, as charted by get_chart_data.
+
+Series are plain lists indexed by label position, with None marking a label
+that has no value. The gap-filling primitives run in linear time and use NumPy
+for long series when it is installed; results are the same either way.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy is optional
+    np = None
+
+# Below this length the pure-Python loops beat NumPy's conversion overhead.
+NUMPY_MIN_LENGTH = 256
+
+
+def interpolate_linear(values):
+    """
+    Fill every run of Nones that has a value on both sides with points on the
+    straight line between them (by position). Leading and trailing Nones are
+    left alone. Returns a new list.
+    """
+    known = [i for i, v in enumerate(values) if v is not None]
+    if len(known) < 2 or len(known) == len(values):
+        return list(values)
+    if np is not None and len(values) >= NUMPY_MIN_LENGTH:
+        return _interpolate_linear_numpy(values, known)
+
+    filled = list(values)
+    for a, b in zip(known, known[1:]):
+        span = b - a
+        if span < 2:
+            continue
+        left, right = float(values[a]), float(values[b])
+        for i in range(a + 1, b):
+            filled[i] = left + (right - left) * ((i - a) / span)
+    return filled
+
+
+def _interpolate_linear_numpy(values, known):
+    known = np.asarray(known)
+    missing = np.flatnonzero(np.array([v is None for v in values]))
+    missing = missing[(missing > known[0]) & (missing < known[-1])]
+    filled = list(values)
+    if not len(missing):
+        return filled
+
+    ys = np.array([float(values[i]) for i in known])
+    right_pos = np.searchsorted(known, missing)
+    a, b = known[right_pos - 1], known[right_pos]
+    left, right = ys[right_pos - 1], ys[right_pos]
+    # Same operation order as the loop above, so results match bit for bit
+    points = left + (right - left) * ((missing - a) / (b - a))
+    for i, v in zip(missing.tolist(), points.tolist()):
+        filled[i] = v
+    return filled
+
+
+def forward_fill(values, initial=None):
+    """Replace each None with the last value before it (or initial, if none yet)."""
+    filled = []
+    last = initial
+    for v in values:
+        if v is None:
+            filled.append(last)
+        else:
+            filled.append(v)
+            last = v
+    return filled
+
+
+def back_fill(values, final=None):
+    """Replace each None with the next value after it (or final, if none follows)."""
+    return forward_fill(values[::-1], final)[::-1]
+
+
+def lttb_indices(values, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps when reducing a
+    series to at most threshold points.
+
+    LTTB keeps the point in each bucket that forms the largest triangle with the
+    previously kept point and the next bucket's average, so peaks, troughs and
+    trend changes survive downsampling. Gaps (None) are never picked; the first
+    and last real points always are. Returns every real index when the series is
+    already short enough.
+    """
+    points = [(i, float(v)) for i, v in enumerate(values) if v is not None]
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return [i for i, _ in points]
+
+    kept = [points[0][0]]
+    # Every bucket but the first and last holds this many points
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for bucket in range(threshold - 2):
+        # Average of the next bucket is the triangle's third corner
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, n)
+        next_points = points[next_start:next_end] or [points[-1]]
+        avg_x = sum(x for x, _ in next_points) / len(next_points)
+        avg_y = sum(y for _, y in next_points) / len(next_points)
+
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        ax, ay = points[a]
+
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+
+        kept.append(points[best][0])
+        a = best
+
+    kept.append(points[-1][0])
+    return kept
+
+
+def downsample_shared(series_list, threshold):
+    """
+    Label positions to keep so that every series in series_list (all the same
+    length, sharing labels) keeps its own LTTB points: the union of each series'
+    selection plus both ends. Each series keeps at most threshold points.
+    """
+    length = len(series_list[0]) if series_list else 0
+    if length <= threshold:
+        return list(range(length))
+
+    keep = {0, length - 1}
+    for values in series_list:
+        keep.update(lttb_indices(values, threshold))
+    return sorted(keep)
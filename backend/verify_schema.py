@@ -69,7 +69,7 @@ def verify_schema():
         cur.execute("""
             SELECT tablename, indexname 
             FROM pg_indexes 
-            WHERE tablename IN ('event_types', 'events')
+            WHERE tablename IN ('event_types', 'events', 'meals')
             ORDER BY tablename, indexname
         """)
         indexes = cur.fetchall()
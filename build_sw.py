@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Regenerate the app-shell manifest in frontend/sw.js.
+
+The service worker precaches SHELL_FILES in a cache named for their content
+hashes, so a change to any of them ships a different sw.js: browsers install
+the new worker, which caches the new files and drops the old cache. Run this
+after changing a shell file:
+
+    python3 build_sw.py          # rewrite the manifest in sw.js
+    python3 build_sw.py --check  # exit 1 if sw.js is out of date
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+
+FRONTEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'frontend')
+SW_PATH = os.path.join(FRONTEND, 'sw.js')
+
+# Shell URL -> file under frontend/
+SHELL_FILES = {
+    '/': 'index.html',
+    '/index.html': 'index.html',
+    '/manifest.json': 'manifest.json',
+    '/icon-512.png': 'icon-512.png',
+    '/storage.js': 'storage.js'
+}
+
+BLOCK = re.compile(r'(// BEGIN APP SHELL[^\n]*\n).*?(// END APP SHELL)', re.S)
+
+
+def file_hash(name):
+    with open(os.path.join(FRONTEND, name), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def manifest_block():
+    """The generated APP_SHELL/SHELL_VERSION declarations."""
+    shell = {url: file_hash(name) for url, name in SHELL_FILES.items()}
+    version = hashlib.sha256(json.dumps(shell, sort_keys=True).encode()).hexdigest()[:12]
+    entries = ',\n'.join(f"    '{url}': '{digest}'" for url, digest in shell.items())
+    return f"const APP_SHELL = {{\n{entries}\n}};\nconst SHELL_VERSION = '{version}';\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true', help="exit 1 if sw.js's manifest is out of date")
+    args = parser.parse_args()
+
+    with open(SW_PATH) as f:
+        source = f.read()
+    if not BLOCK.search(source):
+        print(f"No APP SHELL block in {SW_PATH}")
+        return 1
+
+    updated = BLOCK.sub(lambda m: m.group(1) + manifest_block() + m.group(2), source, count=1)
+    if updated == source:
+        print("sw.js app shell manifest is up to date")
+        return 0
+    if args.check:
+        print("sw.js app shell manifest is out of date: run python3 build_sw.py")
+        return 1
+
+    with open(SW_PATH, 'w') as f:
+        f.write(updated)
+    print("Updated the app shell manifest in sw.js")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,149 @@
 // Storage layer - Communicates with Backend API
+//
+// Meals and events are read from a local IndexedDB replica kept current through
+// GET /api/sync, so screens render without waiting on the network. Writes to
+// them are applied to the replica and go through an outbox: sent at once when
+// online, otherwise kept and replayed in order by the service worker's
+// Background Sync (or when the page sees the connection return). Meal and event
+// ids are made here and the server ignores an insert it already has, so a
+// replay never creates a duplicate.
+
+const REPLICA_DB = 'lifestats';
+const REPLICA_VERSION = 2;
+const OUTBOX_SYNC_TAG = 'lifestats-outbox';
+// Sends of one queued write that fail server-side (5xx/429) before it is given
+// up on, and the backoff between them (doubling from the base, up to the max)
+const OUTBOX_MAX_ATTEMPTS = 8;
+const OUTBOX_RETRY_BASE_MS = 5000;
+const OUTBOX_RETRY_MAX_MS = 30 * 60 * 1000;
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function idbDone(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = () => resolve();
+        tx.onerror = tx.onabort = () => reject(tx.error);
+    });
+}
+
+let replicaOpening = null;
+
+// The replica database, or a rejection where IndexedDB isn't available
+function openReplica() {
+    if (!replicaOpening) {
+        replicaOpening = new Promise((resolve, reject) => {
+            if (typeof indexedDB === 'undefined') {
+                reject(new Error('IndexedDB not available'));
+                return;
+            }
+            const request = indexedDB.open(REPLICA_DB, REPLICA_VERSION);
+            request.onupgradeneeded = (event) => {
+                const db = request.result;
+                if (event.oldVersion < 1) {
+                    db.createObjectStore('meals', { keyPath: 'id' }).createIndex('timestamp', 'timestamp');
+                    const events = db.createObjectStore('events', { keyPath: 'id' });
+                    events.createIndex('type_timestamp', ['eventTypeId', 'timestamp']);
+                    // Queued writes, replayed in seq order
+                    db.createObjectStore('outbox', { keyPath: 'seq', autoIncrement: true });
+                    db.createObjectStore('meta', { keyPath: 'key' });
+                }
+                if (event.oldVersion < 2) {
+                    // Queued writes the server refused or kept failing, kept for inspection
+                    db.createObjectStore('deadletter', { keyPath: 'seq' });
+                }
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+    return replicaOpening;
+}
+
+let outboxFlushing = null;
+
+// Send queued writes in order. Stops at the first one the network or server
+// can't take right now, leaving it and the rest queued; a server-side failure
+// (5xx/429) also counts an attempt and holds the write back for a growing
+// delay. Writes the server refuses (4xx), or that fail OUTBOX_MAX_ATTEMPTS
+// times, move to the dead-letter store and the replica is put back as it was
+// before them. Resolves to { pending, rejected: [{ seq, status, error }] }.
+function flushOutbox() {
+    if (!outboxFlushing) {
+        outboxFlushing = sendOutbox().finally(() => { outboxFlushing = null; });
+    }
+    return outboxFlushing;
+}
+
+async function sendOutbox() {
+    const db = await openReplica();
+    const rejected = [];
+    while (true) {
+        const cursor = await idbRequest(db.transaction('outbox').objectStore('outbox').openCursor());
+        if (!cursor) return { pending: false, rejected };
+        const op = cursor.value;
+        if (op.retryAt && op.retryAt > Date.now()) {
+            return { pending: true, rejected };  // Backing off
+        }
+
+        let response;
+        try {
+            response = await fetch(op.url, {
+                method: op.method,
+                headers: op.body ? { 'Content-Type': 'application/json' } : {},
+                body: op.body ? JSON.stringify(op.body) : undefined
+            });
+        } catch (error) {
+            return { pending: true, rejected };  // Offline
+        }
+        // Read before opening the transaction below: awaiting the network
+        // inside one would let it auto-commit
+        const body = response.ok ? {} : await response.json().catch(() => ({}));
+
+        const failed = response.status >= 500 || response.status === 429;
+        const attempts = (op.attempts || 0) + (failed ? 1 : 0);
+        if (failed && attempts < OUTBOX_MAX_ATTEMPTS) {
+            const delay = Math.min(OUTBOX_RETRY_BASE_MS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_MS);
+            const tx = db.transaction('outbox', 'readwrite');
+            tx.objectStore('outbox').put({ ...op, attempts, retryAt: Date.now() + delay });
+            await idbDone(tx);
+            return { pending: true, rejected };
+        }
+
+        // A replayed delete of a row that is already gone has done its job
+        const refused = !response.ok && !(op.method === 'DELETE' && response.status === 404);
+        if (refused) {
+            rejected.push({ seq: op.seq, status: response.status, error: body.error });
+            console.error(`Gave up on queued ${op.method} ${op.url} after ${attempts || 1} attempt(s):`,
+                body.error || response.status);
+        }
+
+        const tx = db.transaction(['outbox', 'deadletter', op.store], 'readwrite');
+        if (refused) {
+            if (op.previous) {
+                tx.objectStore(op.store).put(op.previous);
+            } else {
+                tx.objectStore(op.store).delete(op.id);
+            }
+            tx.objectStore('deadletter').put({
+                ...op, attempts, status: response.status, error: body.error || null, failedAt: Date.now()
+            });
+        }
+        tx.objectStore('outbox').delete(op.seq);
+        await idbDone(tx);
+    }
+}
+
 class Storage {
     constructor() {
         this.userId = this.getUserId();
+        this.syncing = null;
+        // Writes queued while offline go out as soon as the connection is back
+        window.addEventListener('online', () => this.sync());
     }
 
     // Get or create user ID (Persist in LocalStorage still for identity)
@@ -14,10 +156,185 @@ class Storage {
         return userId;
     }
 
+    // A new client-side id, unique across devices, for a meal or event
+    newId(prefix) {
+        return `${prefix}-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`;
+    }
+
+    // Bring the replica up to date (Async): send queued writes first, then pull
+    // every change since the last sync. Fires a 'storage-synced' window event
+    // when meals or events changed. Resolves false if it couldn't finish.
+    sync() {
+        if (!this.syncing) {
+            this.syncing = this.pullChanges()
+                .catch(error => {
+                    console.error('Error syncing:', error);
+                    return false;
+                })
+                .finally(() => { this.syncing = null; });
+        }
+        return this.syncing;
+    }
+
+    async pullChanges() {
+        const db = await openReplica();
+        const flushed = await flushOutbox();
+        if (flushed.rejected.length) {
+            // Writes given up on were taken back out of the replica
+            window.dispatchEvent(new CustomEvent('storage-synced', { detail: { changed: flushed.rejected.length } }));
+        }
+        if (flushed.pending) {
+            // Pulling now could overwrite local writes the server hasn't seen
+            this.requestReplay();
+            return false;
+        }
+
+        // A different user on this device starts from an empty replica
+        const owner = await idbRequest(db.transaction('meta').objectStore('meta').get('userId'));
+        if (owner && owner.value !== this.userId) {
+            const tx = db.transaction(['meals', 'events', 'meta'], 'readwrite');
+            ['meals', 'events', 'meta'].forEach(store => tx.objectStore(store).clear());
+            await idbDone(tx);
+        }
+
+        const position = await idbRequest(db.transaction('meta').objectStore('meta').get('syncedUpTo'));
+        let since = position ? position.value : 0;
+        let changed = 0;
+        while (true) {
+            const page = await this.getChanges(since);
+            if (page.resync) {
+                // Deletions since our position were pruned on the server:
+                // rebuild the replica from scratch
+                const tx = db.transaction(['meals', 'events', 'meta'], 'readwrite');
+                ['meals', 'events', 'meta'].forEach(store => tx.objectStore(store).clear());
+                await idbDone(tx);
+                since = 0;
+                changed++;
+                continue;
+            }
+            const tx = db.transaction(['meals', 'events', 'meta'], 'readwrite');
+            for (const store of ['meals', 'events']) {
+                // Deletes first: a row deleted and re-created is in both lists.
+                // Rows the replica already has as sent (this device's own
+                // writes) don't count as changes.
+                const objectStore = tx.objectStore(store);
+                for (const id of page.deleted[store]) {
+                    if (await idbRequest(objectStore.get(id))) {
+                        objectStore.delete(id);
+                        changed++;
+                    }
+                }
+                for (const record of page.changes[store]) {
+                    const existing = await idbRequest(objectStore.get(record.id));
+                    if (JSON.stringify(existing) !== JSON.stringify(record)) {
+                        objectStore.put(record);
+                        changed++;
+                    }
+                }
+            }
+            tx.objectStore('meta').put({ key: 'userId', value: this.userId });
+            tx.objectStore('meta').put({ key: 'syncedUpTo', value: page.next });
+            await idbDone(tx);
+
+            if (!page.more || page.next === since) break;
+            since = page.next;
+        }
+
+        if (changed) {
+            window.dispatchEvent(new CustomEvent('storage-synced', { detail: { changed } }));
+        }
+        return true;
+    }
+
+    // Ask the service worker to replay the outbox once the connection is back.
+    // Without Background Sync, the 'online' listener does it instead.
+    async requestReplay() {
+        try {
+            const registration = 'serviceWorker' in navigator && await navigator.serviceWorker.getRegistration();
+            if (registration && registration.sync) {
+                await registration.sync.register(OUTBOX_SYNC_TAG);
+            }
+        } catch (error) {
+            console.error('Error registering background sync:', error);
+        }
+    }
+
+    // Records from one replica store's index range, newest first; null until the
+    // replica has been synced once (the caller goes to the network instead)
+    async readReplica(store, index, range) {
+        try {
+            const db = await openReplica();
+            const owner = await idbRequest(db.transaction('meta').objectStore('meta').get('userId'));
+            if (!owner || owner.value !== this.userId) {
+                this.sync();
+                return null;
+            }
+            const records = await idbRequest(db.transaction(store).objectStore(store).index(index).getAll(range));
+            this.sync();  // Refresh in the background; 'storage-synced' says when it changed anything
+            return records.sort((a, b) => b.timestamp - a.timestamp);
+        } catch (error) {
+            console.error('Error reading local replica:', error);
+            return null;
+        }
+    }
+
+    // Apply a write to the replica, queue it, and try to send it now (Async).
+    // Resolves once the server has it or it is queued for later; rejects with
+    // the server's error if it refuses it (and the replica is put back).
+    // record is the row as it will be after the write, null for a delete, or
+    // undefined to leave the replica as it is.
+    async write(op, record) {
+        let db;
+        try {
+            db = await openReplica();
+        } catch (error) {
+            // No replica: just send it
+            const response = await fetch(op.url, {
+                method: op.method,
+                headers: op.body ? { 'Content-Type': 'application/json' } : {},
+                body: op.body ? JSON.stringify(op.body) : undefined
+            });
+            if (!response.ok) {
+                const body = await response.json().catch(() => ({}));
+                throw new Error(body.error || `Request failed (${response.status})`);
+            }
+            return;
+        }
+
+        const tx = db.transaction([op.store, 'outbox'], 'readwrite');
+        const previous = await idbRequest(tx.objectStore(op.store).get(op.id));
+        if (record) {
+            tx.objectStore(op.store).put(record);
+        } else if (record === null) {
+            tx.objectStore(op.store).delete(op.id);
+        }
+        const seq = await idbRequest(tx.objectStore('outbox').add({ ...op, previous: previous || null }));
+        await idbDone(tx);
+
+        const result = await flushOutbox();
+        const refusal = result.rejected.find(r => r.seq === seq);
+        if (refusal) {
+            throw new Error(refusal.error || `Request failed (${refusal.status})`);
+        }
+        if (result.pending) {
+            this.requestReplay();
+        }
+    }
+
+    // The replica's current copy of a row, if any (Async)
+    async getLocal(store, id) {
+        try {
+            const db = await openReplica();
+            return await idbRequest(db.transaction(store).objectStore(store).get(id));
+        } catch (error) {
+            return undefined;
+        }
+    }
+
     // Save a meal (Async)
     async saveMeal(foodName, mealType, nutrition = null, servingInfo = null, timestamp = null, brandName = null) {
         const newMeal = {
-            id: 'meal-' + Date.now(),
+            id: this.newId('meal'),
             userId: this.userId,
             foodName: foodName,
             brandName: brandName || null,
@@ -29,22 +346,11 @@ class Storage {
         };
 
         try {
-            const response = await fetch('/api/meals', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(newMeal)
-            });
-
-            if (!response.ok) {
-                throw new Error('Failed to save meal');
-            }
-            return await response.json();
+            await this.write({ store: 'meals', id: newMeal.id, method: 'POST', url: '/api/meals', body: newMeal }, newMeal);
+            return newMeal;
         } catch (error) {
             console.error('Error saving meal:', error);
-            // Fallback? Or just alert. For now, alert.
-            alert('Error saving meal. Check connection.');
+            alert('Error saving meal: ' + error.message);
             return null;
         }
     }
@@ -63,28 +369,77 @@ class Storage {
         }
     }
 
-    // Get meals for today (Async) - Efficient filtering happens in JS for now, simpler
+    // Get meals in the [start, end) window, newest first (Async). From the
+    // replica once it has synced; before that, from the server, following its
+    // nextCursor through every page of the window.
+    async getMealsInRange(start, end) {
+        const local = await this.readReplica('meals', 'timestamp', IDBKeyRange.bound(start, end, false, true));
+        if (local) return local;
+
+        const meals = [];
+        let cursor = null;
+        try {
+            do {
+                const params = new URLSearchParams({ userId: this.userId, start, end, limit: 200 });
+                if (cursor) params.set('cursor', cursor);
+                const response = await fetch(`/api/meals?${params}`);
+                if (!response.ok) {
+                    throw new Error('Failed to fetch meals');
+                }
+                const page = await response.json();
+                meals.push(...page.meals);
+                cursor = page.nextCursor;
+            } while (cursor);
+            return meals;
+        } catch (error) {
+            console.error('Error fetching meals:', error);
+            return [];
+        }
+    }
+
+    // Get meals for the local day containing date (Async)
+    async getMealsForDay(date) {
+        const [start, end] = this.dayBounds(date);
+        return this.getMealsInRange(start, end);
+    }
+
+    // Get meals for today (Async)
     async getTodaysMeals() {
-        const meals = await this.getMeals();
-        const today = new Date();
-        today.setHours(0, 0, 0, 0);
-
-        return meals.filter(meal => {
-            const mealDate = new Date(meal.timestamp);
-            mealDate.setHours(0, 0, 0, 0);
-            return mealDate.getTime() === today.getTime();
-        });
+        return this.getMealsForDay(new Date());
+    }
+
+    // [start, end) epoch ms of the local day containing date
+    dayBounds(date) {
+        const start = new Date(date);
+        start.setHours(0, 0, 0, 0);
+        const end = new Date(start);
+        end.setDate(end.getDate() + 1);
+        return [start.getTime(), end.getTime()];
+    }
+
+    // Get everything changed since the sync position `since` (Async), as
+    // { changes, deleted, next, more }; 0 gets everything. See GET /api/sync.
+    // A 410 (the position is older than the server keeps deletions for)
+    // resolves to { resync: true }
+    async getChanges(since = 0) {
+        const params = new URLSearchParams({ userId: this.userId, since });
+        const response = await fetch(`/api/sync?${params}`);
+        if (response.status === 410) {
+            return { resync: true };
+        }
+        if (!response.ok) {
+            throw new Error('Failed to sync');
+        }
+        return await response.json();
     }
 
     // Delete a meal (Async)
     async deleteMeal(mealId) {
         try {
-            const response = await fetch(`/api/meals/${mealId}?userId=${encodeURIComponent(this.userId)}`, {
-                method: 'DELETE'
-            });
-            if (!response.ok) {
-                throw new Error('Failed to delete meal');
-            }
+            await this.write({
+                store: 'meals', id: mealId, method: 'DELETE',
+                url: `/api/meals/${mealId}?userId=${encodeURIComponent(this.userId)}`
+            }, null);
             return true;
         } catch (error) {
             console.error('Error deleting meal:', error);
@@ -94,16 +449,14 @@ class Storage {
     // Update a meal (Async)
     async updateMeal(mealId, updates) {
         try {
-            const response = await fetch(`/api/meals/${mealId}?userId=${encodeURIComponent(this.userId)}`, {
-                method: 'PUT',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(updates)
-            });
-            if (!response.ok) {
-                throw new Error('Failed to update meal');
-            }
+            const current = await this.getLocal('meals', mealId);
+            const updated = current && {
+                ...current, ...updates, nutrition: { ...current.nutrition, ...(updates.nutrition || {}) }
+            };
+            await this.write({
+                store: 'meals', id: mealId, method: 'PUT',
+                url: `/api/meals/${mealId}?userId=${encodeURIComponent(this.userId)}`, body: updates
+            }, updated);
             return true;
         } catch (error) {
             console.error('Error updating meal:', error);
@@ -111,6 +464,63 @@ class Storage {
         }
     }
 
+    // Log an event (Async). Returns the event; throws with the server's error
+    // if it refuses it.
+    async logEvent(eventData) {
+        const event = { ...eventData, id: eventData.id || this.newId('event'), userId: this.userId };
+        await this.write({
+            store: 'events', id: event.id, method: 'POST',
+            url: `/api/events?userId=${encodeURIComponent(this.userId)}`, body: event
+        }, event);
+        return event;
+    }
+
+    // Update an event (Async); throws with the server's error if it refuses it
+    async updateEvent(eventId, updates) {
+        const current = await this.getLocal('events', eventId);
+        await this.write({
+            store: 'events', id: eventId, method: 'PUT',
+            url: `/api/events/${eventId}?userId=${encodeURIComponent(this.userId)}`, body: updates
+        }, current && { ...current, ...updates });
+    }
+
+    // Delete an event (Async); throws with the server's error if it refuses it
+    async deleteEvent(eventId) {
+        await this.write({
+            store: 'events', id: eventId, method: 'DELETE',
+            url: `/api/events/${eventId}?userId=${encodeURIComponent(this.userId)}`
+        }, null);
+    }
+
+    // Get one event (Async), from the replica when it has it
+    async getEvent(eventId) {
+        const local = await this.getLocal('events', eventId);
+        if (local) return local;
+        const response = await fetch(`/api/events/${eventId}?userId=${encodeURIComponent(this.userId)}`);
+        if (!response.ok) {
+            throw new Error('Failed to fetch event details');
+        }
+        return await response.json();
+    }
+
+    // Get one event type's events for the local day containing date, newest
+    // first (Async)
+    async getEventsForDay(eventTypeId, date) {
+        const [start, end] = this.dayBounds(date);
+        const local = await this.readReplica('events', 'type_timestamp',
+            IDBKeyRange.bound([eventTypeId, start], [eventTypeId, end], false, true));
+        if (local) return local;
+
+        const params = new URLSearchParams({
+            userId: this.userId, eventTypeId, startDate: start, endDate: end - 1, limit: 100
+        });
+        const response = await fetch(`/api/events?${params}`);
+        if (!response.ok) {
+            throw new Error('Failed to fetch events');
+        }
+        return await response.json();
+    }
+
     // Save custom food (Async)
     async saveCustomFood(foodData) {
         try {
@@ -192,5 +602,5 @@ class Storage {
     }
 }
 
-// Export for use in HTML
-const storage = new Storage();
+// Export for use in HTML (the service worker imports this file for flushOutbox only)
+const storage = typeof window !== 'undefined' ? new Storage() : null;
@@ -1,36 +1,146 @@
-// Simple service worker for offline support
-const CACHE_NAME = 'lifestats-v20';
-const urlsToCache = [
-    '/',
-    '/index.html',
-    '/manifest.json',
-    '/icon-512.png',
-    '/storage.js'
-];
-
-// Install service worker and cache resources
+// Service worker: offline app shell, stale-while-revalidate for read-only API
+// calls, and Background Sync for the storage.js outbox.
+
+// BEGIN APP SHELL (generated by build_sw.py; do not edit by hand)
+const APP_SHELL = {
+    '/': '3176bfbb9670',
+    '/index.html': '3176bfbb9670',
+    '/manifest.json': '8cdf8d280b27',
+    '/icon-512.png': 'cbceaa363f65',
+    '/storage.js': '4396cb71165e'
+};
+const SHELL_VERSION = '6a963c590315';
+// END APP SHELL
+
+// Named for the shell files' hashes, so a change to any of them installs a new
+// worker with a fresh shell cache, and activate deletes the old one.
+const SHELL_CACHE = `lifestats-shell-${SHELL_VERSION}`;
+const API_CACHE = 'lifestats-api-v1';
+
+// Read-only endpoints answered from API_CACHE while they refresh in the
+// background, each with the write paths that make it stale. A successful
+// non-GET to a path under one of those prefixes drops every cached response of
+// that endpoint. Only requests carrying a userId are cached, so each user's
+// responses have their own keys.
+const API_READS = {
+    // Event types carry lastUsed, so meal and event writes change them too
+    '/api/event-types': ['/api/event-types', '/api/categories', '/api/events', '/api/meals', '/api/integrations'],
+    '/api/categories': ['/api/categories'],
+    '/api/profile': ['/api/profile', '/api/events', '/api/integrations'],
+    '/api/goals': ['/api/goals', '/api/event-types'],
+    '/api/custom-foods': ['/api/custom-foods', '/api/add-custom-food']
+};
+
+// Bumped per endpoint on every invalidation; a background refresh that started
+// before one doesn't write its (possibly stale) response back
+const generations = {};
+
+const underPath = (pathname, prefix) => pathname === prefix || pathname.startsWith(prefix + '/');
+
+function cachedRead(url) {
+    if (!url.searchParams.get('userId')) return null;
+    return Object.keys(API_READS).find(endpoint => underPath(url.pathname, endpoint)) || null;
+}
+
+async function invalidate(writePath) {
+    const stale = Object.keys(API_READS).filter(endpoint =>
+        API_READS[endpoint].some(prefix => underPath(writePath, prefix)));
+    if (!stale.length) return;
+    stale.forEach(endpoint => { generations[endpoint] = (generations[endpoint] || 0) + 1; });
+
+    const cache = await caches.open(API_CACHE);
+    const keys = await cache.keys();
+    await Promise.all(keys
+        .filter(request => stale.some(endpoint => underPath(new URL(request.url).pathname, endpoint)))
+        .map(request => cache.delete(request)));
+}
+
+async function staleWhileRevalidate(event, request, endpoint) {
+    const cache = await caches.open(API_CACHE);
+    const cached = await cache.match(request);
+    const generation = generations[endpoint] || 0;
+    const refresh = fetch(request).then(async (response) => {
+        if (response.ok && (generations[endpoint] || 0) === generation) {
+            await cache.put(request, response.clone());
+        }
+        return response;
+    });
+
+    if (cached) {
+        event.waitUntil(refresh.catch(() => {}));
+        return cached;
+    }
+    return refresh;
+}
+
+async function writeThrough(request) {
+    const response = await fetch(request);
+    if (response.ok) {
+        await invalidate(new URL(request.url).pathname);
+    }
+    return response;
+}
+
+// flushOutbox and OUTBOX_SYNC_TAG: replays writes queued while offline
+importScripts('/storage.js');
+
+// Install service worker and cache the app shell, bypassing the HTTP cache
 self.addEventListener('install', (event) => {
     event.waitUntil(
-        caches.open(CACHE_NAME)
-            .then((cache) => cache.addAll(urlsToCache))
+        caches.open(SHELL_CACHE)
+            .then((cache) => cache.addAll(Object.keys(APP_SHELL).map(url => new Request(url, { cache: 'reload' }))))
     );
 });
 
-// Fetch from cache, fallback to network
 self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/api/')) {
+        if (request.method !== 'GET') {
+            event.respondWith(writeThrough(request));
+            return;
+        }
+        const endpoint = cachedRead(url);
+        if (endpoint) {
+            event.respondWith(staleWhileRevalidate(event, request, endpoint));
+        }
+        // Other reads (meals, events, search, stats) always go to the network
+        return;
+    }
+
+    // App shell: from cache, falling back to network
     event.respondWith(
-        caches.match(event.request)
-            .then((response) => response || fetch(event.request))
+        caches.match(request)
+            .then((response) => response || fetch(request))
     );
 });
 
+// Background Sync: the page registers OUTBOX_SYNC_TAG when writes are queued
+// offline; the browser fires this once it is back online, and again later if
+// the outbox couldn't all be sent
+self.addEventListener('sync', (event) => {
+    if (event.tag === OUTBOX_SYNC_TAG) {
+        event.waitUntil(
+            flushOutbox().then(async (result) => {
+                // Replayed here, these writes didn't pass through the fetch handler
+                await Promise.all(['/api/meals', '/api/events'].map(invalidate));
+                if (result.pending) {
+                    throw new Error('Outbox not fully sent, retrying later');
+                }
+            })
+        );
+    }
+});
+
 // Clean up old caches
 self.addEventListener('activate', (event) => {
     event.waitUntil(
         caches.keys().then((cacheNames) => {
             return Promise.all(
                 cacheNames.map((cacheName) => {
-                    if (cacheName !== CACHE_NAME) {
+                    if (cacheName !== SHELL_CACHE && cacheName !== API_CACHE) {
                         return caches.delete(cacheName);
                     }
                 })